@@ -1,19 +1,80 @@
-from typing import Union, Coroutine
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Coroutine, Dict, Hashable, Iterable, Iterator, Optional, Union
+
+import aiohttp
 import ujson
+from .cache import CamsAPICache
+from .overload import CircuitOpenError
 from .requesters import CamsAPIRequester
+from .requesters.common import AsyncSingleFlight, SingleFlight
 
 from .objects import StreamSessions, StreamSession
 
+log = logging.getLogger(__name__)
+
+
+def _parse_stream(response: str) -> StreamSession:
+    return StreamSession.from_dict(ujson.loads(response))
+
 
 class CamsAPI:
-    def __init__(self, requester: CamsAPIRequester) -> None:
+    def __init__(self, requester: CamsAPIRequester, cache: Optional[CamsAPICache] = None) -> None:
         self.requester = requester
+        self.cache = cache
+        self._single_flight = AsyncSingleFlight() if asyncio.iscoroutinefunction(requester.get) else SingleFlight()
+
+    def _cached(self, endpoint: str, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        if self.cache is None:
+            return fetch()
+        if asyncio.iscoroutinefunction(self.requester.get):
+            return self.cache.aget(endpoint, key, fetch)
+        return self.cache.get(endpoint, key, fetch)
 
     def get_won(self, **kwargs) -> Union[StreamSessions, Coroutine]:
-        return self.requester.get('won',
-                                  cb=lambda resp: StreamSessions.from_dict(ujson.loads(resp)))
+        """WON is streamed with `iter_won`, bypassing the requester's single flight:
+        concurrent calls share one materialised result instead.
+        """
+        if asyncio.iscoroutinefunction(self.requester.get):
+            async def fetch() -> StreamSessions:
+                return StreamSessions(won_stream_names=[stream_name async for stream_name in self.iter_won()])
+        else:
+            def fetch() -> StreamSessions:
+                return StreamSessions(won_stream_names=self.iter_won())
+        return self._cached('won', None, lambda: self._single_flight.do('won', fetch))
+
+    def iter_won(self) -> Union[Iterator[str], AsyncIterator[str]]:
+        """Stream names of WON as they are received, the response is decoded incrementally. Not cached."""
+        return self.requester.iter_json_items('won')
 
     def get_stream(self, stream_name: str) -> Union[StreamSession, Coroutine]:
-        return self.requester.get(f'models/stream/{stream_name.lower()}',
-                                  cb=lambda resp: StreamSession.from_dict(ujson.loads(resp)),
-                                  skip_not_found_logging=True)
+        stream_name = stream_name.lower()
+        return self._cached('stream', stream_name, lambda: self.requester.get(
+            f'models/stream/{stream_name}',
+            cb=_parse_stream,
+            skip_not_found_logging=True))
+
+    async def get_streams(self, stream_names: Iterable[str],
+                          concurrency: int = 10) -> Dict[str, Optional[StreamSession]]:
+        """Fetch many streams at once, at most `concurrency` requests are in flight. Async requester only.
+        Streams which are not online map to None, streams which could not be fetched are left out.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        streams = {}
+
+        async def get_stream(stream_name: str) -> None:
+            async with semaphore:
+                try:
+                    streams[stream_name] = await self.get_stream(stream_name)
+                except aiohttp.ClientResponseError as e:
+                    if e.status == 404:
+                        streams[stream_name] = None
+                    else:
+                        log.error(f'{stream_name}: Cams raised error: {e}')
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+                    log.error(f'{stream_name}: Cams raised error: {e!r}')
+                except CircuitOpenError as e:
+                    log.warning(f'{stream_name}: Cams request skipped: {e}')
+
+        await asyncio.gather(*(get_stream(stream_name) for stream_name in stream_names))
+        return streams
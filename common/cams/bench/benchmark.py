@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence, Tuple
+
+import requests
+import ujson
+
+from common.cams.api import CamsAPI
+from common.cams.cache import is_not_found
+from common.cams.requesters.asyn import CamsAPIAsyncRequester
+from common.cams.requesters.syn import CamsAPISyncRequester
+
+
+class BenchmarkResult(namedtuple('BenchmarkResult',
+                                 'requester, requests, errors, duration, throughput, p50, p99, connections')):
+    __slots__ = ()
+
+    def __str__(self) -> str:
+        reuse = self.requests / self.connections if self.connections else 0
+        return (f'{self.requester}: {self.requests} requests in {self.duration:.2f}s, '
+                f'{self.throughput:.1f} req/s, p50 {self.p50 * 1000:.1f}ms, p99 {self.p99 * 1000:.1f}ms, '
+                f'{self.errors} errors, {self.connections} connections ({reuse:.1f} requests per connection)')
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile, `q` in [0, 100]."""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(q / 100 * len(values))) - 1))]
+
+
+def get_stats(url: str) -> dict:
+    return requests.get(f'{url}/stats').json()
+
+
+def get_stream_names(url: str, count: int) -> List[str]:
+    """`count` stream names of the stand-in server, cycling through its WON."""
+    won = list(ujson.loads(requests.get(f'{url}/won').text))
+    return list(itertools.islice(itertools.cycle(won), count)) if won else []
+
+
+def run_sync(url: str, stream_names: List[str], concurrency: int) -> Tuple[List[float], int]:
+    cams_api = CamsAPI(CamsAPISyncRequester(url, pool_size=concurrency, retries=0))
+
+    def get_stream(stream_name: str) -> Tuple[float, bool]:
+        started = time.perf_counter()
+        try:
+            cams_api.get_stream(stream_name)
+            failed = False
+        except Exception as e:
+            failed = not is_not_found(e)
+        return time.perf_counter() - started, failed
+
+    try:
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(get_stream, stream_names))
+    finally:
+        cams_api.requester.close()
+    return [latency for latency, _ in results], sum(failed for _, failed in results)
+
+
+async def run_async(url: str, stream_names: List[str], concurrency: int) -> Tuple[List[float], int]:
+    semaphore = asyncio.Semaphore(concurrency)
+    async with CamsAPIAsyncRequester(url, limit_per_host=concurrency) as requester:
+        cams_api = CamsAPI(requester)
+
+        async def get_stream(stream_name: str) -> Tuple[float, bool]:
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await cams_api.get_stream(stream_name)
+                    failed = False
+                except Exception as e:
+                    failed = not is_not_found(e)
+                return time.perf_counter() - started, failed
+
+        results = await asyncio.gather(*(get_stream(stream_name) for stream_name in stream_names))
+    return [latency for latency, _ in results], sum(failed for _, failed in results)
+
+
+def benchmark(url: str, requester: str, requests_count: int, concurrency: int) -> BenchmarkResult:
+    """Requests `requests_count` streams of the stand-in server at `url` with `concurrency` requests in flight.
+    Not found streams are not counted as errors.
+    """
+    stream_names = get_stream_names(url, requests_count)
+    connections = get_stats(url)['connections']
+
+    started = time.perf_counter()
+    if requester == 'sync':
+        latencies, errors = run_sync(url, stream_names, concurrency)
+    else:
+        latencies, errors = asyncio.get_event_loop().run_until_complete(run_async(url, stream_names, concurrency))
+    duration = time.perf_counter() - started
+
+    return BenchmarkResult(
+        requester=requester,
+        requests=len(latencies),
+        errors=errors,
+        duration=duration,
+        throughput=len(latencies) / duration if duration else 0,
+        p50=percentile(latencies, 50),
+        p99=percentile(latencies, 99),
+        connections=get_stats(url)['connections'] - connections,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark of the Cams API requesters against the stand-in server, '
+                                                 'see common.cams.bench.server.')
+    parser.add_argument('--url', default='http://127.0.0.1:8765')
+    parser.add_argument('--requester', choices=['sync', 'async', 'both'], default='both')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=10)
+    args = parser.parse_args()
+
+    logging.getLogger('common.cams').setLevel(logging.CRITICAL)  # errors are counted, not logged
+    for requester in ['sync', 'async'] if args.requester == 'both' else [args.requester]:
+        print(benchmark(args.url, requester, args.requests, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
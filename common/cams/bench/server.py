@@ -0,0 +1,97 @@
+import argparse
+import asyncio
+import math
+import random
+from typing import Optional
+
+from aiohttp import web
+
+
+class StandInCamsAPI:
+    """
+    Stand-in of the Cams API endpoints used by `common.cams.api.CamsAPI`: `won` and `models/stream/{name}`.
+
+    Serves `streams` streams named `stream{i}`, `offline_rate` of them are not found. Every response is delayed
+    by a log-normal latency of `latency_median` seconds median and `latency_sigma` spread, `error_rate`
+    of the responses are 503 errors, stream responses are padded to about `payload_size` bytes.
+    `stats` counts the requests and the connections they came over, `GET /stats` returns them.
+    """
+
+    def __init__(self, streams: int = 1000, offline_rate: float = 0, latency_median: float = 0.02,
+                 latency_sigma: float = 0.5, error_rate: float = 0, payload_size: int = 0, edges: int = 10,
+                 seed: Optional[int] = None) -> None:
+        self._random = random.Random(seed)
+        self._latency_median = latency_median
+        self._latency_sigma = latency_sigma
+        self._error_rate = error_rate
+        self._padding = 'x' * payload_size
+        self.stream_names = [f'stream{i}' for i in range(streams)]
+        self._online = {stream_name.lower(): f'edge{i % edges}.cams.test'
+                        for i, stream_name in enumerate(self.stream_names) if self._random.random() >= offline_rate}
+        self._transports = set()
+        self.stats = {'requests': 0, 'connections': 0, 'errors': 0}
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get('/won', self.won)
+        app.router.add_get('/models/stream/{stream_name}', self.stream)
+        app.router.add_get('/stats', self.get_stats)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        if request.path == '/stats':
+            return await handler(request)
+
+        self.stats['requests'] += 1
+        if request.transport not in self._transports:
+            self._transports.add(request.transport)
+            self.stats['connections'] += 1
+
+        if self._latency_median:
+            await asyncio.sleep(self._random.lognormvariate(math.log(self._latency_median), self._latency_sigma))
+        if self._random.random() < self._error_rate:
+            self.stats['errors'] += 1
+            raise web.HTTPServiceUnavailable()
+        return await handler(request)
+
+    async def won(self, request: web.Request) -> web.Response:
+        return web.json_response({stream_name: {'online': '1'} for stream_name in self.stream_names
+                                  if stream_name.lower() in self._online})
+
+    async def stream(self, request: web.Request) -> web.Response:
+        stream_name = request.match_info['stream_name']
+        subdomain = self._online.get(stream_name.lower())
+        if subdomain is None:
+            raise web.HTTPNotFound()
+        return web.json_response({
+            'stream_name': stream_name,
+            'subdomain': subdomain,
+            'online': '1',
+            'padding': self._padding,
+        })
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Stand-in Cams API server for load tests.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--streams', type=int, default=1000)
+    parser.add_argument('--offline-rate', type=float, default=0)
+    parser.add_argument('--latency-median', type=float, default=0.02, help='seconds')
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--payload-size', type=int, default=0, help='bytes of padding of stream responses')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    api = StandInCamsAPI(args.streams, args.offline_rate, args.latency_median, args.latency_sigma,
+                         args.error_rate, args.payload_size, seed=args.seed)
+    web.run_app(api.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
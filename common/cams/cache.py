@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import time
+from collections import namedtuple
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from cachetools import LRUCache
+
+log = logging.getLogger(__name__)
+
+
+def is_not_found(e: Exception) -> bool:
+    """Whether the error is a 404 response of either requester, see `common.cams.requesters`."""
+    status = getattr(e, 'status', None)  # aiohttp.ClientResponseError
+    if status is None:
+        status = getattr(getattr(e, 'response', None), 'status_code', None)  # requests.HTTPError
+    return status == 404
+
+
+class CacheEntry(namedtuple('CacheEntry', 'value, error, fetched_at')):
+    __slots__ = ()
+
+    def unwrap(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class CamsAPICache:
+    """Bounded LRU cache of Cams API responses with a TTL per endpoint.
+
+    Not found (404) responses are cached as well, for `not_found_ttl` seconds, the cached error is raised again.
+    The async path serves values up to `stale_ttls` seconds per endpoint past their TTL while a single background
+    request per key refreshes them (stale-while-revalidate), endpoints without a stale TTL are never served stale.
+    The sync path always waits for a fresh value.
+    """
+
+    def __init__(self, ttls: Dict[str, float], maxsize: int = 10000, not_found_ttl: float = 30,
+                 stale_ttls: Optional[Dict[str, float]] = None, clock: Callable[[], float] = time.monotonic) -> None:
+        self._ttls = ttls
+        self._not_found_ttl = not_found_ttl
+        self._stale_ttls = stale_ttls or {}
+        self._clock = clock
+        self._entries = LRUCache(maxsize)
+        self._revalidating = {}
+
+    def _get_ttl(self, endpoint: str, entry: CacheEntry) -> float:
+        return self._not_found_ttl if entry.error is not None else self._ttls.get(endpoint, 0)
+
+    def _lookup(self, endpoint: str, key: Hashable) -> Optional[CacheEntry]:
+        entry = self._entries.get((endpoint, key))
+        if entry is None:
+            return None
+        if self._clock() - entry.fetched_at > self._get_ttl(endpoint, entry) + self._stale_ttls.get(endpoint, 0):
+            del self._entries[(endpoint, key)]
+            return None
+        return entry
+
+    def _is_fresh(self, endpoint: str, entry: CacheEntry) -> bool:
+        return self._clock() - entry.fetched_at <= self._get_ttl(endpoint, entry)
+
+    def _store(self, endpoint: str, key: Hashable, value: Any = None, error: Optional[Exception] = None) -> None:
+        if self._ttls.get(endpoint):
+            self._entries[(endpoint, key)] = CacheEntry(value=value, error=error, fetched_at=self._clock())
+
+    def get(self, endpoint: str, key: Hashable, fetch: Callable[[], Any]) -> Any:
+        entry = self._lookup(endpoint, key)
+        if entry is not None and self._is_fresh(endpoint, entry):
+            return entry.unwrap()
+
+        try:
+            value = fetch()
+        except Exception as e:
+            if is_not_found(e):
+                self._store(endpoint, key, error=e)
+            raise
+        self._store(endpoint, key, value)
+        return value
+
+    async def aget(self, endpoint: str, key: Hashable, fetch: Callable[[], Awaitable]) -> Any:
+        entry = self._lookup(endpoint, key)
+        if entry is not None:
+            if self._is_fresh(endpoint, entry):
+                return entry.unwrap()
+            if entry.error is None:
+                self._revalidate(endpoint, key, fetch)
+                return entry.value
+
+        return await self._afetch(endpoint, key, fetch)
+
+    async def _afetch(self, endpoint: str, key: Hashable, fetch: Callable[[], Awaitable]) -> Any:
+        try:
+            value = await fetch()
+        except Exception as e:
+            if is_not_found(e):
+                self._store(endpoint, key, error=e)
+            raise
+        self._store(endpoint, key, value)
+        return value
+
+    def _revalidate(self, endpoint: str, key: Hashable, fetch: Callable[[], Awaitable]) -> None:
+        if (endpoint, key) in self._revalidating:
+            return
+
+        def done(task: asyncio.Future) -> None:
+            del self._revalidating[(endpoint, key)]
+            if not task.cancelled() and task.exception() is not None and not is_not_found(task.exception()):
+                log.debug(f'Failed to revalidate {endpoint} {key}: {task.exception()!r}')
+
+        task = asyncio.ensure_future(self._afetch(endpoint, key, fetch))
+        self._revalidating[(endpoint, key)] = task
+        task.add_done_callback(done)
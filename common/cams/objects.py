@@ -1,5 +1,8 @@
+import sys
+from array import array
 from collections import namedtuple
 from enum import Enum
+from typing import Any, FrozenSet, Iterable, Iterator, List, Optional, Tuple, Union
 
 
 class ChatTypeEnum(Enum):
@@ -23,16 +26,83 @@ class StreamSession(namedtuple('StreamingEngineSession',
     def from_dict(d: dict) -> 'StreamSession':
         return StreamSession(
             stream_name=d['stream_name'],
-            subdomain=d['subdomain'],
+            subdomain=sys.intern(d['subdomain']),  # shared by the streams of an edge
             chat_type=ChatTypeEnum(d['online'])
         )
 
+    def to_dict(self) -> dict:
+        return {
+            'stream_name': self.stream_name,
+            'subdomain': self.subdomain,
+            'online': self.chat_type.value,
+        }
 
-class StreamSessions(namedtuple('StreamingEngineSessions', 'won_stream_names')):
-    __slots__ = ()
+
+class StreamSessions:
+    """
+    Sessions of many streams, stored in columns: interned stream names and subdomains, chat types as an array
+    of small ints. WON lists stream names only, `subdomains` and `chat_types` are None until they are known.
+    """
+
+    __slots__ = ('won_stream_names', 'subdomains', '_chat_types', '_names')
+
+    def __init__(self, won_stream_names: Iterable[str] = (), subdomains: Optional[Iterable[str]] = None,
+                 chat_types: Optional[Iterable[ChatTypeEnum]] = None) -> None:
+        self.won_stream_names = [sys.intern(stream_name) for stream_name in won_stream_names]
+        self.subdomains = [sys.intern(subdomain) for subdomain in subdomains] if subdomains is not None else None
+        self._chat_types = array('b', (int(chat_type.value) for chat_type in chat_types)) \
+            if chat_types is not None else None
+        self._names = None
 
     @staticmethod
-    def from_dict(d: dict) -> 'StreamSessions':
-        return StreamSessions(
-            won_stream_names=list(d)
-        )
+    def from_dict(d: Union[list, dict]) -> 'StreamSessions':
+        """From a list of stream names or a dict of sessions by stream name."""
+        if isinstance(d, dict) and d and all('subdomain' in v and 'online' in v for v in d.values()):
+            return StreamSessions.from_sessions(StreamSession(stream_name=stream_name, subdomain=v['subdomain'],
+                                                              chat_type=ChatTypeEnum(v['online']))
+                                                for stream_name, v in d.items())
+        return StreamSessions(won_stream_names=d)
+
+    @staticmethod
+    def from_sessions(sessions: Iterable[StreamSession]) -> 'StreamSessions':
+        sessions = list(sessions)
+        return StreamSessions(won_stream_names=[session.stream_name for session in sessions],
+                              subdomains=[session.subdomain for session in sessions],
+                              chat_types=[session.chat_type for session in sessions])
+
+    @property
+    def chat_types(self) -> Optional[List[ChatTypeEnum]]:
+        return [ChatTypeEnum(str(code)) for code in self._chat_types] if self._chat_types is not None else None
+
+    @property
+    def names(self) -> FrozenSet[str]:
+        if self._names is None:
+            self._names = frozenset(self.won_stream_names)
+        return self._names
+
+    def sessions(self) -> Iterator[StreamSession]:
+        if self.subdomains is None:
+            raise ValueError('Sessions are not known, only stream names are')
+        for stream_name, subdomain, code in zip(self.won_stream_names, self.subdomains, self._chat_types):
+            yield StreamSession(stream_name=stream_name, subdomain=subdomain, chat_type=ChatTypeEnum(str(code)))
+
+    def diff(self, previous: 'StreamSessions') -> Tuple[List[str], List[str]]:
+        """Stream names which joined since `previous`, in WON order, and stream names which left."""
+        names, previous_names = self.names, previous.names
+        return ([stream_name for stream_name in self.won_stream_names if stream_name not in previous_names],
+                [stream_name for stream_name in previous.won_stream_names if stream_name not in names])
+
+    def __len__(self) -> int:
+        return len(self.won_stream_names)
+
+    def __contains__(self, stream_name: str) -> bool:
+        return stream_name in self.names
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, StreamSessions):
+            return NotImplemented
+        return (self.won_stream_names, self.subdomains, self._chat_types) == \
+            (other.won_stream_names, other.subdomains, other._chat_types)
+
+    def __repr__(self) -> str:
+        return f'StreamSessions({len(self)} streams)'
@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def is_available(status: int) -> bool:
+    """Whether a response status tells the API copes with the load, client errors and 404 do."""
+    return status < 500 and status != 429
+
+
+class CircuitBreaker:
+    """
+    Fails requests fast while the API is down.
+
+    Closed: requests pass, `failure_threshold` consecutive failures open the circuit.
+    Open: requests raise CircuitOpenError for `reset_timeout` seconds.
+    Half open: a single probe request passes, it closes the circuit on success and opens it again on failure.
+
+    Thread safe, one breaker can be shared by the sync and the async requester of a process.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._probing or self._clock() - self._opened_at >= self._reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def check(self) -> None:
+        """Raises CircuitOpenError if the request must not be made, every passed request must be `record`ed."""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            raise CircuitOpenError(f'Circuit is {state}, {self._failures} consecutive failures')
+
+    def record(self, success: Optional[bool]) -> None:
+        """Records the outcome of a request, None if it tells nothing about the API (e.g. it was cancelled)."""
+        with self._lock:
+            if success is None:
+                self._probing = False
+            elif success:
+                self._failures, self._opened_at, self._probing = 0, None, False
+            else:
+                self._failures += 1
+                if self._probing or self._failures >= self._failure_threshold:
+                    self._opened_at, self._probing = self._clock(), False
+
+
+class AIMDLimit:
+    """
+    Concurrency limit adapted to the API health: additive increase, by 1 per `limit` successful requests,
+    multiplicative decrease, by `backoff` on a failure. Failures of requests started before the last decrease
+    do not decrease it again, a burst of failures halves the limit once.
+    """
+
+    def __init__(self, initial_limit: int = 10, min_limit: int = 1, max_limit: int = 100,
+                 backoff: float = 0.5) -> None:
+        self._limit = float(initial_limit)
+        self._min_limit = min_limit
+        self._max_limit = max_limit
+        self._backoff = backoff
+        self._generation = 0
+        self.in_flight = 0
+
+    @property
+    def limit(self) -> int:
+        return max(self._min_limit, int(self._limit))
+
+    def _update(self, generation: int, success: Optional[bool]) -> None:
+        self.in_flight -= 1
+        if success:
+            self._limit = min(self._max_limit, self._limit + 1 / self._limit)
+        elif success is not None and generation == self._generation:
+            self._limit = max(self._min_limit, self._limit * self._backoff)
+            self._generation += 1
+
+
+class AdaptiveLimiter(AIMDLimit):
+    """Thread version of the limiter. `acquire` blocks until a slot is free, its result is passed to `release`."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._condition = threading.Condition()
+
+    def acquire(self) -> int:
+        with self._condition:
+            self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            return self._generation
+
+    def release(self, generation: int, success: Optional[bool]) -> None:
+        with self._condition:
+            self._update(generation, success)
+            self._condition.notify_all()
+
+
+class AsyncAdaptiveLimiter(AIMDLimit):
+    """AsyncIO version of `AdaptiveLimiter`, waiters are served first come, first served."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._waiters = deque()
+
+    async def acquire(self) -> int:
+        while self.in_flight >= self.limit:
+            waiter = asyncio.get_event_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._wake()  # woken up and cancelled at once, hand the slot over
+                raise
+        self.in_flight += 1
+        return self._generation
+
+    def release(self, generation: int, success: Optional[bool]) -> None:
+        self._update(generation, success)
+        self._wake()
+
+    def _wake(self) -> None:
+        free = self.limit - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
@@ -1,9 +1,16 @@
+import asyncio
 import logging
-from typing import Any, Callable, Optional
+import time
+from typing import Any, AsyncIterator, Callable, Optional, Tuple
 
 import aiohttp
 
-from .common import CamsAPIRequester, maybe_json
+from common.json_streaming import JsonItemsDecoder
+
+from ..overload import AsyncAdaptiveLimiter, CircuitBreaker, is_available
+
+from .common import (AsyncSingleFlight, CamsAPIRequester, Instrumentation, RequestMetrics, get_debug_data,
+                     get_request_key)
 
 log = logging.getLogger(__name__)
 
@@ -11,93 +18,167 @@ log = logging.getLogger(__name__)
 class CamsAPIAsyncRequester(CamsAPIRequester):
     """
     AsyncIO version of requester
+
+    All requests share one session, so connections, DNS lookups and TLS sessions are reused: at most `limit`
+    connections are open, `limit_per_host` of them to the same host, idle ones are kept for `keepalive_timeout`
+    seconds. The session is created on first use and must be closed with `close` or by using the requester
+    as an async context manager.
+    Requests time out after `connect_timeout` seconds of connecting and `read_timeout` seconds of waiting for data.
+    With a `breaker` and a `limiter` requests fail fast with CircuitOpenError while the API is down and their
+    concurrency adapts to its health, see `common.cams.overload`.
+    Identical GET requests in flight at the same time are coalesced into one: callers with the same `cb` and
+    keyword arguments share the value `cb` returned, so `cb` should be a function rather than a fresh lambda,
+    and the callers must not mutate the value.
+    Every request is reported to `instrumentation`, see `common.cams.requesters.common.Instrumentation`.
     """
 
+    def __init__(self, url: str, limit: int = 100, limit_per_host: int = 20, ttl_dns_cache: int = 300,
+                 keepalive_timeout: float = 30, connect_timeout: float = 3.05, read_timeout: float = 10,
+                 instrumentation: Optional[Instrumentation] = None, breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[AsyncAdaptiveLimiter] = None) -> None:
+        super().__init__(url, instrumentation, breaker, limiter)
+        self._timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self._connector_kwargs = {
+            'limit': limit,
+            'limit_per_host': limit_per_host,
+            'ttl_dns_cache': ttl_dns_cache,
+            'keepalive_timeout': keepalive_timeout,
+        }
+        self._session = None
+        self._loop = None
+        self._single_flight = AsyncSingleFlight()
+
+    async def __aenter__(self) -> 'CamsAPIAsyncRequester':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    async def _acquire(self) -> Optional[int]:
+        return await self.limiter.acquire() if self.limiter is not None else None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_event_loop()
+        # a session is bound to the loop it was created in, the one of another loop is closed, not leaked
+        if self._session is not None and self._loop is not loop:
+            session, self._session = self._session, None
+            if not self._loop.is_closed():
+                await session.close()
+            else:
+                try:
+                    session.connector._close()
+                except RuntimeError:  # its transports can not schedule their callbacks on the closed loop anymore
+                    pass
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(**self._connector_kwargs),
+                                                  timeout=self._timeout)
+            self._loop = loop
+        return self._session
+
     async def get(self, uri: str, *, cb: Callable, query: Optional[dict] = None, raw: bool = False,
                   error_log_level: int = logging.ERROR, skip_not_found_logging: bool = False, **kwargs) -> Any:
-        debug_data = {}
-        async with aiohttp.ClientSession() as session:
-            try:
-                debug_data['request'] = {
-                    'url': f'{self.url}/{uri}',
-                    'query': dict(query) if query is not None else None,
-                }
-
-                result = await session.get(f'{self.url}/{uri}', params=query)
-                response = await (result.read() if raw else result.text())
-
-                debug_data['response'] = {
-                    'status': f'{result.status} {result.reason}',
-                    'value': maybe_json(response),
-                    'headers': dict(result.headers),
-                }
-
-            finally:
-                log.debug(f'GET request to {self.url}/{uri}.', extra={'data': debug_data})
-
-            if result.status == 404 and skip_not_found_logging:
-                result.raise_for_status()
-
+        async def call() -> Tuple[aiohttp.ClientResponse, Callable[[], dict], Any, Optional[Exception]]:
+            result, response, debug_data = await self._request('GET', uri, raw, params=query)
             try:
                 result.raise_for_status()
-                return cb(response, **kwargs)
+                return result, debug_data, cb(response, **kwargs), None
             except Exception as e:
-                log.log(error_log_level, f'Failed GET request to {self.url}/{uri}.',
-                        extra={'data': debug_data}, exc_info=e)
-                raise
+                return result, debug_data, None, e
+
+        result, debug_data, value, error = await self._single_flight.do(
+            (get_request_key(uri, query, raw), cb, tuple(sorted(kwargs.items()))), call)
+        if error is None:
+            return value
+
+        if not (result.status == 404 and skip_not_found_logging):
+            log.log(error_log_level, f'Failed GET request to {self.url}/{uri}.',
+                    extra={'data': debug_data()}, exc_info=error)
+        raise error
+
+    async def iter_json_items(self, uri: str, *, query: Optional[dict] = None, chunk_size: int = 64 * 1024,
+                              error_log_level: int = logging.ERROR) -> AsyncIterator[Any]:
+        """Yields the items of the JSON array (or the keys of the JSON object) response as they are received."""
+        url = f'{self.url}/{uri}'
+        status = reason = headers = success = None
+        generation = self._check_circuit(await self._acquire())
+        started = time.monotonic()
+        try:
+            async with (await self._get_session()).get(url, params=query) as result:
+                status, reason, headers = result.status, result.reason, result.headers
+                success = is_available(status)
+                result.raise_for_status()
+                decoder = JsonItemsDecoder()
+                async for chunk in result.content.iter_chunked(chunk_size):
+                    for item in decoder.feed(chunk):
+                        yield item
+                decoder.close()
+        except (GeneratorExit, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)) and not isinstance(
+                    e, aiohttp.ClientResponseError):
+                success = False
+            log.log(error_log_level, f'Failed GET request to {url}.',
+                    extra={'data': get_debug_data(url, query, status, reason, headers, None)}, exc_info=e)
+            raise
+        finally:
+            self._record(generation, success)
+            self.instrumentation.on_request(log, RequestMetrics('GET', url, status, time.monotonic() - started),
+                                            lambda: get_debug_data(url, query, status, reason, headers, None))
 
     async def post(self, uri: str, *, cb: Callable, json: Optional[dict] = None, raw: bool = False,
                    error_log_level: int = logging.ERROR, **kwargs) -> Any:
-        debug_data = {}
-        async with aiohttp.ClientSession() as session:
-            try:
-                debug_data['request'] = {
-                    'url': f'{self.url}/{uri}',
-                    'query': dict(json) if json is not None else None,
-                }
-
-                result = await session.post(f'{self.url}/{uri}', json=json)
-                response = await (result.read() if raw else result.text())
-
-                debug_data['response'] = {
-                    'status': f'{result.status} {result.reason}',
-                    'value': maybe_json(response),
-                    'headers': dict(result.headers),
-                }
+        result, response, debug_data = await self._request('POST', uri, raw, json=json)
 
-            finally:
-                log.debug(f'POST request to {self.url}/{uri}.', extra={'data': debug_data})
-
-            try:
-                result.raise_for_status()
-                return cb(response, **kwargs)
-            except Exception as e:
-                log.log(error_log_level, f'Failed POST request to {self.url}/{uri}.',
-                        extra={'data': debug_data}, exc_info=e)
-                raise
+        try:
+            result.raise_for_status()
+            return cb(response, **kwargs)
+        except Exception as e:
+            log.log(error_log_level, f'Failed POST request to {self.url}/{uri}.',
+                    extra={'data': debug_data()}, exc_info=e)
+            raise
 
     async def delete(self, uri: str, *, cb: Callable, error_log_level: int = logging.ERROR, **kwargs) -> Any:
-        debug_data = {}
-        async with aiohttp.ClientSession() as session:
-            try:
-                debug_data['request'] = {'url': f'{self.url}/{uri}'}
-
-                result = await session.delete(f'{self.url}/{uri}')
-                response = await result.text()
-
-                debug_data['response'] = {
-                    'status': f'{result.status} {result.reason}',
-                    'value': maybe_json(response),
-                    'headers': dict(result.headers),
-                }
-
-            finally:
-                log.debug(f'DELETE request to {self.url}/{uri}.', extra={'data': debug_data})
-
-            try:
-                result.raise_for_status()
-                return cb(response, **kwargs)
-            except Exception as e:
-                log.log(error_log_level, f'Failed DELETE request to {self.url}/{uri}.',
-                        extra={'data': debug_data}, exc_info=e)
-                raise
+        result, response, debug_data = await self._request('DELETE', uri)
+
+        try:
+            result.raise_for_status()
+            return cb(response, **kwargs)
+        except Exception as e:
+            log.log(error_log_level, f'Failed DELETE request to {self.url}/{uri}.',
+                    extra={'data': debug_data()}, exc_info=e)
+            raise
+
+    async def _request(self, method: str, uri: str, raw: bool = False, *, params: Optional[dict] = None,
+                       json: Optional[dict] = None) -> Tuple[aiohttp.ClientResponse, Any, Callable[[], dict]]:
+        url = f'{self.url}/{uri}'
+        result = response = success = None
+        generation = self._check_circuit(await self._acquire())
+        started = time.monotonic()
+        try:
+            session = await self._get_session()
+            async with session.request(method, url, params=params, json=json) as result:
+                success = is_available(result.status)
+                response = await (result.read() if raw else result.text())
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            success = False
+            raise
+        finally:
+            self._record(generation, success)
+            status = result.status if result is not None else None
+
+            def debug_data() -> dict:
+                return get_debug_data(url, params if json is None else json, status,
+                                      result.reason if result is not None else None,
+                                      result.headers if result is not None else None, response)
+
+            self.instrumentation.on_request(log, RequestMetrics(method, url, status, time.monotonic() - started),
+                                            debug_data)
+
+        return result, response, debug_data
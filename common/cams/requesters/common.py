@@ -1,8 +1,15 @@
 import abc
-from typing import Any, Callable, Optional
+import asyncio
+import logging
+import random
+import threading
+from collections import namedtuple
+from typing import Any, Awaitable, Callable, Hashable, Mapping, Optional
 
 import ujson
 
+from ..overload import AIMDLimit, CircuitBreaker, CircuitOpenError
+
 
 def maybe_json(text: str) -> Any:
     try:
@@ -11,14 +18,144 @@ def maybe_json(text: str) -> Any:
         return text
 
 
+def get_debug_data(url: str, query: Optional[dict], status: Optional[int], reason: Optional[str],
+                   headers: Optional[Mapping], response: Any) -> dict:
+    debug_data = {'request': {'url': url, 'query': dict(query) if query is not None else None}}
+    if status is not None:
+        debug_data['response'] = {
+            'status': f'{status} {reason}',
+            'value': maybe_json(response),
+            'headers': dict(headers),
+        }
+    return debug_data
+
+
+RequestMetrics = namedtuple('RequestMetrics', 'method, url, status, duration')
+
+
+class Instrumentation:
+    """Hook called by the requesters after every request.
+
+    `metrics` gets a `RequestMetrics` of every request, `status` is None when no response was received.
+    The debug payload (request, parsed response and headers) is built only when debug logging is enabled
+    and the request is sampled with `debug_sample_rate` probability.
+    """
+
+    def __init__(self, metrics: Optional[Callable[[RequestMetrics], None]] = None, debug_sample_rate: float = 1,
+                 sample: Callable[[], float] = random.random) -> None:
+        self._metrics = metrics
+        self._debug_sample_rate = debug_sample_rate
+        self._sample = sample
+
+    def on_request(self, logger: logging.Logger, metrics: RequestMetrics, debug_data: Callable[[], dict]) -> None:
+        if self._metrics is not None:
+            try:
+                self._metrics(metrics)
+            except Exception as e:
+                logger.warning(f'Failed to record metrics of {metrics.method} request to {metrics.url}.', exc_info=e)
+
+        if logger.isEnabledFor(logging.DEBUG) and self._sample() < self._debug_sample_rate:
+            logger.debug(f'{metrics.method} request to {metrics.url}.', extra={'data': debug_data()})
+
+
+def get_request_key(uri: str, query: Optional[dict], raw: bool) -> Hashable:
+    return uri, tuple(sorted(query.items())) if query else None, raw
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent identical calls across threads: while a call for a key is running,
+    other callers with the same key wait for it and share its result or exception.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if leader:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    del self._flights[key]
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+
+class AsyncSingleFlight:
+    """AsyncIO version of `SingleFlight`. Cancelling a waiter does not cancel the shared call."""
+
+    def __init__(self) -> None:
+        self._flights = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]) -> Any:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = asyncio.ensure_future(fn())
+
+            def done(_: asyncio.Future) -> None:
+                del self._flights[key]
+                if not flight.cancelled():
+                    flight.exception()  # retrieved, even if every waiter was cancelled meanwhile
+
+            flight.add_done_callback(done)
+        return await asyncio.shield(flight)
+
+
 class CamsAPIRequester(abc.ABC):
-    def __init__(self, url: str) -> None:
+    def __init__(self, url: str, instrumentation: Optional[Instrumentation] = None,
+                 breaker: Optional[CircuitBreaker] = None, limiter: Optional[AIMDLimit] = None) -> None:
         self.url = url
+        self.instrumentation = instrumentation or Instrumentation()
+        self.breaker = breaker
+        self.limiter = limiter
+
+    def _check_circuit(self, generation: Optional[int]) -> Optional[int]:
+        try:
+            if self.breaker is not None:
+                self.breaker.check()
+        except CircuitOpenError:
+            if self.limiter is not None:
+                self.limiter.release(generation, None)
+            raise
+        return generation
+
+    def _record(self, generation: Optional[int], success: Optional[bool]) -> None:
+        if self.limiter is not None:
+            self.limiter.release(generation, success)
+        if self.breaker is not None:
+            self.breaker.record(success)
 
     @abc.abstractmethod
     def get(self, uri: str, *, cb: Callable, query: Optional[dict] = None, raw: bool = False, **kwargs) -> Any:
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def iter_json_items(self, uri: str, *, query: Optional[dict] = None, **kwargs) -> Any:
+        raise NotImplementedError
+
     @abc.abstractmethod
     def post(self, uri: str, *, cb: Callable, json: Optional[dict] = None, raw: bool = False, **kwargs) -> Any:
         raise NotImplementedError
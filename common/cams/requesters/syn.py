@@ -1,9 +1,17 @@
 import logging
-from typing import Any, Callable, Optional
+import time
+from typing import Any, Callable, Iterator, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from .common import CamsAPIRequester, maybe_json
+from common.json_streaming import JsonItemsDecoder
+
+from ..overload import AdaptiveLimiter, CircuitBreaker, is_available
+
+from .common import (CamsAPIRequester, Instrumentation, RequestMetrics, SingleFlight, get_debug_data,
+                     get_request_key)
 
 log = logging.getLogger(__name__)
 
@@ -11,89 +19,135 @@ log = logging.getLogger(__name__)
 class CamsAPISyncRequester(CamsAPIRequester):
     """
     Sync version of requester
-    """
 
-    def get(self, uri: str, *, cb: Callable, query: Optional[dict] = None, raw: bool = False,
-            error_log_level: int = logging.ERROR, skip_not_found_logging: bool = False, **kwargs) -> Any:
-        debug_data = {}
-        try:
-            debug_data['request'] = {
-                'url': f'{self.url}/{uri}',
-                'query': dict(query) if query is not None else None,
-            }
+    Connections are kept alive and reused from a pool of `pool_size` per host. Idempotent requests are retried
+    on connection errors and on 502/503/504 up to `retries` times, sleeping `backoff_factor * 2 ** (n - 1)` seconds.
+    Requests time out after `connect_timeout` seconds of connecting and `read_timeout` seconds of waiting for data.
+    With a `breaker` and a `limiter` requests fail fast with CircuitOpenError while the API is down and their
+    concurrency adapts to its health, see `common.cams.overload`.
+    Identical GET requests of concurrent threads are coalesced into one: callers with the same `cb` and keyword
+    arguments share the value `cb` returned, so `cb` should be a function rather than a fresh lambda, and the callers
+    must not mutate the value.
+    Every request is reported to `instrumentation`, see `common.cams.requesters.common.Instrumentation`.
+    """
 
-            result = requests.get(f'{self.url}/{uri}', params=query)
-            response = result.content if raw else result.text
+    RETRY_STATUSES = (502, 503, 504)
 
-            debug_data['response'] = {
-                'status': f'{result.status_code} {result.reason}',
-                'value': maybe_json(response),
-                'headers': dict(result.headers),
-            }
+    def __init__(self, url: str, pool_size: int = 10, retries: int = 3, backoff_factor: float = 0.3,
+                 connect_timeout: float = 3.05, read_timeout: float = 10,
+                 instrumentation: Optional[Instrumentation] = None, breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[AdaptiveLimiter] = None) -> None:
+        super().__init__(url, instrumentation, breaker, limiter)
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=self.RETRY_STATUSES,
+                      raise_on_status=False)  # the last response is returned, raise_for_status reports it
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._single_flight = SingleFlight()
 
-        finally:
-            log.debug(f'GET request to {self.url}/{uri}.', extra={'data': debug_data})
+    def close(self) -> None:
+        self.session.close()
 
-        if result.status_code == 404 and skip_not_found_logging:
-            result.raise_for_status()
+    def _acquire(self) -> Optional[int]:
+        return self.limiter.acquire() if self.limiter is not None else None
 
+    def get(self, uri: str, *, cb: Callable, query: Optional[dict] = None, raw: bool = False,
+            error_log_level: int = logging.ERROR, skip_not_found_logging: bool = False, **kwargs) -> Any:
+        def call() -> Tuple[requests.Response, Callable[[], dict], Any, Optional[Exception]]:
+            result, response, debug_data = self._request('GET', uri, raw, params=query)
+            try:
+                result.raise_for_status()
+                return result, debug_data, cb(response, **kwargs), None
+            except Exception as e:
+                return result, debug_data, None, e
+
+        result, debug_data, value, error = self._single_flight.do(
+            (get_request_key(uri, query, raw), cb, tuple(sorted(kwargs.items()))), call)
+        if error is None:
+            return value
+
+        if not (result.status_code == 404 and skip_not_found_logging):
+            log.log(error_log_level, f'Failed GET request to {self.url}/{uri}.',
+                    extra={'data': debug_data()}, exc_info=error)
+        raise error
+
+    def iter_json_items(self, uri: str, *, query: Optional[dict] = None, chunk_size: int = 64 * 1024,
+                        error_log_level: int = logging.ERROR) -> Iterator[Any]:
+        """Yields the items of the JSON array (or the keys of the JSON object) response as they are received."""
+        url = f'{self.url}/{uri}'
+        status = reason = headers = success = None
+        generation = self._check_circuit(self._acquire())
+        started = time.monotonic()
         try:
-            result.raise_for_status()
-            return cb(response, **kwargs)
+            with self.session.get(url, params=query, stream=True, timeout=self.timeout) as result:
+                status, reason, headers = result.status_code, result.reason, result.headers
+                success = is_available(status)
+                result.raise_for_status()
+                decoder = JsonItemsDecoder()
+                for chunk in result.iter_content(chunk_size):
+                    yield from decoder.feed(chunk)
+                decoder.close()
+        except GeneratorExit:
+            raise
         except Exception as e:
-            log.log(error_log_level, f'Failed GET request to {self.url}/{uri}.', extra={'data': debug_data}, exc_info=e)
+            if isinstance(e, requests.RequestException) and not isinstance(e, requests.HTTPError):
+                success = False
+            log.log(error_log_level, f'Failed GET request to {url}.',
+                    extra={'data': get_debug_data(url, query, status, reason, headers, None)}, exc_info=e)
             raise
+        finally:
+            self._record(generation, success)
+            self.instrumentation.on_request(log, RequestMetrics('GET', url, status, time.monotonic() - started),
+                                            lambda: get_debug_data(url, query, status, reason, headers, None))
 
     def post(self, uri: str, *, cb: Callable, json: Optional[dict] = None, raw: bool = False,
              error_log_level: int = logging.ERROR, **kwargs) -> Any:
-        debug_data = {}
-        try:
-            debug_data['request'] = {
-                'url': f'{self.url}/{uri}',
-                'query': dict(json) if json is not None else None,
-            }
-
-            result = requests.post(f'{self.url}/{uri}', json=json)
-            response = result.content if raw else result.text
-
-            debug_data['response'] = {
-                'status': f'{result.status_code} {result.reason}',
-                'value': maybe_json(response),
-                'headers': dict(result.headers),
-            }
-
-        finally:
-            log.debug(f'POST request to {self.url}/{uri}.', extra={'data': debug_data})
+        result, response, debug_data = self._request('POST', uri, raw, json=json)
 
         try:
             result.raise_for_status()
             return cb(response, **kwargs)
         except Exception as e:
             log.log(error_log_level, f'Failed POST request to {self.url}/{uri}.',
-                    extra={'data': debug_data}, exc_info=e)
+                    extra={'data': debug_data()}, exc_info=e)
             raise
 
     def delete(self, uri: str, *, cb: Callable, error_log_level: int = logging.ERROR, **kwargs) -> Any:
-        debug_data = {}
-        try:
-            debug_data['request'] = {'url': f'{self.url}/{uri}'}
-
-            result = requests.delete(f'{self.url}/{uri}')
-            response = result.text
-
-            debug_data['response'] = {
-                'status': f'{result.status_code} {result.reason}',
-                'value': maybe_json(response),
-                'headers': dict(result.headers),
-            }
-
-        finally:
-            log.debug(f'DELETE request to {self.url}/{uri}.', extra={'data': debug_data})
+        result, response, debug_data = self._request('DELETE', uri)
 
         try:
             result.raise_for_status()
             return cb(response, **kwargs)
         except Exception as e:
             log.log(error_log_level, f'Failed DELETE request to {self.url}/{uri}.',
-                    extra={'data': debug_data}, exc_info=e)
+                    extra={'data': debug_data()}, exc_info=e)
             raise
+
+    def _request(self, method: str, uri: str, raw: bool = False, *, params: Optional[dict] = None,
+                 json: Optional[dict] = None) -> Tuple[requests.Response, Any, Callable[[], dict]]:
+        url = f'{self.url}/{uri}'
+        result = response = success = None
+        generation = self._check_circuit(self._acquire())
+        started = time.monotonic()
+        try:
+            result = self.session.request(method, url, params=params, json=json, timeout=self.timeout)
+            success = is_available(result.status_code)
+            response = result.content if raw else result.text
+        except requests.RequestException:
+            success = False
+            raise
+        finally:
+            self._record(generation, success)
+            status = result.status_code if result is not None else None
+
+            def debug_data() -> dict:
+                return get_debug_data(url, params if json is None else json, status,
+                                      result.reason if result is not None else None,
+                                      result.headers if result is not None else None, response)
+
+            self.instrumentation.on_request(log, RequestMetrics(method, url, status, time.monotonic() - started),
+                                            debug_data)
+
+        return result, response, debug_data
@@ -0,0 +1,102 @@
+import re
+from typing import Any, List
+
+import ujson
+
+# structural bytes outside and inside of a string, UTF-8 multibyte sequences never contain ASCII bytes
+_STRUCTURAL = re.compile(rb'["\[\]{},]')
+_STRING = re.compile(rb'["\\]')
+
+
+class JsonItemsDecoder:
+    """
+    Incremental decoder of the items of a top level JSON array, or the keys of a top level JSON object,
+    fed with chunks of raw bytes as they are received.
+
+    Only the current item is buffered and decoded, the document is never held in memory as a whole.
+
+    Examples:
+        decoder = JsonItemsDecoder()
+        decoder.feed(b'["anna", "bel')  -> ['anna']
+        decoder.feed(b'la"]')           -> ['bella']
+        decoder.close()
+
+        b'{"anna": {...}, "bella": {...}}' -> ['anna', 'bella']
+    """
+
+    def __init__(self) -> None:
+        self._buffer = b''
+        self._pos = 0  # next byte to scan
+        self._item_start = None  # start of the current item, None until the container is opened
+        self._key_end = None  # end of the key of the current object item
+        self._container = None
+        self._depth = 0
+        self._in_string = False
+        self._count = 0
+        self.done = False
+
+    def feed(self, data: bytes) -> List[Any]:
+        """Returns the items completed by `data`. Raises ValueError on malformed documents."""
+        if self.done:
+            return []
+
+        self._buffer += data
+        items = []
+        while not self.done:
+            match = (_STRING if self._in_string else _STRUCTURAL).search(self._buffer, self._pos)
+            if match is None:
+                break
+            self._pos = match.end()
+            char = match.group()
+
+            if char == b'\\':
+                self._pos += 1  # skip the escaped byte, it may be in the next chunk
+            elif char == b'"':
+                self._in_string = not self._in_string
+                if not self._in_string and self._depth == 1 and self._container == b'{' and self._key_end is None:
+                    self._key_end = self._pos
+            elif char in b'[{':
+                if self._depth == 0:
+                    if self._buffer[:match.start()].strip():
+                        raise ValueError('JSON document is not an array nor an object')
+                    self._container, self._item_start = char, self._pos
+                self._depth += 1
+            elif self._depth == 0:
+                raise ValueError(f'Unexpected {char!r} in JSON document')
+            elif char == b',':
+                if self._depth == 1:
+                    items.append(self._decode_item(match.start()))
+                    self._item_start, self._key_end = self._pos, None
+            else:  # closing bracket
+                self._depth -= 1
+                if self._depth == 0:
+                    if self._buffer[self._item_start:match.start()].strip():
+                        items.append(self._decode_item(match.start()))
+                    elif self._count:
+                        raise ValueError('Trailing comma in JSON document')
+                    self.done = True
+
+        self._trim()
+        return items
+
+    def close(self) -> None:
+        """Raises ValueError if the document is incomplete."""
+        if not self.done:
+            raise ValueError('Incomplete JSON document')
+
+    def _decode_item(self, end: int) -> Any:
+        self._count += 1
+        if self._container == b'{':
+            if self._key_end is None:
+                raise ValueError('Malformed JSON object')
+            return ujson.loads(self._buffer[self._item_start:self._key_end])
+        return ujson.loads(self._buffer[self._item_start:end])
+
+    def _trim(self) -> None:
+        start = self._item_start if self._item_start is not None else 0
+        if start:
+            self._buffer = self._buffer[start:]
+            self._pos -= start
+            self._item_start = 0 if self._item_start is not None else None
+            if self._key_end is not None:
+                self._key_end -= start
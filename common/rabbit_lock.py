@@ -2,7 +2,7 @@ import asyncio
 import logging
 import sys
 from contextlib import wraps
-from typing import Callable
+from typing import Awaitable, Callable, List, Set
 
 import aio_pika
 import aiormq
@@ -12,9 +12,10 @@ from common.background_tasks import BackgroundTasks
 from common.config import config
 
 if sys.version_info[:2] > (3, 6):
-    from contextlib import AsyncExitStack
+    from contextlib import AsyncExitStack, asynccontextmanager
 else:
     from async_exit_stack import AsyncExitStack
+    from async_generator import asynccontextmanager
 
 try:
     from contextlib import AsyncContextDecorator
@@ -48,6 +49,43 @@ class LockHandoverError(LockPostAcquisitionError):
     pass
 
 
+class ConnectionPool:
+    """At most `max_size` broker connections, made by `connect`, each lent to one `RabbitLock` at a time.
+    A connection which comes back closed, e.g. by a lock which could not delete its queue, is dropped, not reused.
+    """
+
+    def __init__(self, connect: Callable[[], Awaitable[aio_pika.Connection]], max_size: int) -> None:
+        self._connect = connect
+        self._semaphore = asyncio.Semaphore(max_size)
+        self._idle = []  # type: List[aio_pika.Connection]
+        self._connections = set()  # type: Set[aio_pika.Connection]
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._semaphore:
+            connection = None
+            while self._idle and connection is None:
+                connection = self._idle.pop()
+                if connection.is_closed:
+                    self._connections.discard(connection)
+                    connection = None
+            if connection is None:
+                connection = await self._connect()
+                self._connections.add(connection)
+
+            try:
+                yield connection
+            finally:
+                if connection.is_closed:
+                    self._connections.discard(connection)
+                else:
+                    self._idle.append(connection)
+
+    async def close(self) -> None:
+        connections, self._connections, self._idle = self._connections, set(), []
+        await asyncio.gather(*(connection.close() for connection in connections), return_exceptions=True)
+
+
 class RabbitLock(AsyncContextDecorator):
     QUEUE_NAME_TEMPLATE = 'rabbit_lock_handover_bus_{}'
 
@@ -91,6 +129,8 @@ class RabbitLock(AsyncContextDecorator):
             self._channel = await self._connection.channel()
 
             await self._acquire()
+            if self._connection_pool is not None:
+                stack.push_async_callback(self._delete_queue)
 
             self._background_tasks = await stack.enter_async_context(BackgroundTasks())
             if self._handover:
@@ -113,13 +153,29 @@ class RabbitLock(AsyncContextDecorator):
 
         finally:
             # CDBCT-2644 Try to fix "queue.declare caused a channel exception resource_locked".
-            await self._connection.close()
+            if self._connection_pool is None:
+                await self._connection.close()
             self._connection = None
 
             self._channel = None
             self._queue = None
             self._background_tasks = None
 
+    async def _delete_queue(self) -> None:
+        # while its queue exists the lock is held, and a pooled connection outlives the lock: if the queue can not be
+        # deleted, the connection is closed instead, so the pool drops it and the broker deletes the queue
+        try:
+            if self._channel and not self._channel.is_closed:
+                await self._queue.delete(if_unused=False, if_empty=False)
+                return
+            log.warning('%r: channel closed before the queue was deleted, closing the connection.', self)
+        except asyncio.CancelledError:
+            await self._connection.close()
+            raise
+        except Exception:
+            log.warning('%r: deleting the queue failed, closing the connection.', self, exc_info=True)
+        await self._connection.close()
+
     async def _send_handover(self) -> None:
         log.debug('Sending handover request(id=%s) to queue "%s".', id(self), self._queue_name)
         await self._channel.default_exchange.publish(
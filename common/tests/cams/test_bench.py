@@ -0,0 +1,46 @@
+import unittest
+
+import asynctest
+from aiohttp.test_utils import TestClient, TestServer
+
+from common.cams.bench.benchmark import percentile, run_async
+from common.cams.bench.server import StandInCamsAPI
+
+
+class TestPercentile(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(100, 0, -1))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([], 50), 0)
+
+
+class TestStandInCamsAPI(asynctest.TestCase):
+    async def setUp(self) -> None:
+        self.api = StandInCamsAPI(streams=10, offline_rate=0.5, latency_median=0, payload_size=100, seed=1)
+        self.client = TestClient(TestServer(self.api.make_app()))
+        await self.client.start_server()
+
+    async def tearDown(self) -> None:
+        await self.client.close()
+
+    async def test_endpoints(self):
+        won = await (await self.client.get('/won')).json()
+        self.assertTrue(0 < len(won) < 10)
+
+        online, offline = next(iter(won)), next(name for name in self.api.stream_names if name not in won)
+        stream = await (await self.client.get(f'/models/stream/{online}')).json()
+        self.assertEqual(stream['stream_name'], online)
+        self.assertEqual(len(stream['padding']), 100)
+        self.assertEqual((await self.client.get(f'/models/stream/{offline}')).status, 404)
+
+        self.assertEqual(await (await self.client.get('/stats')).json(),
+                         {'requests': 3, 'connections': 1, 'errors': 0})
+
+    async def test_run_async(self):
+        latencies, errors = await run_async(str(self.client.make_url('')).rstrip('/'), self.api.stream_names * 2, 4)
+
+        self.assertEqual(len(latencies), 20)
+        self.assertEqual(errors, 0)  # not found streams are not errors
+        self.assertLessEqual(self.api.stats['connections'], 4)
@@ -0,0 +1,80 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import asynctest
+import requests
+
+from common.cams.cache import CamsAPICache
+
+
+def not_found() -> requests.HTTPError:
+    return requests.HTTPError(response=mock.Mock(status_code=404))
+
+
+class TestCamsAPICache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0
+        self.cache = CamsAPICache({'stream': 10}, maxsize=2, not_found_ttl=5, clock=lambda: self.now)
+
+    def test_ttl(self):
+        fetch = mock.Mock(side_effect=['a', 'b'])
+        self.assertEqual(self.cache.get('stream', 'anna', fetch), 'a')
+        self.now = 10
+        self.assertEqual(self.cache.get('stream', 'anna', fetch), 'a')
+        self.now = 11
+        self.assertEqual(self.cache.get('stream', 'anna', fetch), 'b')
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_not_found(self):
+        fetch = mock.Mock(side_effect=[not_found(), 'a'])
+        for _ in range(2):
+            with self.assertRaises(requests.HTTPError):
+                self.cache.get('stream', 'anna', fetch)
+        self.now = 6
+        self.assertEqual(self.cache.get('stream', 'anna', fetch), 'a')
+
+    def test_errors_are_not_cached(self):
+        fetch = mock.Mock(side_effect=[requests.ConnectionError(), 'a'])
+        with self.assertRaises(requests.ConnectionError):
+            self.cache.get('stream', 'anna', fetch)
+        self.assertEqual(self.cache.get('stream', 'anna', fetch), 'a')
+
+    def test_lru_and_uncached_endpoints(self):
+        for name in ['anna', 'bella', 'carla']:
+            self.cache.get('stream', name, lambda: name)
+        self.assertEqual(self.cache.get('stream', 'anna', lambda: 'new'), 'new')
+        self.assertEqual(self.cache.get('stream', 'carla', lambda: 'new'), 'carla')
+
+        self.cache.get('won', None, lambda: 'a')
+        self.assertEqual(self.cache.get('won', None, lambda: 'b'), 'b')
+
+
+class TestCamsAPICacheAsync(asynctest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0
+        self.cache = CamsAPICache({'won': 10, 'stream': 10}, stale_ttls={'won': 20, 'stream': 0},
+                                  clock=lambda: self.now)
+
+    async def test_stale_while_revalidate(self):
+        fetch = asynctest.CoroutineMock(side_effect=['a', 'b', 'c'])
+        self.assertEqual(await self.cache.aget('won', None, fetch), 'a')
+
+        self.now = 15
+        self.assertEqual(await self.cache.aget('won', None, fetch), 'a')
+        self.assertEqual(await self.cache.aget('won', None, fetch), 'a')
+        await asyncio.sleep(0)
+        self.assertEqual(fetch.call_count, 2)
+        self.assertEqual(await self.cache.aget('won', None, fetch), 'b')
+
+        # too stale to be served
+        self.now = 100
+        self.assertEqual(await self.cache.aget('won', None, fetch), 'c')
+
+    async def test_expired_stream_is_refetched(self):
+        fetch = asynctest.CoroutineMock(side_effect=['free', 'private'])
+        self.assertEqual(await self.cache.aget('stream', 'anna', fetch), 'free')
+
+        self.now = 11
+        self.assertEqual(await self.cache.aget('stream', 'anna', fetch), 'private')
+        self.assertEqual(fetch.call_count, 2)
@@ -0,0 +1,118 @@
+import asyncio
+import unittest
+
+import asynctest
+import requests
+import responses
+
+from common.cams.overload import (AIMDLimit, AdaptiveLimiter, AsyncAdaptiveLimiter, CircuitBreaker,
+                                  CircuitOpenError)
+from common.cams.requesters.syn import CamsAPISyncRequester
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0
+        self.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=lambda: self.now)
+
+    def fail(self) -> None:
+        self.breaker.check()
+        self.breaker.record(False)
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail()
+        self.breaker.record(True)
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check()
+
+    def test_half_open_probe(self):
+        self.fail()
+        self.fail()
+        self.now = 10
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.fail()  # the probe failed
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check()
+
+        self.now = 20
+        self.breaker.check()
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check()  # a single probe at once
+        self.breaker.record(None)
+        self.breaker.check()
+        self.breaker.record(True)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+class TestAIMDLimit(unittest.TestCase):
+    def test_update(self):
+        limit = AIMDLimit(initial_limit=4, min_limit=1, max_limit=5)
+        generation = limit._generation
+        for _ in range(5):
+            limit._update(generation, True)
+        self.assertEqual(limit.limit, 5)
+
+        limit._update(generation, False)
+        limit._update(generation, False)  # started before the decrease
+        self.assertEqual(limit.limit, 2)
+        limit._update(limit._generation, False)
+        limit._update(limit._generation, False)
+        self.assertEqual(limit.limit, 1)
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    def test_acquire(self):
+        limiter = AdaptiveLimiter(initial_limit=1)
+        generation = limiter.acquire()
+        self.assertEqual(limiter.in_flight, 1)
+        limiter.release(generation, None)
+        limiter.release(limiter.acquire(), True)
+        self.assertEqual(limiter.in_flight, 0)
+
+
+class TestAsyncAdaptiveLimiter(asynctest.TestCase):
+    async def test_waiters(self):
+        limiter = AsyncAdaptiveLimiter(initial_limit=2, max_limit=2)
+        generations = [await limiter.acquire(), await limiter.acquire()]
+        waiters = [asyncio.ensure_future(limiter.acquire()) for _ in range(2)]
+        await asyncio.sleep(0)
+        self.assertFalse(any(waiter.done() for waiter in waiters))
+
+        limiter.release(generations[0], False)  # limit is halved, the slot is not handed over
+        await asyncio.sleep(0)
+        self.assertFalse(any(waiter.done() for waiter in waiters))
+
+        waiters[0].cancel()
+        limiter.release(generations[1], None)
+        await asyncio.wait_for(waiters[1], 1)
+        self.assertEqual(limiter.in_flight, 1)
+
+
+class TestCamsAPISyncRequesterOverload(unittest.TestCase):
+    def setUp(self) -> None:
+        self.requester = CamsAPISyncRequester('https://cams.test.com', retries=0,
+                                              breaker=CircuitBreaker(failure_threshold=2),
+                                              limiter=AdaptiveLimiter(initial_limit=4))
+
+    def tearDown(self) -> None:
+        self.requester.close()
+
+    @responses.activate
+    def test_fails_fast(self):
+        responses.add(responses.GET, 'https://cams.test.com/models/stream/anna', status=404)
+        responses.add(responses.GET, 'https://cams.test.com/won', status=500)
+
+        # not found is a success
+        for uri in ['models/stream/anna', 'won', 'won']:
+            with self.assertRaises(requests.HTTPError):
+                self.requester.get(uri, cb=lambda resp: resp)
+        with self.assertRaises(CircuitOpenError):
+            self.requester.get('models/stream/anna', cb=lambda resp: resp)
+
+        self.assertEqual(len(responses.calls), 3)
+        self.assertEqual(self.requester.limiter.in_flight, 0)
+        self.assertEqual(self.requester.limiter.limit, 1)
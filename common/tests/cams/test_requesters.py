@@ -0,0 +1,91 @@
+import logging
+import unittest
+from unittest import mock
+
+import requests
+import responses
+from parameterized import parameterized
+
+from common.cams.api import CamsAPI
+from common.cams.objects import StreamSessions
+from common.cams.requesters.common import Instrumentation, RequestMetrics
+from common.cams.requesters.syn import CamsAPISyncRequester
+
+
+class TestCamsAPISyncRequester(unittest.TestCase):
+    def setUp(self) -> None:
+        self.requester = CamsAPISyncRequester('https://cams.test.com', pool_size=4, retries=2, backoff_factor=0)
+
+    def tearDown(self) -> None:
+        self.requester.close()
+
+    def test_adapter(self):
+        adapter = self.requester.session.get_adapter('https://cams.test.com/won')
+        self.assertEqual(adapter._pool_maxsize, 4)
+        self.assertEqual(adapter.max_retries.total, 2)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        self.assertNotIn('POST', adapter.max_retries.method_whitelist)
+
+    @responses.activate
+    def test_get(self):
+        responses.add(responses.GET, 'https://cams.test.com/won', json=['anna'], status=200)
+        responses.add(responses.GET, 'https://cams.test.com/models/stream/bella', status=404)
+
+        self.assertEqual(self.requester.get('won', cb=lambda resp: resp), '["anna"]')
+        with self.assertRaises(requests.HTTPError):
+            self.requester.get('models/stream/bella', cb=lambda resp: resp, skip_not_found_logging=True)
+
+    @responses.activate
+    def test_instrumentation(self):
+        responses.add(responses.GET, 'https://cams.test.com/won', json=['anna'], status=200)
+        self.requester.instrumentation = mock.Mock()
+
+        self.requester.get('won', cb=lambda resp: resp)
+        with self.assertRaises(requests.ConnectionError):
+            self.requester.delete('won', cb=lambda resp: resp)
+
+        (_, metrics, debug_data), _ = self.requester.instrumentation.on_request.call_args_list[0]
+        self.assertEqual(metrics[:3], ('GET', 'https://cams.test.com/won', 200))
+        self.assertEqual(debug_data()['response']['value'], ['anna'])
+        (_, metrics, debug_data), _ = self.requester.instrumentation.on_request.call_args_list[1]
+        self.assertEqual(metrics[:3], ('DELETE', 'https://cams.test.com/won', None))
+        self.assertNotIn('response', debug_data())
+
+    @responses.activate
+    def test_get_won(self):
+        responses.add(responses.GET, 'https://cams.test.com/won', body=b'["anna", "bella"]', status=200)
+        responses.add(responses.GET, 'https://cams.test.com/won', status=503)
+        cams_api = CamsAPI(self.requester)
+
+        self.assertEqual(cams_api.get_won(), StreamSessions(won_stream_names=['anna', 'bella']))
+        with self.assertRaises(requests.HTTPError):
+            list(cams_api.iter_won())
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self) -> None:
+        self.logger = mock.Mock(spec=logging.Logger)
+        self.debug_data = mock.Mock(return_value={})
+        self.metrics = RequestMetrics('GET', 'https://cams.test.com/won', 200, 0.1)
+
+    def test_debug_data_is_lazy(self):
+        record = mock.Mock()
+        self.logger.isEnabledFor.return_value = False
+        Instrumentation(record).on_request(self.logger, self.metrics, self.debug_data)
+
+        record.assert_called_once_with(self.metrics)
+        self.debug_data.assert_not_called()
+        self.logger.debug.assert_not_called()
+
+    @parameterized.expand([(0.3, True), (0.7, False)])
+    def test_sampling(self, sample, logged):
+        self.logger.isEnabledFor.return_value = True
+        instrumentation = Instrumentation(debug_sample_rate=0.5, sample=lambda: sample)
+        instrumentation.on_request(self.logger, self.metrics, self.debug_data)
+        self.assertEqual(self.logger.debug.called, logged)
+        self.assertEqual(self.debug_data.called, logged)
+
+    def test_metrics_errors_are_logged(self):
+        self.logger.isEnabledFor.return_value = False
+        Instrumentation(mock.Mock(side_effect=ValueError)).on_request(self.logger, self.metrics, self.debug_data)
+        self.logger.warning.assert_called_once()
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import asynctest
+from aioresponses import aioresponses
+
+from common.cams.api import CamsAPI
+from common.cams.objects import ChatTypeEnum, StreamSession, StreamSessions
+from common.cams.requesters.asyn import CamsAPIAsyncRequester
+from common.cams.requesters.common import AsyncSingleFlight, SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_are_coalesced(self):
+        single_flight, release = SingleFlight(), threading.Event()
+        fn = mock.Mock(side_effect=lambda: release.wait() and 'a')
+
+        with ThreadPoolExecutor(4) as executor:
+            futures = [executor.submit(single_flight.do, 'key', fn) for _ in range(4)]
+            while fn.call_count == 0:
+                release.wait(0.01)
+            release.set()
+            self.assertEqual([future.result() for future in futures], ['a'] * 4)
+
+        self.assertLess(fn.call_count, 4)
+        self.assertEqual(single_flight.do('key', lambda: 'b'), 'b')
+
+    def test_error_is_shared(self):
+        with self.assertRaises(ValueError):
+            SingleFlight().do('key', mock.Mock(side_effect=ValueError))
+
+
+class TestAsyncSingleFlight(asynctest.TestCase):
+    async def test_cancelled_waiter_does_not_cancel_call(self):
+        single_flight = AsyncSingleFlight()
+        fn = asynctest.CoroutineMock(side_effect=lambda: asyncio.sleep(0.01, result='a'))
+
+        waiter = asyncio.ensure_future(single_flight.do('key', fn))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        self.assertEqual(await single_flight.do('key', fn), 'a')
+        self.assertEqual(fn.call_count, 1)
+
+    async def test_requester_coalesces_gets(self):
+        cb = mock.Mock(side_effect=lambda resp: [resp])
+        async with CamsAPIAsyncRequester('http://cams.test.com') as requester:
+            with aioresponses() as m:
+                # registered once, a second request would fail
+                m.get('http://cams.test.com/won', payload=['anna'])
+                results = await asyncio.gather(requester.get('won', cb=cb), requester.get('won', cb=cb))
+
+        self.assertEqual(results, [['["anna"]']] * 2)
+        self.assertIs(results[0], results[1])
+        cb.assert_called_once_with('["anna"]')
+
+    async def test_requester_coalesces_gets_per_callback(self):
+        async with CamsAPIAsyncRequester('http://cams.test.com') as requester:
+            with aioresponses() as m:
+                m.get('http://cams.test.com/won', payload=['anna'])
+                m.get('http://cams.test.com/won', payload=['anna'])
+                results = await asyncio.gather(requester.get('won', cb=str.lower), requester.get('won', cb=str.upper))
+
+        self.assertEqual(results, ['["anna"]', '["ANNA"]'])
+
+    async def test_get_stream_coalesces_parsing(self):
+        async with CamsAPIAsyncRequester('http://cams.test.com') as requester:
+            cams_api = CamsAPI(requester)
+            with aioresponses() as m:
+                m.get('http://cams.test.com/models/stream/anna',
+                      payload=StreamSession('anna', 'edge1.cams.test', ChatTypeEnum.FREE).to_dict())
+                results = await asyncio.gather(cams_api.get_stream('anna'), cams_api.get_stream('Anna'))
+
+        self.assertIs(results[0], results[1])
+
+    async def test_get_won_coalesces_requests(self):
+        async with CamsAPIAsyncRequester('http://cams.test.com') as requester:
+            cams_api = CamsAPI(requester)
+            with aioresponses() as m:
+                # registered once, a second request would fail
+                m.get('http://cams.test.com/won', body=b'["anna", "bella"]')
+                results = await asyncio.gather(cams_api.get_won(), cams_api.get_won())
+
+        self.assertEqual(results, [StreamSessions(won_stream_names=['anna', 'bella'])] * 2)
+        self.assertIs(results[0], results[1])
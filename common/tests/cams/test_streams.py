@@ -0,0 +1,122 @@
+import asyncio
+import unittest
+
+import asynctest
+from aioresponses import aioresponses
+
+from common.cams.api import CamsAPI
+from common.cams.objects import ChatTypeEnum, StreamSession, StreamSessions
+from common.cams.requesters.asyn import CamsAPIAsyncRequester
+
+
+class TestGetStreams(asynctest.TestCase):
+    def setUp(self) -> None:
+        self.cams_api = CamsAPI(CamsAPIAsyncRequester('http://cams.test.com'))
+
+    async def tearDown(self) -> None:
+        await self.cams_api.requester.close()
+
+    async def test_get_streams(self):
+        with aioresponses() as m:
+            m.get('http://cams.test.com/models/stream/anna',
+                  payload={'stream_name': 'Anna', 'subdomain': 'edge1', 'online': '1'})
+            m.get('http://cams.test.com/models/stream/bella', status=404)
+            m.get('http://cams.test.com/models/stream/carla', status=500)
+
+            streams = await self.cams_api.get_streams(['Anna', 'Bella', 'Carla'], concurrency=2)
+
+        self.assertEqual(streams, {
+            'Anna': StreamSession(stream_name='Anna', subdomain='edge1', chat_type=ChatTypeEnum.FREE),
+            'Bella': None,
+        })
+
+    async def test_iter_won(self):
+        with aioresponses() as m:
+            m.get('http://cams.test.com/won', body=b'{"anna": {}, "bella": {}}')
+            m.get('http://cams.test.com/won', body=b'["anna", "bella", "carla"]')
+
+            self.assertEqual([stream_name async for stream_name in self.cams_api.iter_won()], ['anna', 'bella'])
+            self.assertEqual(await self.cams_api.get_won(),
+                             StreamSessions(won_stream_names=['anna', 'bella', 'carla']))
+
+
+class TestStreamSession(asynctest.TestCase):
+    def test_to_dict(self):
+        stream = StreamSession(stream_name='Anna', subdomain='edge1', chat_type=ChatTypeEnum.TIPPING)
+        self.assertEqual(StreamSession.from_dict(stream.to_dict()), stream)
+
+
+class TestCamsAPIAsyncRequester(asynctest.TestCase):
+    async def test_session_is_shared(self):
+        async with CamsAPIAsyncRequester('http://cams.test.com') as requester:
+            with aioresponses() as m:
+                m.get('http://cams.test.com/won', payload=['anna'])
+                m.get('http://cams.test.com/won', payload=['bella'])
+
+                self.assertEqual(await requester.get('won', cb=lambda resp: resp), '["anna"]')
+                session = requester._session
+                self.assertEqual(await requester.get('won', cb=lambda resp: resp), '["bella"]')
+                self.assertIs(requester._session, session)
+
+        self.assertTrue(session.closed)
+        self.assertIsNone(requester._session)
+
+
+class TestCamsAPIAsyncRequesterLoops(unittest.TestCase):
+    def setUp(self) -> None:
+        self.requester = CamsAPIAsyncRequester('http://cams.test.com')
+        self.loops = [asyncio.new_event_loop() for _ in range(2)]
+        for loop in self.loops:
+            self.addCleanup(loop.close)
+
+    def test_session_of_another_loop_is_closed(self):
+        first = self.loops[0].run_until_complete(self.requester._get_session())
+        second = self.loops[1].run_until_complete(self.requester._get_session())
+
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.loops[1].run_until_complete(self.requester.close())
+        self.assertTrue(second.closed)
+
+    def test_session_of_closed_loop_is_closed(self):
+        first = self.loops[0].run_until_complete(self.requester._get_session())
+        self.loops[0].close()
+        second = self.loops[1].run_until_complete(self.requester._get_session())
+
+        self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.loops[1].run_until_complete(self.requester.close())
+
+
+class TestStreamSessions(asynctest.TestCase):
+    def test_from_dict(self):
+        self.assertEqual(StreamSessions.from_dict(['anna', 'bella']).won_stream_names, ['anna', 'bella'])
+        self.assertEqual(StreamSessions.from_dict({'anna': {}, 'bella': {}}).won_stream_names, ['anna', 'bella'])
+
+        sessions = StreamSessions.from_dict({
+            'anna': {'subdomain': 'edge1', 'online': '1'},
+            'bella': {'subdomain': 'edge1', 'online': '6'},
+        })
+        self.assertEqual(list(sessions.sessions()), [
+            StreamSession(stream_name='anna', subdomain='edge1', chat_type=ChatTypeEnum.FREE),
+            StreamSession(stream_name='bella', subdomain='edge1', chat_type=ChatTypeEnum.TIPPING),
+        ])
+        self.assertEqual(sessions.chat_types, [ChatTypeEnum.FREE, ChatTypeEnum.TIPPING])
+        with self.assertRaises(ValueError):
+            list(StreamSessions(won_stream_names=['anna']).sessions())
+
+    def test_strings_are_interned(self):
+        sessions = StreamSessions.from_sessions(
+            StreamSession(stream_name=name, subdomain=''.join(['edge', '1']), chat_type=ChatTypeEnum.FREE)
+            for name in ['anna', 'bella'])
+        self.assertIs(sessions.subdomains[0], sessions.subdomains[1])
+        self.assertIs(sessions.won_stream_names[0], 'anna')
+
+    def test_diff(self):
+        previous = StreamSessions(won_stream_names=['anna', 'bella', 'carla'])
+        current = StreamSessions(won_stream_names=['dana', 'carla', 'anna', 'emma'])
+
+        self.assertEqual(current.diff(previous), (['dana', 'emma'], ['bella']))
+        self.assertEqual(current.diff(current), ([], []))
+        self.assertIn('dana', current)
+        self.assertEqual(len(current), 4)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import ujson
+from parameterized import parameterized
+
+from common.json_streaming import JsonItemsDecoder
+
+
+def decode(data: bytes, chunk_size: int) -> list:
+    decoder, items = JsonItemsDecoder(), []
+    for pos in range(0, len(data), chunk_size):
+        items += decoder.feed(data[pos:pos + chunk_size])
+    decoder.close()
+    return items
+
+
+class TestJsonItemsDecoder(unittest.TestCase):
+
+    @parameterized.expand([(1,), (3,), (1024,)])
+    def test_array(self, chunk_size):
+        items = ['anna', 'be"l\\la', 'çarla', {'a': [1, ',]}'], 'b': None}, [], 1.5]
+        data = ujson.dumps(items, ensure_ascii=False).encode()
+        self.assertEqual(decode(b' \n' + data + b'\n', chunk_size), items)
+
+    @parameterized.expand([(1,), (1024,)])
+    def test_object_keys(self, chunk_size):
+        data = b'{"anna": {"online": "1"}, "b\\u00e9lla": ["}", 1]}'
+        self.assertEqual(decode(data, chunk_size), ['anna', 'bélla'])
+
+    @parameterized.expand([(b'[]',), (b'{}',)])
+    def test_empty(self, data):
+        self.assertEqual(decode(data, 1), [])
+
+    def test_items_are_yielded_as_they_arrive(self):
+        decoder = JsonItemsDecoder()
+        self.assertEqual(decoder.feed(b'["anna", "bel'), ['anna'])
+        self.assertEqual(decoder.feed(b'la", "carla"'), ['bella'])
+        self.assertEqual(decoder.feed(b']'), ['carla'])
+        self.assertTrue(decoder.done)
+
+    @parameterized.expand([(b'["anna",]',), (b'"anna"',), (b'["anna"',), (b'["anna" "bella"]',), (b'{"anna": 1,}',)])
+    def test_malformed(self, data):
+        with self.assertRaises(ValueError):
+            decode(data, 1)
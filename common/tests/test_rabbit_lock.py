@@ -0,0 +1,116 @@
+import asyncio
+
+import aiormq
+import asynctest
+
+from common.rabbit_lock import ConnectionPool, RabbitLock
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.is_closed = False
+        self.channels = []
+
+    async def channel(self):
+        channel = asynctest.MagicMock(is_closed=False)
+        channel.declare_queue = asynctest.CoroutineMock()
+        channel.declare_queue.return_value.delete = asynctest.CoroutineMock()
+        channel.close = asynctest.CoroutineMock()
+        self.channels.append(channel)
+        return channel
+
+    async def close(self) -> None:
+        self.is_closed = True
+
+
+class TestConnectionPool(asynctest.TestCase):
+
+    def setUp(self) -> None:
+        self.connections = []
+        self.pool = ConnectionPool(self.connect, max_size=2)
+
+    async def connect(self) -> FakeConnection:
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+    async def test_reuses_connections(self):
+        async with self.pool.acquire() as first, self.pool.acquire() as second:
+            self.assertIsNot(first, second)
+        async with self.pool.acquire() as third:
+            self.assertIn(third, (first, second))
+        self.assertEqual(len(self.connections), 2)
+
+    async def test_bounded(self):
+        async with self.pool.acquire(), self.pool.acquire():
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(self.pool.acquire().__aenter__(), 0.1)
+
+    async def test_drops_closed_connections(self):
+        async with self.pool.acquire() as connection:
+            await connection.close()
+        async with self.pool.acquire() as other:
+            self.assertIsNot(other, connection)
+
+    async def test_close(self):
+        async with self.pool.acquire(), self.pool.acquire():
+            pass
+        await self.pool.close()
+        self.assertTrue(all(connection.is_closed for connection in self.connections))
+
+
+class TestPooledRabbitLock(asynctest.TestCase):
+
+    def setUp(self) -> None:
+        self.connections = []
+        self.pool = ConnectionPool(self.connect, max_size=1)
+
+    async def connect(self) -> FakeConnection:
+        connection = FakeConnection()
+        self.connections.append(connection)
+        return connection
+
+    def queue(self, connection: FakeConnection):
+        return connection.channels[-1].declare_queue.return_value
+
+    async def test_deletes_queue_and_keeps_connection(self):
+        async with RabbitLock('test', timeout=0, handover=False, connection_pool=self.pool):
+            pass
+        connection, = self.connections
+        self.queue(connection).delete.assert_called_once_with(if_unused=False, if_empty=False)
+        self.assertFalse(connection.is_closed)
+
+        async with RabbitLock('test', timeout=0, handover=False, connection_pool=self.pool):
+            pass
+        self.assertEqual(self.connections, [connection])
+
+    async def release_failing(self, error: BaseException) -> FakeConnection:
+        lock = RabbitLock('test', timeout=0, handover=False, connection_pool=self.pool)
+        await lock.__aenter__()
+        connection = self.connections[-1]
+        self.queue(connection).delete.side_effect = error
+        try:
+            await lock.__aexit__(None, None, None)
+        finally:
+            # the queue dies with the connection, the pool does not lend it out again
+            self.assertTrue(connection.is_closed)
+            async with self.pool.acquire() as other:
+                self.assertIsNot(other, connection)
+        return connection
+
+    async def test_closes_connection_if_queue_delete_fails(self):
+        await self.release_failing(aiormq.exceptions.ChannelInvalidStateError('closed'))
+
+    async def test_closes_connection_if_queue_delete_is_cancelled(self):
+        with self.assertRaises(asyncio.CancelledError):
+            await self.release_failing(asyncio.CancelledError())
+
+    async def test_closes_connection_if_channel_closed(self):
+        lock = RabbitLock('test', timeout=0, handover=False, connection_pool=self.pool)
+        await lock.__aenter__()
+        connection, = self.connections
+        connection.channels[-1].is_closed = True
+        await lock.__aexit__(None, None, None)
+
+        self.queue(connection).delete.assert_not_called()
+        self.assertTrue(connection.is_closed)
@@ -0,0 +1,13 @@
+// Storage is sharded by the md5 of the lowercase stream name, see tasks.tasks._get_shard_directory:
+// /storage/videos/preview/mp4/anna.mp4 is served from /var/storage/videos/preview/mp4/a7/0f/anna.mp4
+var crypto = require('crypto');
+
+function path(r) {
+    var fileName = r.uri.substring(r.uri.lastIndexOf('/') + 1);
+    var dot = fileName.lastIndexOf('.');
+    var streamName = (dot > 0 ? fileName.substring(0, dot) : fileName).toLowerCase();
+    var digest = crypto.createHash('md5').update(streamName).digest('hex');
+    return digest.substring(0, 2) + '/' + digest.substring(2, 4);
+}
+
+export default {path};
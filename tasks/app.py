@@ -13,9 +13,9 @@ log.info('Starting with config parameters.', extra={'data': config_as_dict(confi
 
 
 CELERYBEAT_SCHEDULE = {
-    'make_all_preview_videos': {
-        'task': 'tasks.tasks.make_all_preview_videos',
-        'schedule': config.PREVIEW_VIDEO_UPDATE_PERIOD
+    'schedule_preview_videos': {
+        'task': 'tasks.tasks.schedule_preview_videos',
+        'schedule': config.PREVIEW_VIDEO_SCHEDULE_PERIOD
     },
     'cleanup_preview_videos': {
         'task': 'tasks.tasks.cleanup_preview_videos',
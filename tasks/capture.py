@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+from collections import namedtuple
+from typing import Awaitable, Callable, Iterable, List, Optional
+
+from common.background_tasks import BackgroundTasks
+from tasks.edge import EdgeLimiter
+from tasks.supervisor import ProcessSupervisor
+
+log = logging.getLogger(__name__)
+
+
+class CaptureMetrics(namedtuple('CaptureMetrics', 'frames, duration, size, bit_rate, avg_frame_rate')):
+    __slots__ = ()
+
+    @staticmethod
+    def from_progress(progress: dict) -> Optional['CaptureMetrics']:
+        """Build metrics from the last block of ffmpeg `-progress` output.
+        `out_time_ms` is in microseconds despite its name, newer ffmpeg versions also report it as `out_time_us`.
+        `frame` is not reported for stream copies by newer ffmpeg versions, frame based metrics are None then.
+        """
+        try:
+            size = int(progress['total_size'])
+            duration = int(progress['out_time_us'] if 'out_time_us' in progress else progress['out_time_ms']) / 1000000
+            frames = int(progress['frame']) if 'frame' in progress else None
+        except (KeyError, ValueError):
+            return None
+
+        if duration <= 0:
+            return None
+
+        return CaptureMetrics(
+            frames=frames,
+            duration=duration,
+            size=size,
+            bit_rate=int(size * 8 / duration),
+            avg_frame_rate=frames / duration if frames is not None else None,
+        )
+
+
+class CaptureResult(namedtuple('CaptureResult', 'process, progress')):
+    __slots__ = ()
+
+    @property
+    def returncode(self) -> int:
+        return self.process.returncode
+
+    @property
+    def metrics(self) -> Optional[CaptureMetrics]:
+        return CaptureMetrics.from_progress(self.progress)
+
+
+class CaptureEngine:
+    """Runs many ffmpeg captures concurrently inside one event loop.
+
+    At most `concurrency` ffmpeg processes are in flight at any moment, the rest of the jobs wait
+    for a free slot. Every capture is killed if it does not finish within `timeout` seconds.
+    Captures pulling from an edge server take the edge's slot first, see `tasks.edge.EdgeLimiter`:
+    a capture to a full edge is skipped with EdgeBusyError after a short bounded retry,
+    so it holds up the captures to idle edges for at most the limiter's `wait_timeout`.
+    """
+
+    def __init__(self, concurrency: int, timeout: float, supervisor: Optional[ProcessSupervisor] = None,
+                 edge_limiter: Optional[EdgeLimiter] = None) -> None:
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._semaphore = asyncio.BoundedSemaphore(concurrency)
+        self._supervisor = supervisor or ProcessSupervisor()
+        self._edge_limiter = edge_limiter
+
+    async def capture(self, args: List[str], name: str, edge: Optional[str] = None) -> CaptureResult:
+        """Run ffmpeg and collect `key=value` lines it writes to stdout, i.e. `-progress pipe:1` output.
+        `edge` is the server the input is pulled from, if any.
+        """
+        if edge is not None and self._edge_limiter is not None:
+            async with self._edge_limiter.slot(edge):
+                return await self._capture(args, name)
+        return await self._capture(args, name)
+
+    async def _capture(self, args: List[str], name: str) -> CaptureResult:
+        async with self._semaphore:
+            log.info(f'{name}: ffmpeg_cmd: {" ".join(args)}')
+            progress = {}
+
+            def on_output(line: str) -> None:
+                key, sep, value = line.strip().partition('=')
+                if sep:
+                    progress[key] = value
+
+            process = await self._supervisor.run(args, self._timeout, on_output=on_output)
+            if process.timed_out:
+                log.warning(f'{name}: capture did not finish within {self._timeout}s and was killed.')
+            log.info(f'{name}: capture process finished', extra={'data': process._asdict()})
+            return CaptureResult(process=process, progress=progress)
+
+    async def run(self, jobs: Iterable[Callable[[], Awaitable]]) -> None:
+        """Run all the jobs, keeping the number of concurrently running ones within the limit.
+        The jobs are expected to handle their own errors, anything they raise aborts the whole run.
+        """
+        queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+
+        if queue.empty():
+            return
+
+        async with BackgroundTasks() as workers:
+            for _ in range(min(self._concurrency, queue.qsize())):
+                workers.add(self._worker(queue))
+            await workers.start()
+            await queue.join()
+
+    @staticmethod
+    async def _worker(queue: asyncio.Queue) -> None:
+        while True:
+            job = await queue.get()
+            await job()
+            # not in `finally`: a failed job must not release `queue.join()` before its error reaches `run`
+            queue.task_done()
@@ -21,18 +21,72 @@ AREDIS_BUS = 'aredis.StrictRedisCluster'  # 'aredis.StrictRedis'
 
 AMQP_URL = 'amqp://guest:{}@127.0.0.1:5672'
 AMQP_PASSWORD = 'guest'
+# stream online/offline events, see tasks.events
+STREAM_EVENTS_EXCHANGE = 'cams.streams'
+STREAM_EVENTS_QUEUE = 'thumbnail.stream_events'
+STREAM_EVENTS_ROUTING_KEYS = ['stream.*']
 
 CELERY_BROKER_BUS = 'AMQP_BROKER'  # 'REDIS_BROKER'
 CELERY_BACKEND_BUS = 'AMQP_BACKEND'  # 'REDIS_BACKEND'
 
 CAMS_URL = 'https://beta-api.cams.com'
+# seconds Cams responses are cached for, 0 disables caching of the endpoint
+CAMS_CACHE_WON_TTL = 30
+CAMS_CACHE_STREAM_TTL = 30  # short: a stream switching to a private show must not be captured for long
+CAMS_CACHE_NOT_FOUND_TTL = 30
+# async lookups serve values that long past their TTL while refreshing them, never a stale chat type of a stream
+CAMS_CACHE_WON_STALE_TTL = 30
+CAMS_CACHE_STREAM_STALE_TTL = 0
+CAMS_CACHE_SIZE = 10000
+CAMS_CONNECT_TIMEOUT = 3.05
+CAMS_READ_TIMEOUT = 10
+# consecutive failed Cams requests after which requests fail fast for CAMS_BREAKER_RESET_TIMEOUT seconds
+CAMS_BREAKER_FAILURE_THRESHOLD = 5
+CAMS_BREAKER_RESET_TIMEOUT = 30
+CAMS_DEBUG_SAMPLE_RATE = 0.01  # share of Cams requests logged with their payload when debug logging is enabled
 PREVIEW_VIDEO_UPDATE_PERIOD = 60 * 30
 PREVIEW_VIDEO_STORAGE_PATH = '/var/storage/videos/preview/mp4'
-PREVIEW_VIDEO_TASK_CHUNK_SIZE = 10
-PREVIEW_VIDEO_TASK_COUNTDOWN_MULTIPLIER = 3
+PREVIEW_VIDEO_DURATION = 10  # seconds
+PREVIEW_VIDEO_TASK_CHUNK_SIZE = 20  # streams per make_preview_videos task
+PREVIEW_VIDEO_CAPTURE_CONCURRENCY = 20  # ffmpeg captures in flight per worker process
+PREVIEW_VIDEO_CAPTURE_TIMEOUT = 30  # seconds
+PREVIEW_VIDEO_STREAM_FETCH_CONCURRENCY = 10  # Cams requests in flight when fetching sessions of many streams
+# the scheduler dispatches the stalest previews every period, at the rate the workers can sustain:
+# roughly worker count * PREVIEW_VIDEO_CAPTURE_CONCURRENCY / seconds per capture
+PREVIEW_VIDEO_SCHEDULE_PERIOD = 60
+PREVIEW_VIDEO_CAPTURE_RATE = 2.0  # captures per second
+PREVIEW_VIDEO_MIN_AGE = 60 * 5  # previews younger than that and streams dispatched within that are not dispatched
+PREVIEW_VIDEO_RETIRE_DEPARTED = True  # unpublish previews of streams as soon as they leave WON
+PREVIEW_VIDEO_SCHEDULER_STATE_PATH = '/var/storage/state/scheduler.json'
+# limits per edge server (RTMP subdomain), see tasks.edge.EdgeLimiter, 0 disables the respective limit
+PREVIEW_VIDEO_EDGE_MAX_IN_FLIGHT = 8  # captures across all workers
+# the connect rate is shaped in each worker process, an edge sees up to worker count times these
+PREVIEW_VIDEO_EDGE_CONNECT_RATE_PER_WORKER = 2.0  # new captures per second
+PREVIEW_VIDEO_EDGE_CONNECT_BURST_PER_WORKER = 4
+PREVIEW_VIDEO_EDGE_WAIT_TIMEOUT = 5  # seconds a capture retries a full edge before it is skipped, holding a worker
 PREVIEW_VIDEO_FILE_SIZE_THRESHOLD = 100 * 1024  # bytes
 PREVIEW_VIDEO_EXPIRE_PERIOD = 60 * 60 * 24
-PREVIEW_VIDEO_CLEAN_PERIOD = 60 * 60 * 24
+PREVIEW_VIDEO_CLEAN_PERIOD = 60 * 5
+# created files are listed in hourly buckets, expiry drops whole buckets instead of scanning the storage
+PREVIEW_VIDEO_MANIFEST_PATH = '/var/storage/state/manifest'
+PREVIEW_VIDEO_MANIFEST_BUCKET_PERIOD = 60 * 60
+# the head of the WON list is recorded continuously by the `hot_set` service, see tasks.hot_set, and its previews
+# are cut from a local segment ring, 0 disables
+PREVIEW_VIDEO_HOT_SET_SIZE = 0
+PREVIEW_VIDEO_HOT_SET_STAGING_PATH = '/tmp/storage/hot'
+PREVIEW_VIDEO_HOT_SET_SEGMENT_DURATION = 2  # seconds
+PREVIEW_VIDEO_HOT_SET_REFRESH_PERIOD = 60
+# previews of the hot set older than that are cut, early enough for the scheduler never to find them stale
+PREVIEW_VIDEO_HOT_SET_MAX_AGE = PREVIEW_VIDEO_MIN_AGE - 2 * PREVIEW_VIDEO_HOT_SET_REFRESH_PERIOD
+PREVIEW_SNAPSHOT_STORAGE_PATH = '/var/storage/snapshots/preview'
+PREVIEW_SNAPSHOT_FORMATS = ['jpg', 'webp']  # see tasks.snapshot.SNAPSHOT_FORMATS, empty list disables snapshots
+PREVIEW_SNAPSHOT_WIDTHS = [320, 640]
+PREVIEW_SNAPSHOT_QUALITY = 80
+# a capture whose poster frame differs from the published snapshot by at most that many bits of the 64 bit
+# fingerprint is not published (static or paused stream), -1 disables; requires snapshots
+PREVIEW_VIDEO_DEDUPE_MAX_DISTANCE = 4
+# a preview captured longer ago than that is republished even if it looks the same, fingerprints miss slow changes
+PREVIEW_VIDEO_DEDUPE_MAX_AGE = PREVIEW_VIDEO_MIN_AGE * 6
 
 try:
     from tasks.local_config import *
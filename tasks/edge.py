@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import itertools
+import logging
+import random
+import sys
+import time
+from functools import partial
+from typing import Callable, Optional
+
+import aio_pika
+
+from common.config import config
+from common.rabbit_lock import ConnectionPool, LockExistsError, RabbitLock
+
+if sys.version_info[:2] > (3, 6):
+    from contextlib import asynccontextmanager
+else:
+    from async_generator import asynccontextmanager
+
+log = logging.getLogger(__name__)
+
+
+class EdgeBusyError(Exception):
+    pass
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `burst` of them saved up.
+    Tokens are reserved ahead of time, so concurrent callers are spaced out instead of waking up together.
+    A bucket lives in one process, it knows nothing about the callers of other processes.
+    """
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated_at = clock()
+
+    def reserve(self) -> float:
+        """Take a token, return how many seconds to wait until it is actually available."""
+        now = self._clock()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+        self._tokens -= 1
+        return max(0, -self._tokens / self._rate)
+
+    async def acquire(self) -> None:
+        delay = self.reserve()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class EdgeLimiter:
+    """Limits captures per edge server (RTMP subdomain).
+
+    At most `max_in_flight` captures hit one edge at any moment across all worker replicas: every capture holds
+    one of the edge's slot locks, see `common.rabbit_lock.RabbitLock`. The locks of a process share a pool
+    of at most `connection_pool_size` broker connections. New connections to an edge are shaped by a token bucket
+    of this process only: `rate` and `burst` are per worker process, with N workers an edge sees up to N times
+    the rate. Zero `max_in_flight` or `rate` disables the respective limit.
+
+    A capture to a full edge is not parked: it fails with EdgeBusyError at once if the process already holds
+    all of the edge's slots, otherwise it retries the slot locks with a jittered backoff for up to `wait_timeout`
+    seconds. Meanwhile it keeps its caller's concurrency slot, e.g. a `tasks.capture.CaptureEngine` worker,
+    so `wait_timeout` should stay well below a capture's duration.
+    """
+
+    LOCK_NAME_TEMPLATE = 'edge_{}_{}'
+
+    def __init__(self, max_in_flight: int, rate: float, burst: int, wait_timeout: float,
+                 lock_factory: Optional[Callable[[str], RabbitLock]] = None, retry_interval: float = 0.5,
+                 max_retry_interval: float = 4, connection_pool_size: int = 10) -> None:
+        self._max_in_flight = max_in_flight
+        self._rate = rate
+        self._burst = burst
+        self._wait_timeout = wait_timeout
+        self._lock_factory = lock_factory or self._make_lock
+        self._retry_interval = retry_interval
+        self._max_retry_interval = max_retry_interval
+        self._connection_pool_size = connection_pool_size
+        self._connection_pool = None
+        self._semaphores = {}
+        self._buckets = {}
+
+    def _make_lock(self, name: str) -> RabbitLock:
+        if self._connection_pool is None:
+            self._connection_pool = ConnectionPool(
+                partial(aio_pika.connect_robust, config.AMQP_URL.format(config.AMQP_PASSWORD)),
+                max_size=self._connection_pool_size)
+        return RabbitLock(name, timeout=0, handover=False, connection_pool=self._connection_pool)
+
+    async def close(self) -> None:
+        if self._connection_pool is not None:
+            await self._connection_pool.close()
+            self._connection_pool = None
+
+    @asynccontextmanager
+    async def slot(self, edge: str):
+        if not self._max_in_flight:
+            await self._acquire_token(edge)
+            yield
+            return
+
+        # a process never competes for more slots than an edge has, so the broker is not asked in vain
+        semaphore = self._semaphores.get(edge)
+        if semaphore is None:
+            semaphore = self._semaphores[edge] = asyncio.Semaphore(self._max_in_flight)
+        if semaphore.locked():
+            raise EdgeBusyError(f'{edge}: all {self._max_in_flight} capture slots are held by this process')
+
+        async with semaphore:
+            lock = await self._acquire_lock(edge)
+            try:
+                await self._acquire_token(edge)
+                yield
+            finally:
+                await lock.__aexit__(None, None, None)
+
+    async def _acquire_lock(self, edge: str) -> RabbitLock:
+        deadline = time.monotonic() + self._wait_timeout
+        for attempt in itertools.count():
+            # start at a random slot, so replicas do not all probe the same locks first
+            offset = random.randrange(self._max_in_flight)
+            for i in range(self._max_in_flight):
+                lock = self._lock_factory(self.LOCK_NAME_TEMPLATE.format(edge, (offset + i) % self._max_in_flight))
+                try:
+                    await lock.__aenter__()
+                    return lock
+                except LockExistsError:
+                    pass
+
+            # full jitter, so replicas waiting for the same edge do not probe it in lockstep
+            delay = random.uniform(0, min(self._max_retry_interval, self._retry_interval * 2 ** attempt))
+            if time.monotonic() + delay > deadline:
+                raise EdgeBusyError(f'{edge}: all {self._max_in_flight} capture slots are busy')
+            log.debug(f'{edge}: all capture slots are busy, retrying in {delay:.2f}s')
+            await asyncio.sleep(delay)
+
+    async def _acquire_token(self, edge: str) -> None:
+        if not self._rate:
+            return
+        bucket = self._buckets.get(edge)
+        if bucket is None:
+            bucket = self._buckets[edge] = TokenBucket(self._rate, self._burst)
+        await bucket.acquire()
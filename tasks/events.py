@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import logging.config
+import time
+from collections import namedtuple
+from typing import Awaitable, Callable, Iterable
+
+import aio_pika
+import ujson
+
+from common.cams.objects import ChatTypeEnum, StreamSession
+from common.config import config, load_logging_config
+from tasks.tasks import _is_valid_stream, dispatch_preview_video, dispatch_retirement
+
+log = logging.getLogger(__name__)
+
+Handler = Callable[[bytes], Awaitable[None]]
+
+
+class StreamEvent(namedtuple('StreamEvent', 'type, stream_name, subdomain, chat_type, timestamp')):
+    """
+    A stream went online (`start`), offline (`stop`) or changed its chat type (`chat_type`).
+
+    Message body: {"type": "start", "stream_name": "Anna", "subdomain": "edge1.cams.com", "online": "1",
+    "timestamp": 1600000000.0}, `subdomain` and `online` are only required for `start` and `chat_type` events,
+    `timestamp` is the unix time of the event, the time it was received if missing.
+    """
+    __slots__ = ()
+
+    START, STOP, CHAT_TYPE = 'start', 'stop', 'chat_type'
+
+    @staticmethod
+    def from_json(body: bytes, received_at: float) -> 'StreamEvent':
+        d = ujson.loads(body)
+        event_type = d['type']
+        timestamp = float(d.get('timestamp', received_at))
+        if event_type == StreamEvent.STOP:
+            return StreamEvent(type=event_type, stream_name=d['stream_name'], subdomain=None, chat_type=None,
+                               timestamp=timestamp)
+        if event_type in (StreamEvent.START, StreamEvent.CHAT_TYPE):
+            return StreamEvent(type=event_type, stream_name=d['stream_name'], subdomain=d['subdomain'],
+                               chat_type=ChatTypeEnum(d['online']), timestamp=timestamp)
+        raise ValueError(f'Unknown stream event type: {event_type}')
+
+    def to_session(self) -> StreamSession:
+        return StreamSession(stream_name=self.stream_name, subdomain=self.subdomain, chat_type=self.chat_type)
+
+
+class AMQPEventSource:
+    """Consumes stream events from a queue bound to a topic exchange, messages are acked once handled.
+    Consumers sharing the queue share the events.
+    """
+
+    def __init__(self, url: str, exchange: str, queue: str, routing_keys: Iterable[str] = ('stream.*',),
+                 prefetch_count: int = 10) -> None:
+        self._url = url
+        self._exchange = exchange
+        self._queue = queue
+        self._routing_keys = list(routing_keys)
+        self._prefetch_count = prefetch_count
+
+    async def run(self, handle: Handler) -> None:
+        connection = await aio_pika.connect_robust(self._url)
+        async with connection:
+            channel = await connection.channel()
+            await channel.set_qos(prefetch_count=self._prefetch_count)
+            exchange = await channel.declare_exchange(self._exchange, aio_pika.ExchangeType.TOPIC, durable=True)
+            queue = await channel.declare_queue(self._queue, durable=True)
+            for routing_key in self._routing_keys:
+                await queue.bind(exchange, routing_key)
+
+            async with queue.iterator() as messages:
+                async for message in messages:
+                    async with message.process(requeue=False, ignore_processed=True):
+                        await handle(message.body)
+
+
+class InMemoryEventSource:
+    """Stand-in of `AMQPEventSource` for tests and local runs, `run` returns once closed and drained."""
+
+    def __init__(self) -> None:
+        self._messages = asyncio.Queue()
+
+    def publish(self, body: bytes) -> None:
+        self._messages.put_nowait(body)
+
+    def close(self) -> None:
+        self._messages.put_nowait(None)
+
+    async def run(self, handle: Handler) -> None:
+        while True:
+            body = await self._messages.get()
+            if body is None:
+                return
+            await handle(body)
+
+
+class StreamEventConsumer:
+    """
+    Reacts to stream events within seconds instead of waiting for the scheduler to notice them in WON:
+    streams which went online or changed their chat type are passed to `capture`, unless they were
+    `min_interval` seconds ago, streams which went offline or into a chat type `is_valid` rejects
+    (e.g. a private show) are passed to `retire` with the time they did, whenever they did.
+    `capture` returns whether the capture was dispatched.
+    Both block on the broker, they are run in the default executor.
+    """
+
+    MAX_TRACKED = 10000
+
+    def __init__(self, source, capture: Callable[[StreamSession], bool], retire: Callable[[str, float], None],
+                 is_valid: Callable[[ChatTypeEnum], bool], min_interval: float,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self._source = source
+        self._capture = capture
+        self._retire = retire
+        self._is_valid = is_valid
+        self._min_interval = min_interval
+        self._clock = clock
+        self._captured_at = {}
+
+    async def run(self) -> None:
+        await self._source.run(self.handle)
+
+    async def handle(self, body: bytes) -> None:
+        try:
+            event = StreamEvent.from_json(body, time.time())
+        except (ValueError, KeyError, TypeError) as e:
+            log.warning(f'Dropped malformed stream event: {e!r}', extra={'data': {'body': body[:1000]}})
+            return
+
+        stream_name = event.stream_name.lower()
+        loop = asyncio.get_event_loop()
+        try:
+            if event.type == StreamEvent.STOP:
+                self._captured_at.pop(stream_name, None)
+                await loop.run_in_executor(None, self._retire, event.stream_name, event.timestamp)
+                log.info(f'{event.stream_name}: went offline, preview retired')
+                return
+            if not self._is_valid(event.chat_type):
+                self._captured_at.pop(stream_name, None)
+                await loop.run_in_executor(None, self._retire, event.stream_name, event.timestamp)
+                log.info(f'{event.stream_name}: {event.type} event to {event.chat_type.name}, preview retired')
+                return
+
+            now = self._clock()
+            captured_at = self._captured_at.get(stream_name)
+            if captured_at is not None and now - captured_at < self._min_interval:
+                return
+            if await loop.run_in_executor(None, self._capture, event.to_session()):
+                self._track(stream_name, now)
+                log.info(f'{event.stream_name}: {event.type} event, capture dispatched')
+        except Exception as e:
+            log.error(f'{event.stream_name}: failed to handle {event.type} event: {e!r}')
+
+    def _track(self, stream_name: str, now: float) -> None:
+        self._captured_at[stream_name] = now
+        if len(self._captured_at) > self.MAX_TRACKED:
+            self._captured_at = {name: at for name, at in self._captured_at.items()
+                                 if now - at < self._min_interval}
+
+
+def main() -> None:
+    logging.config.dictConfig(load_logging_config())
+    source = AMQPEventSource(config.AMQP_URL.format(config.AMQP_PASSWORD), config.STREAM_EVENTS_EXCHANGE,
+                             config.STREAM_EVENTS_QUEUE, config.STREAM_EVENTS_ROUTING_KEYS)
+    consumer = StreamEventConsumer(source, dispatch_preview_video, dispatch_retirement, _is_valid_stream,
+                                   min_interval=config.PREVIEW_VIDEO_MIN_AGE)
+    log.info('Consuming stream events.')
+    asyncio.get_event_loop().run_until_complete(consumer.run())
+
+
+if __name__ == '__main__':
+    main()
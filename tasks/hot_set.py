@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import logging.config
+import math
+import time
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from common.cams.objects import StreamSession
+from common.config import config, load_logging_config
+from tasks.capture import CaptureEngine
+from tasks.recorder import SegmentRecorder
+from tasks.tasks import (_cut_preview_video, _get_preview_video_published_at, _get_rtmp_url, _is_valid_stream,
+                         acams_api, supervisor)
+
+log = logging.getLogger(__name__)
+
+
+class HotSetRecorder:
+    """
+    Keeps the hot set, the streams at the head of WON, recorded into a local segment ring and cuts their previews
+    from the ring instead of paying for an RTMP connect per preview. Runs as its own long-lived service, see `main`,
+    so the recordings never hold a Celery worker.
+
+    Every `refresh_period` seconds the hot set is fetched with `get_hot_set`: streams which left it stop being
+    recorded, streams which joined it or moved to another edge are (re)started. Then the previews for which
+    `is_stale` holds are cut with `cut`, as jobs of `engine`.
+    """
+
+    def __init__(self, recorder: SegmentRecorder, engine: CaptureEngine,
+                 get_hot_set: Callable[[], Awaitable[List[StreamSession]]],
+                 get_input_url: Callable[[StreamSession], str], is_stale: Callable[[str], bool],
+                 cut: Callable[[str], Awaitable[None]], refresh_period: float) -> None:
+        self._recorder = recorder
+        self._engine = engine
+        self._get_hot_set = get_hot_set
+        self._get_input_url = get_input_url
+        self._is_stale = is_stale
+        self._cut = cut
+        self._refresh_period = refresh_period
+        self._recordings = {}  # type: Dict[str, Tuple[StreamSession, asyncio.Future]]
+
+    async def run(self) -> None:
+        try:
+            while True:
+                try:
+                    await self.refresh()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log.error(f'hot set refresh error: {e!r}')
+                await asyncio.sleep(self._refresh_period)
+        finally:
+            await self.close()
+
+    async def refresh(self) -> None:
+        streams = {stream.stream_name: stream for stream in await self._get_hot_set()}
+
+        for stream_name, (stream, recording) in list(self._recordings.items()):
+            if streams.get(stream_name) != stream or recording.done():
+                await self._stop(stream_name)
+        for stream_name, stream in streams.items():
+            if stream_name not in self._recordings:
+                recording = asyncio.ensure_future(
+                    self._recorder.record(stream_name, self._get_input_url(stream), math.inf))
+                self._recordings[stream_name] = (stream, recording)
+
+        stale = [stream_name for stream_name in self._recordings if self._is_stale(stream_name)]
+        log.info(f'hot set: recording {len(self._recordings)} streams, cutting {len(stale)} previews',
+                 extra={'data': {'stream_names': list(self._recordings), 'stale': stale}})
+        await self._engine.run(partial(self._cut, stream_name) for stream_name in stale)
+
+    async def close(self) -> None:
+        for stream_name in list(self._recordings):
+            await self._stop(stream_name)
+        self._recorder.close()
+
+    async def _stop(self, stream_name: str) -> None:
+        _, recording = self._recordings.pop(stream_name)
+        recording.cancel()
+        try:
+            await recording
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log.warning(f'{stream_name}: segment recorder failed: {e!r}')
+        self._recorder.discard(stream_name)
+
+
+async def get_hot_set() -> List[StreamSession]:
+    won = await acams_api.get_won()
+    # WON lists the most viewed streams first
+    streams = await acams_api.get_streams(won.won_stream_names[:config.PREVIEW_VIDEO_HOT_SET_SIZE],
+                                          config.PREVIEW_VIDEO_STREAM_FETCH_CONCURRENCY)
+    return [stream for stream in streams.values() if stream is not None and _is_valid_stream(stream.chat_type)]
+
+
+def is_stale(stream_name: str) -> bool:
+    return time.time() - _get_preview_video_published_at(stream_name) >= config.PREVIEW_VIDEO_HOT_SET_MAX_AGE
+
+
+def main() -> None:
+    logging.config.dictConfig(load_logging_config())
+    if not config.PREVIEW_VIDEO_HOT_SET_SIZE:
+        log.info('Hot set is disabled.')
+        return
+
+    segment_duration = config.PREVIEW_VIDEO_HOT_SET_SEGMENT_DURATION
+    recorder = SegmentRecorder(supervisor, config.PREVIEW_VIDEO_HOT_SET_STAGING_PATH, segment_duration,
+                               ring_size=math.ceil(config.PREVIEW_VIDEO_DURATION / segment_duration) + 2)
+    engine = CaptureEngine(config.PREVIEW_VIDEO_CAPTURE_CONCURRENCY, config.PREVIEW_VIDEO_CAPTURE_TIMEOUT, supervisor)
+    hot_set_recorder = HotSetRecorder(recorder, engine, get_hot_set, _get_rtmp_url, is_stale,
+                                      partial(_cut_preview_video, engine, recorder),
+                                      config.PREVIEW_VIDEO_HOT_SET_REFRESH_PERIOD)
+    log.info('Recording the hot set.')
+    asyncio.get_event_loop().run_until_complete(hot_set_recorder.run())
+
+
+if __name__ == '__main__':
+    main()
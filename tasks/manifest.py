@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import time
+from typing import Callable, Iterable
+
+log = logging.getLogger(__name__)
+
+BUCKET_FILE_EXTENSION = '.txt'
+
+
+class ExpiryManifest:
+    """Time bucketed lists of created files, so that expiry does not need to scan the storage.
+
+    Every bucket is an append-only text file with one path per line, named after the start of its period.
+    Writers of several processes may append to the same bucket: a single small `O_APPEND` write is not interleaved.
+    """
+
+    def __init__(self, path: str, bucket_period: int, clock: Callable[[], float] = time.time) -> None:
+        self._path = path
+        self._bucket_period = bucket_period
+        self._clock = clock
+
+    def add(self, file_paths: Iterable[str]) -> None:
+        """Record files, preferably before they are created, so that a crash in between can not leak them."""
+        data = ''.join(f'{file_path}\n' for file_path in file_paths).encode('utf-8')
+        if not data:
+            return
+
+        bucket = int(self._clock() // self._bucket_period * self._bucket_period)
+        os.makedirs(self._path, exist_ok=True)
+        fd = os.open(os.path.join(self._path, f'{bucket}{BUCKET_FILE_EXTENSION}'),
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+    def expire(self, expire_period: float, remove: Callable[[str], None]) -> int:
+        """Call `remove` for every file of the buckets which ended at least `expire_period` seconds ago
+        and drop those buckets. Returns the number of files handed to `remove`.
+        """
+        now = self._clock()
+        try:
+            bucket_file_names = sorted(os.listdir(self._path))
+        except FileNotFoundError:
+            return 0
+
+        removed = 0
+        for bucket_file_name in bucket_file_names:
+            bucket, extension = os.path.splitext(bucket_file_name)
+            if extension != BUCKET_FILE_EXTENSION or not bucket.isdigit():
+                continue
+            if int(bucket) + self._bucket_period + expire_period > now:
+                continue
+
+            bucket_file_path = os.path.join(self._path, bucket_file_name)
+            try:
+                with open(bucket_file_path) as f:
+                    file_paths = f.read().splitlines()
+            except FileNotFoundError:
+                continue  # dropped by a concurrent expiry
+
+            for file_path in file_paths:
+                if file_path:
+                    remove(file_path)
+                    removed += 1
+
+            try:
+                os.unlink(bucket_file_path)
+            except FileNotFoundError:
+                pass
+            log.info(f'{bucket_file_path}: expired {len(file_paths)} files')
+        return removed
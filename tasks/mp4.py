@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Minimal MP4 (ISO BMFF) reader which pulls video track statistics out of `moov`.
+
+The file is mmap-ed and only box headers and sample tables are touched, `mdat` is skipped over without being read.
+"""
+import mmap
+import os
+import struct
+from collections import namedtuple
+from typing import Iterator, Optional, Tuple
+
+_BOX_HEADER = struct.Struct('>I4s')
+_UINT32 = struct.Struct('>I')
+_UINT64 = struct.Struct('>Q')
+_FULL_BOX_HEADER_SIZE = 4  # version(1) + flags(3)
+
+
+class Mp4Error(Exception):
+    pass
+
+
+class Mp4Info(namedtuple('Mp4Info', 'size, duration, sample_count, avg_frame_rate, bit_rate, keyframe_count')):
+    """Statistics of the first video track, `size` is the size of the whole file."""
+    __slots__ = ()
+
+
+def probe(file_path: str) -> Mp4Info:
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            raise Mp4Error('Empty file')
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return parse(buf, size)
+
+
+def parse(buf, size: int) -> Mp4Info:
+    try:
+        moov = _find_box(buf, 0, size, b'moov')
+        if moov is None:
+            raise Mp4Error('No moov box')
+
+        for _, start, end in _iter_boxes(buf, *moov, box_types=(b'trak',)):
+            info = _parse_video_track(buf, start, end, size)
+            if info is not None:
+                return info
+
+    except (struct.error, IndexError) as e:
+        raise Mp4Error(f'Malformed box: {e}') from e
+
+    raise Mp4Error('No video track')
+
+
+def _iter_boxes(buf, start: int, end: int, box_types: Optional[Tuple[bytes, ...]] = None) \
+        -> Iterator[Tuple[bytes, int, int]]:
+    """Yield (type, payload start, payload end) of the boxes found between `start` and `end`."""
+    offset = start
+    while offset + _BOX_HEADER.size <= end:
+        box_size, box_type = _BOX_HEADER.unpack_from(buf, offset)
+        header_size = _BOX_HEADER.size
+        if box_size == 1:
+            if offset + header_size + _UINT64.size > end:
+                raise Mp4Error(f'Truncated {box_type} box header')
+            box_size, = _UINT64.unpack_from(buf, offset + header_size)
+            header_size += _UINT64.size
+        elif box_size == 0:  # box extends to the end of its container
+            box_size = end - offset
+
+        if box_size < header_size or offset + box_size > end:
+            raise Mp4Error(f'Truncated {box_type} box')
+
+        if box_types is None or box_type in box_types:
+            yield box_type, offset + header_size, offset + box_size
+        offset += box_size
+
+
+def _find_box(buf, start: int, end: int, box_type: bytes) -> Optional[Tuple[int, int]]:
+    for _, box_start, box_end in _iter_boxes(buf, start, end, box_types=(box_type,)):
+        return box_start, box_end
+    return None
+
+
+def _find_path(buf, start: int, end: int, *path: bytes) -> Optional[Tuple[int, int]]:
+    bounds = (start, end)
+    for box_type in path:
+        bounds = _find_box(buf, *bounds, box_type)
+        if bounds is None:
+            return None
+    return bounds
+
+
+def _read_table(buf, start: int, end: int, entry_format: str) -> Tuple[int, ...]:
+    """Read `entry_count` followed by the entries of a full box sample table."""
+    offset = start + _FULL_BOX_HEADER_SIZE
+    if offset + _UINT32.size > end:
+        raise Mp4Error('Truncated sample table')
+    entry_count, = _UINT32.unpack_from(buf, offset)
+    table = struct.Struct(f'>{entry_count * len(entry_format)}{entry_format[0]}')
+    if offset + _UINT32.size + table.size > end:
+        raise Mp4Error('Truncated sample table')
+    return table.unpack_from(buf, offset + _UINT32.size)
+
+
+def _read_timescale(buf, start: int, end: int) -> int:
+    version = buf[start]
+    # mdhd: creation_time, modification_time are 32 bit in version 0 and 64 bit in version 1
+    offset = start + _FULL_BOX_HEADER_SIZE + (16 if version == 1 else 8)
+    if offset + _UINT32.size > end:
+        raise Mp4Error('Truncated mdhd box')
+    return _UINT32.unpack_from(buf, offset)[0]
+
+
+def _parse_video_track(buf, start: int, end: int, size: int) -> Optional[Mp4Info]:
+    mdia = _find_box(buf, start, end, b'mdia')
+    if mdia is None:
+        return None
+
+    hdlr = _find_box(buf, *mdia, b'hdlr')
+    # hdlr: pre_defined(4) precedes handler_type(4)
+    if hdlr is None or buf[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+        return None
+
+    mdhd = _find_box(buf, *mdia, b'mdhd')
+    stbl = _find_path(buf, *mdia, b'minf', b'stbl')
+    if mdhd is None or stbl is None:
+        raise Mp4Error('Incomplete video track')
+    timescale = _read_timescale(buf, *mdhd)
+
+    stts = _find_box(buf, *stbl, b'stts')
+    stsz = _find_box(buf, *stbl, b'stsz')
+    if stts is None or stsz is None:
+        raise Mp4Error('Incomplete sample table')
+
+    # stts: pairs of (sample_count, sample_delta)
+    time_to_sample = _read_table(buf, *stts, 'II')
+    sample_count = sum(time_to_sample[0::2])
+    duration = sum(count * delta for count, delta in zip(time_to_sample[0::2], time_to_sample[1::2]))
+    duration = duration / timescale if timescale else 0
+
+    # stsz: sample_size(4) is followed by sample_count(4) and, if sample_size is 0, by the table of sizes
+    if stsz[0] + _FULL_BOX_HEADER_SIZE + 8 > stsz[1]:
+        raise Mp4Error('Truncated stsz box')
+    sample_size, = _UINT32.unpack_from(buf, stsz[0] + _FULL_BOX_HEADER_SIZE)
+    if sample_size:
+        video_size = sample_size * _UINT32.unpack_from(buf, stsz[0] + _FULL_BOX_HEADER_SIZE + 4)[0]
+    else:
+        video_size = sum(_read_table(buf, stsz[0] + 4, stsz[1], 'I'))
+
+    # no stss means that every sample is a sync sample
+    stss = _find_box(buf, *stbl, b'stss')
+    keyframe_count = len(_read_table(buf, *stss, 'I')) if stss is not None else sample_count
+
+    return Mp4Info(
+        size=size,
+        duration=duration,
+        sample_count=sample_count,
+        avg_frame_rate=sample_count / duration if duration else 0,
+        bit_rate=int(video_size * 8 / duration) if duration else 0,
+        keyframe_count=keyframe_count,
+    )
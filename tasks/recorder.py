@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import List, Optional
+
+from tasks.supervisor import ProcessSupervisor
+
+log = logging.getLogger(__name__)
+
+PLAYLIST_FILE_NAME = 'index.m3u8'
+
+
+class SegmentRecorder:
+    """Keeps a persistent ffmpeg per stream writing a ring of short MPEG-TS segments (HLS) to a staging directory.
+
+    The newest segments can be cut into a preview locally, without paying for an RTMP connect on every refresh.
+    Every recorder gets its own staging directory, so recorders of overlapping runs do not interfere.
+    """
+
+    def __init__(self, supervisor: ProcessSupervisor, staging_path: str, segment_duration: int, ring_size: int,
+                 restart_delay: float = 5) -> None:
+        self._supervisor = supervisor
+        self._segment_duration = segment_duration
+        self._ring_size = ring_size
+        self._restart_delay = restart_delay
+        os.makedirs(staging_path, exist_ok=True)
+        self.staging_path = tempfile.mkdtemp(prefix='recorder_', dir=staging_path)
+
+    def close(self) -> None:
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+
+    def discard(self, name: str) -> None:
+        """Drop the ring of a stream which is not recorded anymore."""
+        shutil.rmtree(self.get_stream_path(name), ignore_errors=True)
+
+    def get_stream_path(self, name: str) -> str:
+        return os.path.join(self.staging_path, name.lower())
+
+    def get_record_args(self, name: str, input_url: str) -> List[str]:
+        stream_path = self.get_stream_path(name)
+        return ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', input_url, '-c', 'copy',
+                '-f', 'hls', '-hls_time', str(self._segment_duration), '-hls_list_size', str(self._ring_size),
+                '-hls_flags', 'delete_segments', '-hls_segment_filename', os.path.join(stream_path, 'segment_%06d.ts'),
+                os.path.join(stream_path, PLAYLIST_FILE_NAME)]
+
+    async def record(self, name: str, input_url: str, duration: float) -> None:
+        """Record the stream for `duration` seconds, ffmpeg is restarted whenever it exits before that."""
+        deadline = time.monotonic() + duration
+        os.makedirs(self.get_stream_path(name), exist_ok=True)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+
+            try:
+                result = await self._supervisor.run(self.get_record_args(name, input_url), remaining)
+                if not result.timed_out:
+                    log.warning(f'{name}: segment recorder exited', extra={'data': result._asdict()})
+            except (asyncio.CancelledError, OSError):
+                raise
+            except Exception as e:
+                log.error(f'{name}: segment recorder error: {e}')
+
+            await asyncio.sleep(min(self._restart_delay, max(deadline - time.monotonic(), 0)))
+
+    def get_latest_segments(self, name: str, duration: float) -> Optional[List[str]]:
+        """Paths of the newest finished segments covering at least `duration` seconds, oldest first.
+        None if the ring does not hold enough of the stream yet.
+        """
+        stream_path = self.get_stream_path(name)
+        try:
+            with open(os.path.join(stream_path, PLAYLIST_FILE_NAME)) as f:
+                lines = f.read().splitlines()
+        except FileNotFoundError:
+            return None
+
+        segments, segment_duration = [], None
+        for line in lines:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                segment_duration = float(line[len('#EXTINF:'):].split(',', 1)[0])
+            elif line and not line.startswith('#') and segment_duration is not None:
+                segments.append((os.path.join(stream_path, line), segment_duration))
+                segment_duration = None
+
+        latest, covered = [], 0
+        for segment_path, segment_duration in reversed(segments):
+            latest.append(segment_path)
+            covered += segment_duration
+            if covered >= duration:
+                return latest[::-1]
+        return None
+
+    @staticmethod
+    def get_cut_input_args(segment_paths: List[str]) -> List[str]:
+        # MPEG-TS segments can be concatenated byte-wise, so no concat list file is needed
+        return ['-i', f'concat:{"|".join(segment_paths)}']
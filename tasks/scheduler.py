@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import fcntl
+import heapq
+import logging
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import Callable, Collection, Dict, Iterable, List, Optional, Tuple
+
+import ujson
+
+log = logging.getLogger(__name__)
+
+
+class StreamRecord(namedtuple('StreamRecord', 'published_at, file, outcome')):
+    """What the scheduler saw of a stream the last time it looked: when its preview was published,
+    the file it points to and the outcome of the last dispatched capture.
+    """
+    __slots__ = ()
+
+    PUBLISHED, PENDING, FAILED = 'published', 'pending', 'failed'
+
+
+class SchedulerBusyError(Exception):
+    pass
+
+
+class SchedulerState:
+    """Dispatch bookkeeping of the preview scheduler, persisted between runs as a JSON file.
+
+    `dispatched_at` maps stream names to the time the last capture was dispatched for them,
+    `streams` maps them to their `StreamRecord`, `won` lists the stream names of the previous run.
+    """
+
+    def __init__(self, dispatched_at: Optional[Dict[str, float]] = None, won: Iterable[str] = (),
+                 streams: Optional[Dict[str, StreamRecord]] = None) -> None:
+        self.dispatched_at = dispatched_at or {}
+        self.won = list(won)
+        self.streams = streams or {}
+
+    @staticmethod
+    def load(file_path: str) -> 'SchedulerState':
+        try:
+            with open(file_path) as f:
+                data = ujson.load(f)
+            return SchedulerState(dispatched_at=data['dispatched_at'], won=data.get('won', ()),
+                                  streams={name: StreamRecord(*record)
+                                           for name, record in data.get('streams', {}).items()})
+        except FileNotFoundError:
+            return SchedulerState()
+        except (ValueError, KeyError, TypeError) as e:
+            log.warning(f'{file_path}: can not read scheduler state, starting from scratch: {e}')
+            return SchedulerState()
+
+    def save(self, file_path: str) -> None:
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_file_path = f'{file_path}.{os.getpid()}.tmp'
+        with open(tmp_file_path, 'w') as f:
+            ujson.dump({
+                'dispatched_at': self.dispatched_at,
+                'won': self.won,
+                'streams': self.streams,
+            }, f)
+        os.replace(tmp_file_path, file_path)
+
+    @staticmethod
+    @contextmanager
+    def lock(file_path: str):
+        """Exclusive lock of the state at `file_path` for a load, dispatch and save run, held on a sidecar file
+        so that it survives the state file being replaced. Raises SchedulerBusyError if another run holds it.
+        """
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(f'{file_path}.lock', 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise SchedulerBusyError(f'{file_path} is locked by another run') from None
+            yield  # unlocked when the file is closed
+
+    def forget_missing(self, stream_names: Iterable[str]) -> None:
+        """Drop the streams which are not online anymore, so that the state does not grow forever."""
+        online = set(stream_names)
+        self.dispatched_at = {name: at for name, at in self.dispatched_at.items() if name in online}
+        self.streams = {name: record for name, record in self.streams.items() if name in online}
+
+    def observe(self, name: str, published_at: float, file: Optional[str], now: float, retry_after: float) -> None:
+        """Record what is published for the stream and what became of the last capture dispatched for it."""
+        dispatched_at = self.dispatched_at.get(name)
+        if dispatched_at is None:
+            outcome = None
+        elif published_at >= dispatched_at:
+            outcome = StreamRecord.PUBLISHED
+        elif now - dispatched_at < retry_after:
+            outcome = StreamRecord.PENDING
+        else:
+            outcome = StreamRecord.FAILED
+        self.streams[name] = StreamRecord(published_at=published_at, file=file, outcome=outcome)
+
+
+def select_stale(stream_names: Iterable[str], published_at: Callable[[str], float], state: SchedulerState,
+                 now: float, min_age: float, retry_after: float, budget: int,
+                 first: Collection[str] = ()) -> List[str]:
+    """Pick up to `budget` streams with the oldest previews, streams without a preview come first,
+    streams in `first` (e.g. the ones which just came online) come before all others.
+
+    A stream is eligible when its preview is at least `min_age` seconds old and no capture was dispatched for it
+    within `retry_after` seconds, i.e. the previous one had enough time to either publish or fail.
+    `published_at` is not called for streams whose preview was fresh the last time the scheduler looked.
+    """
+    if budget <= 0:
+        return []
+
+    eligible = []
+    for name in stream_names:
+        if now - state.dispatched_at.get(name, 0) < retry_after:
+            continue
+        record = state.streams.get(name)
+        if record is not None and now - record.published_at < min_age:
+            continue
+        last_published_at = published_at(name)
+        if now - last_published_at >= min_age:
+            eligible.append((name not in first, last_published_at, name))
+
+    return [name for _, _, name in heapq.nsmallest(budget, eligible)]
+
+
+def spread(stream_names: List[str], chunk_size: int, rate: float) -> List[Tuple[List[str], float]]:
+    """Split the streams into chunks with countdowns, so that captures start at `rate` per second on average."""
+    return [(stream_names[start:start + chunk_size], start / rate)
+            for start in range(0, len(stream_names), chunk_size)]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from collections import namedtuple
+from typing import Iterable
+
+from PIL import Image
+
+# snapshot file extension -> Pillow format
+SNAPSHOT_FORMATS = {
+    'jpg': 'JPEG',
+    'webp': 'WEBP',
+}
+
+
+class SnapshotTarget(namedtuple('SnapshotTarget', 'file_path, width, extension')):
+    __slots__ = ()
+
+
+def save_snapshots(poster_file_path: str, targets: Iterable[SnapshotTarget], quality: int) -> None:
+    """Scale the poster frame down to every target width and encode it, the aspect ratio is preserved.
+    Posters narrower than the target width are not upscaled.
+    """
+    with Image.open(poster_file_path) as poster:
+        poster = poster.convert('RGB')
+
+    resized = {}
+    for target in targets:
+        image = resized.get(target.width)
+        if image is None:
+            image = resized[target.width] = _resize(poster, target.width)
+        image.save(target.file_path, format=SNAPSHOT_FORMATS[target.extension], quality=quality, optimize=True)
+
+
+def _resize(image: Image.Image, width: int) -> Image.Image:
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def get_fingerprint(file_path: str, hash_size: int = 8) -> int:
+    """Difference hash of the image, `hash_size ** 2` bits: whether brightness falls between neighbouring pixels
+    of a tiny grayscale copy. Scaling and lossy re-encoding barely change it, see `get_distance`.
+    """
+    with Image.open(file_path) as image:
+        image = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+
+    pixels = list(image.getdata())
+    fingerprint = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            offset = row * (hash_size + 1) + column
+            fingerprint = fingerprint << 1 | (pixels[offset] > pixels[offset + 1])
+    return fingerprint
+
+
+def get_distance(fingerprint: int, other_fingerprint: int) -> int:
+    """Number of differing bits of two fingerprints."""
+    return bin(fingerprint ^ other_fingerprint).count('1')
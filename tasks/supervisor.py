@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import os
+import signal
+import subprocess as sp
+import time
+from collections import namedtuple
+from typing import Callable, List, Optional
+
+log = logging.getLogger(__name__)
+
+
+def _returncode(status: int) -> int:
+    """Same convention as Popen.returncode: negative signal number if the process was killed."""
+    return -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+
+
+class ProcessResult(namedtuple('ProcessResult', 'returncode, timed_out, wall_time, user_time, system_time, max_rss')):
+    """Exit status and resource usage of a child, `max_rss` is in kilobytes."""
+    __slots__ = ()
+
+
+class ProcessSupervisor:
+    """Launches processes without a shell, each one in its own process group.
+
+    The children are reaped with `os.wait4` so that resource usage is known per child. On deadline, cancellation
+    or any exception raised while waiting (e.g. SoftTimeLimitExceeded) the whole process group is killed, so no
+    orphaned grandchildren are left behind.
+    """
+
+    def __init__(self, poll_interval: float = 0.05) -> None:
+        self._poll_interval = poll_interval
+        self._process_groups = set()
+
+    async def run(self, args: List[str], timeout: float,
+                  on_output: Optional[Callable[[str], None]] = None) -> ProcessResult:
+        """Run the process to completion or until `timeout` seconds pass.
+        Lines written to stdout are passed to `on_output`, stdout is discarded if it is not set.
+        """
+        loop = asyncio.get_event_loop()
+        started = time.monotonic()
+        process = sp.Popen(args, stdin=sp.DEVNULL, stdout=sp.PIPE if on_output else sp.DEVNULL,
+                           start_new_session=True)
+        self._process_groups.add(process.pid)
+        transport, reader_task = None, None
+        try:
+            if on_output:
+                reader = asyncio.StreamReader()
+                transport, _ = await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader),
+                                                            process.stdout)
+                reader_task = asyncio.ensure_future(self._read_lines(reader, on_output))
+
+            timed_out = False
+            deadline = started + timeout
+            while True:
+                pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+                if pid:
+                    break
+                if time.monotonic() >= deadline:
+                    timed_out = True
+                    self._kill(process.pid)
+                    _, status, rusage = os.wait4(process.pid, 0)
+                    break
+                await asyncio.sleep(self._poll_interval)
+
+            # the child is reaped already, let Popen know so that it does not try to wait for it
+            process.returncode = _returncode(status)
+            if reader_task is not None:
+                # stdout may still be held open by grandchildren, do not wait for them past the deadline
+                await asyncio.wait([reader_task], timeout=max(deadline - time.monotonic(), self._poll_interval))
+
+            return ProcessResult(
+                returncode=process.returncode,
+                timed_out=timed_out,
+                wall_time=time.monotonic() - started,
+                user_time=rusage.ru_utime,
+                system_time=rusage.ru_stime,
+                max_rss=rusage.ru_maxrss,
+            )
+
+        finally:
+            if process.returncode is None:
+                self._kill(process.pid)
+                _, status, _ = os.wait4(process.pid, 0)
+                process.returncode = _returncode(status)
+            self._process_groups.discard(process.pid)
+            if reader_task is not None:
+                reader_task.cancel()
+            if transport is not None:
+                transport.close()
+            elif process.stdout is not None:
+                process.stdout.close()
+
+    def kill_all(self) -> None:
+        """Kill the process groups of all the children still running."""
+        for pgid in list(self._process_groups):
+            self._kill(pgid)
+
+    @staticmethod
+    def _kill(pgid: int) -> None:
+        try:
+            os.killpg(pgid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        except PermissionError as e:
+            log.warning(f'Can not kill process group {pgid}', exc_info=e)
+
+    @staticmethod
+    async def _read_lines(reader: asyncio.StreamReader, on_output: Callable[[str], None]) -> None:
+        async for line in reader:
+            on_output(line.decode(errors='replace'))
@@ -1,25 +1,77 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import glob
+import hashlib
 import logging
 import os
-import subprocess as sp
-import shlex
-import json
 import time
+import uuid
 from datetime import datetime
-from typing import List
+from functools import partial
+from typing import Any, Callable, Coroutine, Dict, Iterable, List, Optional, Tuple
 
+import aiohttp
+from celery import Task
 from celery.exceptions import SoftTimeLimitExceeded
-from requests.exceptions import RequestException
+from celery.signals import worker_shutdown
 
 from common.cams.api import CamsAPI
-from common.cams.objects import StreamSession, ChatTypeEnum
+from common.cams.cache import CamsAPICache
+from common.cams.objects import StreamSession, StreamSessions, ChatTypeEnum
+from common.cams.overload import AsyncAdaptiveLimiter, CircuitBreaker, CircuitOpenError
+from common.cams.requesters.asyn import CamsAPIAsyncRequester
+from common.cams.requesters.common import Instrumentation
 from common.cams.requesters.syn import CamsAPISyncRequester
+from common.celery.enums import Priority
 from common.config import config
 from tasks import celery_app
+from tasks import mp4
+from tasks.capture import CaptureEngine, CaptureMetrics
+from tasks.edge import EdgeBusyError, EdgeLimiter
+from tasks.manifest import ExpiryManifest
+from tasks.recorder import SegmentRecorder
+from tasks.scheduler import SchedulerBusyError, SchedulerState, StreamRecord, select_stale, spread
+from tasks.snapshot import SnapshotTarget, get_distance, get_fingerprint, save_snapshots
+from tasks.supervisor import ProcessSupervisor
 
 log = logging.getLogger(__name__)
 
-cams_api = CamsAPI(CamsAPISyncRequester(config.CAMS_URL))
+cams_cache = CamsAPICache({'won': config.CAMS_CACHE_WON_TTL, 'stream': config.CAMS_CACHE_STREAM_TTL},
+                          maxsize=config.CAMS_CACHE_SIZE, not_found_ttl=config.CAMS_CACHE_NOT_FOUND_TTL,
+                          stale_ttls={'won': config.CAMS_CACHE_WON_STALE_TTL,
+                                      'stream': config.CAMS_CACHE_STREAM_STALE_TTL})
+cams_instrumentation = Instrumentation(debug_sample_rate=config.CAMS_DEBUG_SAMPLE_RATE)
+# shared by both requesters: once Cams is down, every request of the process fails fast
+cams_breaker = CircuitBreaker(config.CAMS_BREAKER_FAILURE_THRESHOLD, config.CAMS_BREAKER_RESET_TIMEOUT)
+# halved on failures down to 1 request in flight, recovers additively up to the fetch concurrency
+cams_limiter = AsyncAdaptiveLimiter(config.PREVIEW_VIDEO_STREAM_FETCH_CONCURRENCY,
+                                    max_limit=config.PREVIEW_VIDEO_STREAM_FETCH_CONCURRENCY)
+cams_api = CamsAPI(CamsAPISyncRequester(config.CAMS_URL, connect_timeout=config.CAMS_CONNECT_TIMEOUT,
+                                        read_timeout=config.CAMS_READ_TIMEOUT,
+                                        instrumentation=cams_instrumentation, breaker=cams_breaker), cams_cache)
+acams_api = CamsAPI(CamsAPIAsyncRequester(config.CAMS_URL,
+                                          limit_per_host=config.PREVIEW_VIDEO_STREAM_FETCH_CONCURRENCY,
+                                          connect_timeout=config.CAMS_CONNECT_TIMEOUT,
+                                          read_timeout=config.CAMS_READ_TIMEOUT,
+                                          instrumentation=cams_instrumentation, breaker=cams_breaker,
+                                          limiter=cams_limiter), cams_cache)
+supervisor = ProcessSupervisor()
+manifest = ExpiryManifest(config.PREVIEW_VIDEO_MANIFEST_PATH, config.PREVIEW_VIDEO_MANIFEST_BUCKET_PERIOD)
+edge_limiter = EdgeLimiter(config.PREVIEW_VIDEO_EDGE_MAX_IN_FLIGHT, config.PREVIEW_VIDEO_EDGE_CONNECT_RATE_PER_WORKER,
+                           config.PREVIEW_VIDEO_EDGE_CONNECT_BURST_PER_WORKER, config.PREVIEW_VIDEO_EDGE_WAIT_TIMEOUT,
+                           connection_pool_size=config.PREVIEW_VIDEO_CAPTURE_CONCURRENCY)
+
+
+@worker_shutdown.connect
+def close_cams_api(**kwargs):
+    cams_api.requester.close()
+    asyncio.get_event_loop().run_until_complete(acams_api.requester.close())
+
+
+@worker_shutdown.connect
+def close_edge_limiter(**kwargs):
+    asyncio.get_event_loop().run_until_complete(edge_limiter.close())
+
 
 if config.MODE == 'dev':
     from celery.signals import worker_ready
@@ -27,7 +79,7 @@ if config.MODE == 'dev':
     @worker_ready.connect
     def at_start(sender, **k):
         with sender.app.connection() as conn:
-            sender.app.send_task('tasks.tasks.make_all_preview_videos', connection=conn)
+            sender.app.send_task('tasks.tasks.schedule_preview_videos', connection=conn)
 
 
 def ensure_exists(path):
@@ -57,33 +109,122 @@ def cleanup_files(directory: str, file_filter):
             log.warning('Can not cleanup file: %s', exc_info=e)
 
 
-@celery_app.task(soft_time_limit=config.PREVIEW_VIDEO_UPDATE_PERIOD,
-                 expires=config.PREVIEW_VIDEO_UPDATE_PERIOD, ignore_result=True)
-def make_all_preview_videos() -> None:
-    ensure_exists(config.PREVIEW_VIDEO_STORAGE_PATH)
+def _get_preview_video_published_at(stream_name: str) -> float:
+    # the symlink is replaced on every publish, so its own mtime is the time of the last successful capture
+    try:
+        return os.lstat(_get_preview_video_symlink_file_path(stream_name)).st_mtime
+    except FileNotFoundError:
+        return 0
 
-    won = cams_api.get_won()
 
-    log.info(f'make_all_preview_videos: {won}')
-    for i in range(len(won.won_stream_names)):
-        make_preview_video.apply_async(
-            kwargs={
-                'stream_name': won.won_stream_names[i],
-            },
-            ignore_result=True,
-            countdown=(int(i/config.PREVIEW_VIDEO_TASK_CHUNK_SIZE))*config.PREVIEW_VIDEO_TASK_COUNTDOWN_MULTIPLIER,
-        )
+def _observe_published_preview(state: SchedulerState, now: float) -> Callable[[str], float]:
+    """`_get_preview_video_published_at` which records what it finds in the scheduler state."""
+    def get_published_at(stream_name: str) -> float:
+        published_at = _get_preview_video_published_at(stream_name)
+        try:
+            file = os.readlink(_get_preview_video_symlink_file_path(stream_name)) if published_at else None
+        except FileNotFoundError:
+            published_at, file = 0, None
+        state.observe(stream_name, published_at, file, now, config.PREVIEW_VIDEO_MIN_AGE)
+        return published_at
+    return get_published_at
+
+
+def _retire_published_preview(stream_name: str, went_offline_at: Optional[float] = None) -> None:
+    """Unpublish the preview of a stream which went offline, its files are removed when they expire.
+    Previews published after `went_offline_at` are kept, the stream came back online in the meantime.
+    """
+    symlink_file_paths = [_get_preview_video_symlink_file_path(stream_name)]
+    symlink_file_paths += [_get_preview_snapshot_symlink_file_path(stream_name, extension, width)
+                           for extension in config.PREVIEW_SNAPSHOT_FORMATS
+                           for width in config.PREVIEW_SNAPSHOT_WIDTHS]
+    for symlink_file_path in symlink_file_paths:
+        try:
+            if went_offline_at is not None and os.lstat(symlink_file_path).st_mtime > went_offline_at:
+                log.info(f'{stream_name}: {symlink_file_path} was published after the stream went offline, kept')
+                continue
+            os.unlink(symlink_file_path)
+        except FileNotFoundError:
+            pass
+
+
+def _apply_async_many(task: Task, calls: Iterable[Tuple[dict, dict]]) -> None:
+    """Send many calls of `task`, as (kwargs, apply_async options) pairs, over a single producer from the pool
+    instead of acquiring one per call.
+    """
+    with celery_app.producer_or_acquire() as producer:
+        for kwargs, options in calls:
+            task.apply_async(kwargs=kwargs, producer=producer, **options)
+
+
+@celery_app.task(soft_time_limit=config.PREVIEW_VIDEO_SCHEDULE_PERIOD,
+                 expires=config.PREVIEW_VIDEO_SCHEDULE_PERIOD, ignore_result=True)
+def schedule_preview_videos() -> None:
+    ensure_exists(config.PREVIEW_VIDEO_STORAGE_PATH)
+    try:
+        # a slow run may still be going, both would dispatch the same streams and the last save would win
+        with SchedulerState.lock(config.PREVIEW_VIDEO_SCHEDULER_STATE_PATH):
+            _schedule_preview_videos()
+    except SchedulerBusyError as e:
+        log.warning(f'schedule_preview_videos skipped: {e}')
+
 
+def _schedule_preview_videos() -> None:
+    now = time.time()
+    state = SchedulerState.load(config.PREVIEW_VIDEO_SCHEDULER_STATE_PATH)
 
-def _get_stream(stream_name: str) -> StreamSession:
+    won = cams_api.get_won()
+    # the first run has nothing to compare with, no stream is considered new
+    joined, left = won.diff(StreamSessions(won_stream_names=state.won)) if state.won else ([], [])
+    if config.PREVIEW_VIDEO_RETIRE_DEPARTED:
+        for stream_name in left:
+            _retire_published_preview(stream_name)
+    stream_names = state.won = won.won_stream_names
+    state.forget_missing(won.names)
+
+    # previews of the hot set are kept younger than MIN_AGE by `tasks.hot_set`, so they are not selected below
+    rate = config.PREVIEW_VIDEO_CAPTURE_RATE
+    selected = select_stale(stream_names, _observe_published_preview(state, now), state, now,
+                            min_age=config.PREVIEW_VIDEO_MIN_AGE, retry_after=config.PREVIEW_VIDEO_MIN_AGE,
+                            budget=int(rate * config.PREVIEW_VIDEO_SCHEDULE_PERIOD), first=set(joined))
+    # one bulk fetch instead of a request per task: offline and invalid streams are not dispatched at all,
+    # the others carry their sessions, workers only ask Cams about streams which could not be fetched here
+    streams = _run_until_complete(acams_api.get_streams(selected, config.PREVIEW_VIDEO_STREAM_FETCH_CONCURRENCY))
+    dispatched = [stream_name for stream_name in selected
+                  if stream_name not in streams
+                  or (streams[stream_name] is not None and _is_valid_stream(streams[stream_name].chat_type))]
+    _apply_async_many(make_preview_videos, (
+        ({
+            'stream_names': [stream_name for stream_name in chunk if stream_name not in streams],
+            'streams': {stream_name: streams[stream_name].to_dict()
+                        for stream_name in chunk if stream_name in streams},
+        }, {
+            'ignore_result': True,
+            'countdown': countdown,
+        }) for chunk, countdown in spread(dispatched, config.PREVIEW_VIDEO_TASK_CHUNK_SIZE, rate)))
+    for stream_name in selected:
+        state.dispatched_at[stream_name] = now
+    state.save(config.PREVIEW_VIDEO_SCHEDULER_STATE_PATH)
+
+    failed = [stream_name for stream_name, record in state.streams.items() if record.outcome == StreamRecord.FAILED]
+    log.info(f'schedule_preview_videos: dispatched {len(dispatched)} of {len(selected)} selected '
+             f'of {len(stream_names)} streams, {len(joined)} joined, {len(left)} left, {len(failed)} failed',
+             extra={'data': {'stream_names': dispatched, 'joined': joined, 'left': left, 'failed': failed}})
+
+
+async def _get_stream(stream_name: str) -> Optional[StreamSession]:
     try:
-        return cams_api.get_stream(stream_name)
-    except RequestException as e:
-        if e.response is not None and e.response.status_code == 404:
+        return await acams_api.get_stream(stream_name)
+    except aiohttp.ClientResponseError as e:
+        if e.status == 404:
             log.info(f'{stream_name}: No active stream')
         else:
             log.error(f'{stream_name}: Cams raised error: {e}')
-        return None
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        log.error(f'{stream_name}: Cams raised error: {e!r}')
+    except CircuitOpenError as e:
+        log.warning(f'{stream_name}: Cams request skipped: {e}')
+    return None
 
 
 def _get_rtmp_url(stream: dict) -> str:
@@ -102,18 +243,45 @@ def _get_rtmp_url(stream: dict) -> str:
     return rtmp_url
 
 
+def _get_rtmp_input_args(stream: StreamSession) -> List[str]:
+    return ['-re', '-i', _get_rtmp_url(stream)]
+
+
 def _get_preview_video_name(stream_name: str) -> str:
     now = datetime.now()
     return f'preview_video_{now:%Y.%m.%d.%H.%M.%S.%f}_{stream_name}.mp4'
 
 
-def _capture_preview_video(preview_video_file_path: str, rtmp_url: str, stream_name: str) -> None:
-    ffmpeg_cmd = f'timeout 30s ffmpeg -y -hide_banner -loglevel error -re -i "{rtmp_url}" '\
-                 f'-t 10 -movflags +faststart -c copy "{preview_video_file_path}"'
-    log.info(f'{stream_name}: ffmpeg_cmd: {ffmpeg_cmd}')
+def _is_snapshot_enabled() -> bool:
+    return bool(config.PREVIEW_SNAPSHOT_FORMATS and config.PREVIEW_SNAPSHOT_WIDTHS)
+
+
+def _get_poster_file_path(preview_video_file_path: str) -> str:
+    return f'{os.path.splitext(preview_video_file_path)[0]}.png'
+
+
+def _get_capture_args(preview_video_file_path: str, input_args: List[str],
+                      poster_file_path: Optional[str] = None) -> List[str]:
+    args = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-nostats', '-progress', 'pipe:1', *input_args,
+            '-t', str(config.PREVIEW_VIDEO_DURATION), '-movflags', '+faststart', '-c', 'copy', preview_video_file_path]
+    if poster_file_path:
+        # the first decoded frame as a second output of the same pass, snapshots are made of it
+        args += ['-map', '0:v:0', '-frames:v', '1', poster_file_path]
+    return args
 
+
+async def _capture_preview_video(engine: CaptureEngine, preview_video_file_path: str, input_args: List[str],
+                                 stream_name: str, poster_file_path: Optional[str] = None,
+                                 edge: Optional[str] = None) -> Optional[CaptureMetrics]:
     try:
-        os.system(ffmpeg_cmd)
+        args = _get_capture_args(preview_video_file_path, input_args, poster_file_path)
+        result = await engine.capture(args, stream_name, edge)
+        if result.returncode:
+            log.warning(f'{stream_name}: ffmpeg exited with code {result.returncode}')
+        log.info(f'{stream_name}: capture metrics: {result.metrics}')
+        return result.metrics
+    except EdgeBusyError:
+        raise
     except Exception as e:
         log.error(f'{stream_name}: _capture_preview_video: {e}')
         raise
@@ -133,29 +301,20 @@ def _is_valid_stream(chat_type: ChatTypeEnum) -> bool:
         return True
 
 
-def _is_preview_video_size_valid(preview_video_file_path: str) -> bool:
-    file_size = os.path.getsize(preview_video_file_path)
-    return file_size > config.PREVIEW_VIDEO_FILE_SIZE_THRESHOLD
+def _probe_preview_video(preview_video_file_path: str) -> Optional[mp4.Mp4Info]:
+    try:
+        return mp4.probe(preview_video_file_path)
+    except (OSError, ValueError, mp4.Mp4Error) as e:
+        log.warning(f'{preview_video_file_path}: can not read preview video: {e}')
+        return None
 
 
-def _is_blurry(preview_video_file_path: str) -> bool:
-    bash_cmd = f'ffprobe -v error -select_streams v:0 -show_entries stream=bit_rate,r_frame_rate,avg_frame_rate '\
-               f'-print_format json "{preview_video_file_path}"'
-    data = sp.run(shlex.split(bash_cmd), stdout=sp.PIPE).stdout
-    dict_data = json.loads(data)
-    try:
-        bit_rate = int(dict_data['streams'][0]['bit_rate'])
-        r_frame_rate1, r_frame_rate2 = dict_data['streams'][0]['r_frame_rate'].split('/')
-        r_frame_rate = int(r_frame_rate1) / int(r_frame_rate2)
-        avg_frame_rate1, avg_frame_rate2 = dict_data['streams'][0]['avg_frame_rate'].split('/')
-        avg_frame_rate = int(avg_frame_rate1) / int(avg_frame_rate2)
-        if (r_frame_rate <= 11 or avg_frame_rate <= 11 or bit_rate < 450000):
-            return True
-        else:
-            return False
-    except Exception as e:
-        log.error(f'{bash_cmd}: _is_blurry() : {e}')
-        raise
+def _is_preview_video_size_valid(info: mp4.Mp4Info) -> bool:
+    return info.size > config.PREVIEW_VIDEO_FILE_SIZE_THRESHOLD and info.keyframe_count > 0
+
+
+def _is_blurry(info: mp4.Mp4Info) -> bool:
+    return info.avg_frame_rate <= 11 or info.bit_rate < 450000
 
 
 def _get_preview_video_symlink_file_name(stream_name: str) -> str:
@@ -164,82 +323,455 @@ def _get_preview_video_symlink_file_name(stream_name: str) -> str:
 
 def _get_preview_video_symlink_file_path(stream_name: str) -> str:
     file_name = _get_preview_video_symlink_file_name(stream_name)
-    return os.path.join(config.PREVIEW_VIDEO_STORAGE_PATH, file_name)
+    return os.path.join(_get_shard_directory(config.PREVIEW_VIDEO_STORAGE_PATH, stream_name), file_name)
+
+
+def _replace_symlink(target_path: str, symlink_file_path: str) -> None:
+    """Atomically point `symlink_file_path` to `target_path`, readers never see a missing link."""
+    # unique per call, captures of one process are published from executor threads concurrently
+    tmp_symlink_file_path = f'{symlink_file_path}.{uuid.uuid4().hex}.tmp'
+    try:
+        os.symlink(target_path, tmp_symlink_file_path)
+        os.replace(tmp_symlink_file_path, symlink_file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_symlink_file_path)
+        except FileNotFoundError:
+            pass
+        raise
 
 
 def _update_preview_video_symlink(stream_name: str, preview_video_file_path: str) -> None:
     try:
         symlink_file_path = _get_preview_video_symlink_file_path(stream_name)
-        update_symlink_cmd = f'ln -sfn {preview_video_file_path} {symlink_file_path}'
-        os.system(update_symlink_cmd)
+        _replace_symlink(preview_video_file_path, symlink_file_path)
     except Exception as e:
         log.error(f'{stream_name}: _update_preview_video_symlink: {e}')
         raise
 
 
-def _is_old_preview_videos(stream_name: str, filename: str, exclusive_file_names: List[str]) -> bool:
-    return ((stream_name in filename) and (filename not in exclusive_file_names))
+def _get_shard_directory(directory: str, stream_name: str) -> str:
+    # two levels of a hash prefix keep directories small, nginx maps public URLs the same way (nginx/njs/shard.js)
+    digest = hashlib.md5(stream_name.lower().encode('utf-8')).hexdigest()
+    return os.path.join(directory, digest[:2], digest[2:4])
+
+
+def _get_stream_directory(directory: str, stream_name: str) -> str:
+    # every stream keeps its files in its own directory, next to the published symlink
+    return os.path.join(_get_shard_directory(directory, stream_name), stream_name.lower())
+
+
+def _cleanup_stream_files(stream_directory: str, exclusive_file_names: List[str]) -> None:
+    cleanup_files(directory=stream_directory,
+                  file_filter=(lambda filename, file_stat: filename not in exclusive_file_names))
 
 
 def _cleanup_preview_videos(stream_name: str, exclusive_file_names: List[str]) -> None:
     log.info(f'{stream_name}: _cleanup_preview_videos start')
-    cleanup_files(directory=config.PREVIEW_VIDEO_STORAGE_PATH,
-                  file_filter=(lambda filename, file_stat:
-                               _is_old_preview_videos(stream_name, filename, exclusive_file_names)))
+    _cleanup_stream_files(_get_preview_video_directory(stream_name), exclusive_file_names)
     log.info(f'{stream_name}: _cleanup_preview_videos end')
 
 
-def _get_preview_video_file_path(preview_video_name: str) -> str:
-    return os.path.join(config.PREVIEW_VIDEO_STORAGE_PATH, preview_video_name)
+def _get_preview_video_directory(stream_name: str) -> str:
+    return _get_stream_directory(config.PREVIEW_VIDEO_STORAGE_PATH, stream_name)
 
 
-@celery_app.task(soft_time_limit=config.PREVIEW_VIDEO_UPDATE_PERIOD,
-                 expires=config.PREVIEW_VIDEO_UPDATE_PERIOD, ignore_result=True)
-def make_preview_video(stream_name: str) -> None:
+def _get_preview_video_file_path(stream_name: str, preview_video_name: str) -> str:
+    return os.path.join(_get_preview_video_directory(stream_name), preview_video_name)
+
+
+def _get_preview_snapshot_directory(extension: str, width: int) -> str:
+    return os.path.join(config.PREVIEW_SNAPSHOT_STORAGE_PATH, extension, str(width))
+
+
+def _get_preview_snapshot_directories() -> List[str]:
+    return [_get_preview_snapshot_directory(extension, width)
+            for extension in config.PREVIEW_SNAPSHOT_FORMATS
+            for width in config.PREVIEW_SNAPSHOT_WIDTHS]
+
+
+def _get_preview_snapshot_name(preview_video_name: str, extension: str) -> str:
+    name = os.path.splitext(preview_video_name)[0].replace('preview_video_', 'preview_snapshot_', 1)
+    return f'{name}.{extension}'
+
+
+def _get_preview_snapshot_symlink_file_name(stream_name: str, extension: str) -> str:
+    return f'{stream_name.lower()}.{extension}'
+
+
+def _get_preview_snapshot_symlink_file_path(stream_name: str, extension: str, width: int) -> str:
+    return os.path.join(_get_shard_directory(_get_preview_snapshot_directory(extension, width), stream_name),
+                        _get_preview_snapshot_symlink_file_name(stream_name, extension))
+
+
+def _is_preview_unchanged(stream_name: str, poster_file_path: str) -> bool:
+    """Whether the new poster frame looks like the published snapshot, i.e. the stream is static or paused.
+    Previews captured more than `PREVIEW_VIDEO_DEDUPE_MAX_AGE` seconds ago are never considered unchanged.
+    """
+    if config.PREVIEW_VIDEO_DEDUPE_MAX_DISTANCE < 0:
+        return False
+
     try:
-        log.info(f'{stream_name}: make_preview_video start')
+        # the symlink is touched on every dedupe, the file itself keeps the time it was captured
+        captured_at = os.stat(_get_preview_video_symlink_file_path(stream_name)).st_mtime
+    except FileNotFoundError:
+        return False
+    if time.time() - captured_at > config.PREVIEW_VIDEO_DEDUPE_MAX_AGE:
+        return False
 
-        stream = _get_stream(stream_name)
-        if not _is_valid_stream(stream.chat_type):
-            return
+    published_snapshot_file_path = _get_preview_snapshot_symlink_file_path(
+        stream_name, config.PREVIEW_SNAPSHOT_FORMATS[0], config.PREVIEW_SNAPSHOT_WIDTHS[0])
+    try:
+        distance = get_distance(get_fingerprint(poster_file_path), get_fingerprint(published_snapshot_file_path))
+    except FileNotFoundError:
+        return False
+    except OSError as e:
+        log.warning(f'{stream_name}: can not fingerprint preview: {e}')
+        return False
 
-        ensure_exists(config.PREVIEW_VIDEO_STORAGE_PATH)
-        new_preview_video_name = _get_preview_video_name(stream_name)
-        new_preview_video_file_path = _get_preview_video_file_path(new_preview_video_name)
+    log.info(f'{stream_name}: preview fingerprint distance: {distance}')
+    return distance <= config.PREVIEW_VIDEO_DEDUPE_MAX_DISTANCE
 
-        rtmp_url = _get_rtmp_url(stream)
-        _capture_preview_video(new_preview_video_file_path, rtmp_url, stream_name)
 
-        symlink_file_name = _get_preview_video_symlink_file_name(stream_name)
-        exclusive_file_names = [symlink_file_name]
-        if _is_preview_video_size_valid(new_preview_video_file_path) and not _is_blurry(new_preview_video_file_path):
-            _update_preview_video_symlink(stream_name, new_preview_video_file_path)
-            exclusive_file_names.append(new_preview_video_name)
-            log.info('keep new video: {new_preview_video_name}')
-        else:
-            symlink_file_path = _get_preview_video_symlink_file_path(stream_name)
-            existing_preview_video_name = os.path.realpath(symlink_file_path).split('/')[-1]
-            exclusive_file_names.append(existing_preview_video_name)
-            log.info('keep old video: {existing_preview_video_name}')
-        _cleanup_preview_videos(stream_name, exclusive_file_names)
-    except SoftTimeLimitExceeded:
-        log.error(f'{stream_name}: Failed to create preview video within the time specified.')
+def _touch_published_preview(stream_name: str) -> None:
+    # symlink mtime is the time the preview was last confirmed, see _get_preview_video_published_at
+    symlink_file_paths = [_get_preview_video_symlink_file_path(stream_name)]
+    symlink_file_paths += [_get_preview_snapshot_symlink_file_path(stream_name, extension, width)
+                           for extension in config.PREVIEW_SNAPSHOT_FORMATS
+                           for width in config.PREVIEW_SNAPSHOT_WIDTHS]
+    for symlink_file_path in symlink_file_paths:
+        try:
+            os.utime(symlink_file_path, follow_symlinks=False)
+        except FileNotFoundError:
+            pass
+
+
+def _publish_preview_snapshots(stream_name: str, preview_video_name: str, poster_file_path: str) -> None:
+    targets = []
+    for extension in config.PREVIEW_SNAPSHOT_FORMATS:
+        snapshot_name = _get_preview_snapshot_name(preview_video_name, extension)
+        for width in config.PREVIEW_SNAPSHOT_WIDTHS:
+            stream_directory = _get_stream_directory(_get_preview_snapshot_directory(extension, width), stream_name)
+            ensure_exists(stream_directory)
+            targets.append(SnapshotTarget(file_path=os.path.join(stream_directory, snapshot_name),
+                                          width=width, extension=extension))
+
+    manifest.add(target.file_path for target in targets)
+    save_snapshots(poster_file_path, targets, config.PREVIEW_SNAPSHOT_QUALITY)
+
+    for target in targets:
+        stream_directory, snapshot_name = os.path.split(target.file_path)
+        symlink_file_name = _get_preview_snapshot_symlink_file_name(stream_name, target.extension)
+        # the symlink goes to the shard directory, the parent of the stream directory
+        _replace_symlink(target.file_path, os.path.join(os.path.dirname(stream_directory), symlink_file_name))
+        _cleanup_stream_files(stream_directory, [snapshot_name])
+    log.info(f'{stream_name}: published {len(targets)} snapshots')
+
+
+def _publish_preview_video(stream_name: str, new_preview_video_name: str, metrics: Optional[CaptureMetrics],
+                           poster_file_path: Optional[str] = None) -> None:
+    try:
+        _publish_preview_video_file(stream_name, new_preview_video_name, metrics, poster_file_path)
+    finally:
+        if poster_file_path:
+            try:
+                os.unlink(poster_file_path)
+            except FileNotFoundError:
+                pass
+
+
+def _publish_preview_video_file(stream_name: str, new_preview_video_name: str, metrics: Optional[CaptureMetrics],
+                                poster_file_path: Optional[str]) -> None:
+    new_preview_video_file_path = _get_preview_video_file_path(stream_name, new_preview_video_name)
+    exclusive_file_names = []
+    # no progress reported means ffmpeg did not produce anything, skip probing the file
+    info = _probe_preview_video(new_preview_video_file_path) if metrics is not None else None
+    publish = info is not None and _is_preview_video_size_valid(info) and not _is_blurry(info)
+    if publish and poster_file_path and _is_preview_unchanged(stream_name, poster_file_path):
+        # republishing the same picture only costs writes, cache invalidation and client downloads
+        _touch_published_preview(stream_name)
+        publish = False
+    if publish:
+        _update_preview_video_symlink(stream_name, new_preview_video_file_path)
+        exclusive_file_names.append(new_preview_video_name)
+        log.info(f'keep new video: {new_preview_video_name}')
+        if poster_file_path:
+            try:
+                _publish_preview_snapshots(stream_name, new_preview_video_name, poster_file_path)
+            except Exception as e:
+                log.error(f'{stream_name}: _publish_preview_snapshots: {e}')
+    else:
+        symlink_file_path = _get_preview_video_symlink_file_path(stream_name)
+        existing_preview_video_name = os.path.realpath(symlink_file_path).split('/')[-1]
+        exclusive_file_names.append(existing_preview_video_name)
+        log.info(f'keep old video: {existing_preview_video_name}')
+    _cleanup_preview_videos(stream_name, exclusive_file_names)
+
+
+async def _capture_and_publish_preview_video(engine: CaptureEngine, stream_name: str, input_args: List[str],
+                                             edge: Optional[str] = None) -> None:
+    ensure_exists(_get_preview_video_directory(stream_name))
+    new_preview_video_name = _get_preview_video_name(stream_name)
+    new_preview_video_file_path = _get_preview_video_file_path(stream_name, new_preview_video_name)
+    poster_file_path = _get_poster_file_path(new_preview_video_file_path) if _is_snapshot_enabled() else None
+    manifest.add(filter(None, [new_preview_video_file_path, poster_file_path]))
+
+    metrics = await _capture_preview_video(engine, new_preview_video_file_path, input_args, stream_name,
+                                           poster_file_path, edge)
+
+    # validation, symlink update and cleanup are blocking, keep them off the event loop
+    await asyncio.get_event_loop().run_in_executor(None, _publish_preview_video,
+                                                   stream_name, new_preview_video_name, metrics, poster_file_path)
+
+
+async def _make_preview_video(engine: CaptureEngine, stream_name: str, stream: Optional[StreamSession] = None) -> None:
+    try:
+        log.info(f'{stream_name}: make_preview_video start')
+
+        if stream is None:
+            stream = await _get_stream(stream_name)
+        if stream is None or not _is_valid_stream(stream.chat_type):
+            return
+
+        await _capture_and_publish_preview_video(engine, stream_name, _get_rtmp_input_args(stream), stream.subdomain)
+    except (asyncio.CancelledError, SoftTimeLimitExceeded):
+        raise
+    except EdgeBusyError as e:
+        log.warning(f'{stream_name}: capture skipped: {e}')
     except Exception as e:
         log.error(f'{stream_name}: make_preview_video error: {e}')
     finally:
         log.info(f'{stream_name}: make_preview_video end')
 
 
+async def _make_preview_videos(stream_names: List[str], streams: Optional[Dict[str, StreamSession]] = None) -> None:
+    engine = CaptureEngine(config.PREVIEW_VIDEO_CAPTURE_CONCURRENCY, config.PREVIEW_VIDEO_CAPTURE_TIMEOUT,
+                           supervisor, edge_limiter)
+    jobs = [partial(_make_preview_video, engine, stream_name) for stream_name in stream_names]
+    jobs += [partial(_make_preview_video, engine, stream_name, stream)
+             for stream_name, stream in (streams or {}).items()]
+    await engine.run(jobs)
+
+
+async def _cut_preview_video(engine: CaptureEngine, recorder: SegmentRecorder, stream_name: str) -> None:
+    try:
+        segment_paths = recorder.get_latest_segments(stream_name, config.PREVIEW_VIDEO_DURATION)
+        if segment_paths is None:
+            log.info(f'{stream_name}: not enough segments recorded yet')
+            return
+
+        await _capture_and_publish_preview_video(engine, stream_name, recorder.get_cut_input_args(segment_paths))
+    except (asyncio.CancelledError, SoftTimeLimitExceeded):
+        raise
+    except Exception as e:
+        log.error(f'{stream_name}: _cut_preview_video error: {e}')
+
+
+def _run_until_complete(coroutine: Coroutine) -> Any:
+    loop = asyncio.get_event_loop()
+    task = asyncio.ensure_future(coroutine, loop=loop)
+    try:
+        return loop.run_until_complete(task)
+    finally:
+        if not task.done():
+            # e.g. SoftTimeLimitExceeded was raised while the loop was running, kill the captures in flight
+            task.cancel()
+            loop.run_until_complete(asyncio.wait([task]))
+
+
+def dispatch_preview_video(stream: StreamSession) -> bool:
+    """Dispatch a capture of a stream which just came online, see `tasks.events`. Not for private shows.
+    Event driven tasks jump ahead of the scheduler's backlog.
+    """
+    if not _is_valid_stream(stream.chat_type):
+        return False
+    make_preview_videos.apply_async(
+        kwargs={
+            'streams': {stream.stream_name: stream.to_dict()},
+        },
+        ignore_result=True,
+        priority=Priority.HIGH.value,
+    )
+    return True
+
+
+def dispatch_retirement(stream_name: str, went_offline_at: float) -> None:
+    retire_preview_videos.apply_async(
+        kwargs={
+            'stream_names': [stream_name],
+            'went_offline_at': went_offline_at,
+        },
+        ignore_result=True,
+        expires=config.PREVIEW_VIDEO_MIN_AGE,  # the stream may be back online by then
+        priority=Priority.HIGH.value,
+    )
+
+
+@celery_app.task(ignore_result=True)
+def retire_preview_videos(stream_names: List[str], went_offline_at: Optional[float] = None) -> None:
+    for stream_name in stream_names:
+        _retire_published_preview(stream_name, went_offline_at)
+
+
+@celery_app.task(soft_time_limit=config.PREVIEW_VIDEO_UPDATE_PERIOD,
+                 expires=config.PREVIEW_VIDEO_UPDATE_PERIOD, ignore_result=True)
+def make_preview_videos(stream_names: List[str] = (), streams: Optional[Dict[str, dict]] = None) -> None:
+    """`streams` are sessions of the streams fetched by the dispatcher, see `StreamSession.to_dict`,
+    sessions of `stream_names` are fetched here.
+    """
+    streams = {stream_name: StreamSession.from_dict(stream) for stream_name, stream in (streams or {}).items()}
+    count = len(stream_names) + len(streams)
+    try:
+        log.info(f'make_preview_videos start: {count} streams')
+        _run_until_complete(_make_preview_videos(stream_names, streams))
+    except SoftTimeLimitExceeded:
+        supervisor.kill_all()
+        log.error(f'make_preview_videos: Failed to create {count} preview videos '
+                  'within the time specified.')
+    finally:
+        log.info('make_preview_videos end')
+
+
+@celery_app.task(soft_time_limit=config.PREVIEW_VIDEO_UPDATE_PERIOD,
+                 expires=config.PREVIEW_VIDEO_UPDATE_PERIOD, ignore_result=True)
+def make_preview_video(stream_name: str) -> None:
+    try:
+        _run_until_complete(_make_preview_videos([stream_name]))
+    except SoftTimeLimitExceeded:
+        supervisor.kill_all()
+        log.error(f'{stream_name}: Failed to create preview video within the time specified.')
+
+
 def _is_preview_video_expired(current_time: int, modified_time: int):
     return (current_time - modified_time) > config.PREVIEW_VIDEO_EXPIRE_PERIOD
 
 
+def _remove_expired_file(file_path: str) -> None:
+    stream_directory = os.path.dirname(file_path)
+    # the stream's symlink is next to its directory, e.g. a7/0f/anna.mp4 -> a7/0f/anna/preview_video_..._anna.mp4
+    symlink_file_path = f'{stream_directory}{os.path.splitext(file_path)[1]}'
+    try:
+        is_published = os.readlink(symlink_file_path) == file_path
+        refreshed_at = os.lstat(symlink_file_path).st_mtime
+    except OSError:
+        is_published = False  # no symlink
+
+    if is_published:
+        if not _is_preview_video_expired(time.time(), refreshed_at):
+            # still current, the stream was confirmed unchanged lately, see _is_preview_unchanged
+            manifest.add([file_path])
+            return
+        # nothing newer was published for the stream, take the preview down,
+        # unless a capture or a retirement got to the symlink meanwhile
+        try:
+            if os.readlink(symlink_file_path) == file_path:
+                os.unlink(symlink_file_path)
+        except FileNotFoundError:
+            pass
+
+    try:
+        os.unlink(file_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.rmdir(stream_directory)
+    except OSError:
+        pass  # not empty
+
+
+def _cleanup_expired_files(directory: str, current_time: float) -> None:
+    """Remove expired files of the whole tree: shard and stream directories as well as the legacy flat layout."""
+    # symlinks first: a symlink is only recognized as expired while its target still exists,
+    # symlinks are always one level above their targets
+    cleanup_files(directory=directory,
+                  file_filter=(lambda filename, file_stat:
+                               _is_preview_video_expired(current_time, file_stat.st_mtime)))
+    try:
+        with os.scandir(directory) as it:
+            subdirectories = [entry.path for entry in it if entry.is_dir(follow_symlinks=False)]
+    except FileNotFoundError:
+        return
+
+    for subdirectory in subdirectories:
+        _cleanup_expired_files(subdirectory, current_time)
+        try:
+            os.rmdir(subdirectory)
+        except OSError:
+            pass  # not empty
+
+
 @celery_app.task(expires=config.PREVIEW_VIDEO_CLEAN_PERIOD, ignore_result=True)
 def cleanup_preview_videos():
     log.info('cleanup_preview_videos start')
-    ensure_exists(config.PREVIEW_VIDEO_STORAGE_PATH)
+    removed = manifest.expire(config.PREVIEW_VIDEO_EXPIRE_PERIOD, _remove_expired_file)
+    log.info(f'cleanup_preview_videos end: {removed} files expired')
+
+
+@celery_app.task(ignore_result=True)
+def sweep_preview_storage():
+    """Expire files by scanning the whole storage, for files the manifest does not know, e.g. of former layouts."""
+    log.info('sweep_preview_storage start')
     current_time = time.time()
-    cleanup_files(directory=config.PREVIEW_VIDEO_STORAGE_PATH,
-                  file_filter=(lambda filename, file_stat:
-                               _is_preview_video_expired(current_time, file_stat.st_mtime)))
-    log.info('cleanup_preview_videos end')
+    for directory in [config.PREVIEW_VIDEO_STORAGE_PATH, *_get_preview_snapshot_directories()]:
+        _cleanup_expired_files(directory, current_time)
+    log.info('sweep_preview_storage end')
+
+
+def _migrate_flat_symlinks(directory: str) -> int:
+    """Move published files of the flat layout into shards, the rest of the flat layout is left to expire."""
+    with os.scandir(directory) as it:
+        symlinks = [(entry.name, entry.path) for entry in it if entry.is_symlink()]
+
+    migrated = 0
+    for symlink_file_name, symlink_file_path in symlinks:
+        stream_name = os.path.splitext(symlink_file_name)[0]
+        target_path = os.path.realpath(symlink_file_path)
+        shard_symlink_file_path = os.path.join(_get_shard_directory(directory, stream_name), symlink_file_name)
+        # a stream published since the deploy already has its symlink in the shard, do not overwrite it
+        if os.path.isfile(target_path) and not os.path.lexists(shard_symlink_file_path):
+            stream_directory = _get_stream_directory(directory, stream_name)
+            ensure_exists(stream_directory)
+            new_target_path = os.path.join(stream_directory, os.path.basename(target_path))
+            manifest.add([new_target_path])
+            os.replace(target_path, new_target_path)
+            try:
+                os.symlink(new_target_path, shard_symlink_file_path)
+                migrated += 1
+            except FileExistsError:
+                pass  # published meanwhile, the moved file is cleaned up with the stream's next publish
+        os.unlink(symlink_file_path)
+    return migrated
+
+
+@celery_app.task(ignore_result=True)
+def migrate_preview_storage():
+    log.info('migrate_preview_storage start')
+    for directory in [config.PREVIEW_VIDEO_STORAGE_PATH, *_get_preview_snapshot_directories()]:
+        try:
+            migrated = _migrate_flat_symlinks(directory)
+        except FileNotFoundError:
+            log.info(f'{directory} does not exist, nothing to migrate.')
+            continue
+        log.info(f'migrate_preview_storage: {directory}: {migrated} published files moved to shards')
+    log.info('migrate_preview_storage end')
+
+
+@celery_app.task(expires=config.PREVIEW_VIDEO_CLEAN_PERIOD, ignore_result=True)
+def audit_preview_videos():
+    log.info('audit_preview_videos start')
+    published, invalid, blurry = 0, [], []
+    # published symlinks live in the shard directories, see _get_shard_directory
+    for symlink_file_path in glob.iglob(os.path.join(config.PREVIEW_VIDEO_STORAGE_PATH, '??', '??', '*.mp4')):
+        if not os.path.islink(symlink_file_path):
+            continue
+        published += 1
+        symlink_file_name = os.path.basename(symlink_file_path)
+        info = _probe_preview_video(symlink_file_path)
+        if info is None or not _is_preview_video_size_valid(info):
+            invalid.append(symlink_file_name)
+        elif _is_blurry(info):
+            blurry.append(symlink_file_name)
+
+    log.info(f'audit_preview_videos: {published} published, {len(invalid)} invalid, {len(blurry)} blurry',
+             extra={'data': {'invalid': invalid, 'blurry': blurry}})
+    log.info('audit_preview_videos end')
@@ -0,0 +1,83 @@
+import asyncio
+import sys
+import unittest
+
+import asynctest
+from parameterized import parameterized
+
+from tasks.capture import CaptureEngine, CaptureMetrics
+
+
+class TestCaptureMetrics(unittest.TestCase):
+
+    def test_from_progress(self):
+        progress = {'frame': '250', 'total_size': '1250000', 'out_time_ms': '10000000', 'progress': 'end'}
+        self.assertEqual(CaptureMetrics.from_progress(progress),
+                         CaptureMetrics(frames=250, duration=10, size=1250000, bit_rate=1000000, avg_frame_rate=25))
+
+    def test_from_progress_prefers_out_time_us(self):
+        progress = {'frame': '100', 'total_size': '1000', 'out_time_us': '4000000', 'out_time_ms': '1'}
+        self.assertEqual(CaptureMetrics.from_progress(progress).duration, 4)
+
+    def test_from_progress_without_frames(self):
+        progress = {'total_size': '1250000', 'out_time_us': '10000000', 'progress': 'end'}
+        self.assertEqual(CaptureMetrics.from_progress(progress),
+                         CaptureMetrics(frames=None, duration=10, size=1250000, bit_rate=1000000, avg_frame_rate=None))
+
+    @parameterized.expand((
+        ({},),
+        ({'frame': '1', 'total_size': '1'},),
+        ({'frame': 'N/A', 'total_size': '1', 'out_time_ms': '1'},),
+        ({'frame': '0', 'total_size': '0', 'out_time_ms': '0'},),
+    ))
+    def test_from_progress_incomplete(self, progress):
+        self.assertIsNone(CaptureMetrics.from_progress(progress))
+
+
+class TestCaptureEngine(asynctest.TestCase):
+
+    async def test_run_limits_concurrency(self):
+        engine = CaptureEngine(concurrency=2, timeout=1)
+        running, max_running, done = 0, 0, []
+
+        async def job(i):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            done.append(i)
+
+        await engine.run((lambda i=i: job(i)) for i in range(5))
+
+        self.assertEqual(max_running, 2)
+        self.assertCountEqual(done, range(5))
+
+    async def test_run_without_jobs(self):
+        engine = CaptureEngine(concurrency=2, timeout=1)
+        await engine.run([])
+
+    async def test_run_propagates_job_exception(self):
+        async def job():
+            raise IndexError
+
+        engine = CaptureEngine(concurrency=2, timeout=1)
+        with self.assertRaises(IndexError):
+            await engine.run([job])
+
+    async def test_capture_returns_exit_code(self):
+        engine = CaptureEngine(concurrency=1, timeout=5)
+        result = await engine.capture([sys.executable, '-c', 'exit(3)'], 'test')
+        self.assertEqual(result.returncode, 3)
+
+    async def test_capture_collects_progress(self):
+        engine = CaptureEngine(concurrency=1, timeout=5)
+        script = 'print("frame=1\\nprogress=continue\\nframe=250\\nbitrate=N/A\\nnoise\\nprogress=end")'
+        result = await engine.capture([sys.executable, '-c', script], 'test')
+        self.assertEqual(result.returncode, 0)
+        self.assertDictEqual(result.progress, {'frame': '250', 'bitrate': 'N/A', 'progress': 'end'})
+
+    async def test_capture_kills_process_on_timeout(self):
+        engine = CaptureEngine(concurrency=1, timeout=0.1)
+        result = await engine.capture([sys.executable, '-c', 'import time; time.sleep(10)'], 'test')
+        self.assertEqual(result.returncode, -9)
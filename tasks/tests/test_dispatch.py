@@ -0,0 +1,41 @@
+import unittest
+from unittest import mock
+
+import tasks.tasks as tasks_module
+from common.cams.objects import ChatTypeEnum, StreamSession
+from common.celery.enums import Priority
+
+
+class TestDispatch(unittest.TestCase):
+    @mock.patch.object(tasks_module.make_preview_videos, 'apply_async')
+    def test_dispatch_preview_video(self, apply_async):
+        stream = StreamSession(stream_name='Anna', subdomain='edge1', chat_type=ChatTypeEnum.FREE)
+        self.assertTrue(tasks_module.dispatch_preview_video(stream))
+        apply_async.assert_called_once_with(kwargs={'streams': {'Anna': stream.to_dict()}}, ignore_result=True,
+                                            priority=Priority.HIGH.value)
+
+        self.assertFalse(tasks_module.dispatch_preview_video(stream._replace(chat_type=ChatTypeEnum.ELSE)))
+        apply_async.assert_called_once()
+
+    @mock.patch.object(tasks_module.retire_preview_videos, 'apply_async')
+    def test_dispatch_retirement(self, apply_async):
+        with mock.patch.object(tasks_module, 'config', PREVIEW_VIDEO_MIN_AGE=300):
+            tasks_module.dispatch_retirement('Anna', 100)
+        apply_async.assert_called_once_with(kwargs={'stream_names': ['Anna'], 'went_offline_at': 100},
+                                            ignore_result=True, expires=300, priority=Priority.HIGH.value)
+
+
+class TestApplyAsyncMany(unittest.TestCase):
+    @mock.patch.object(tasks_module.celery_app, 'producer_or_acquire')
+    @mock.patch.object(tasks_module.make_preview_videos, 'apply_async')
+    def test_single_producer(self, apply_async, producer_or_acquire):
+        tasks_module._apply_async_many(tasks_module.make_preview_videos, (
+            ({'stream_names': [stream_name]}, {'countdown': countdown})
+            for stream_name, countdown in [('anna', 0), ('bella', 10)]))
+
+        producer_or_acquire.assert_called_once_with()
+        producer = producer_or_acquire.return_value.__enter__.return_value
+        self.assertEqual(apply_async.call_args_list, [
+            mock.call(kwargs={'stream_names': ['anna']}, producer=producer, countdown=0),
+            mock.call(kwargs={'stream_names': ['bella']}, producer=producer, countdown=10),
+        ])
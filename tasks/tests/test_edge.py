@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import asynctest
+
+from common.rabbit_lock import LockExistsError
+from tasks.edge import EdgeBusyError, EdgeLimiter, TokenBucket
+
+
+class FakeLock:
+    """Exclusive lock over a registry shared by all limiters, like RabbitLock's exclusive queues on one broker."""
+
+    def __init__(self, registry: set, name: str) -> None:
+        self._registry = registry
+        self._name = name
+
+    async def __aenter__(self):
+        if self._name in self._registry:
+            raise LockExistsError(self._name)
+        self._registry.add(self._name)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._registry.remove(self._name)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_reserve(self):
+        now = [0]
+        bucket = TokenBucket(rate=2, burst=2, clock=lambda: now[0])
+
+        self.assertSequenceEqual([bucket.reserve() for _ in range(4)], [0, 0, 0.5, 1])
+        now[0] = 10
+        self.assertSequenceEqual([bucket.reserve() for _ in range(3)], [0, 0, 0.5])
+
+
+class TestEdgeLimiter(asynctest.TestCase):
+
+    def setUp(self) -> None:
+        self.registry = set()
+
+    def limiter(self, max_in_flight: int = 2, wait_timeout: float = 0.2) -> EdgeLimiter:
+        return EdgeLimiter(max_in_flight, rate=0, burst=0, wait_timeout=wait_timeout,
+                           lock_factory=lambda name: FakeLock(self.registry, name), retry_interval=0.01)
+
+    async def test_max_in_flight_across_limiters(self):
+        first, second = self.limiter(), self.limiter()
+        async with first.slot('edge-a'), second.slot('edge-a'):
+            self.assertEqual(self.registry, {'edge_edge-a_0', 'edge_edge-a_1'})
+
+            with self.assertRaises(EdgeBusyError):
+                async with first.slot('edge-a'):
+                    pass
+
+            # other edges are not affected
+            async with second.slot('edge-b'):
+                pass
+
+        self.assertEqual(self.registry, set())
+
+    async def test_retries_slot_released_by_other_process(self):
+        other, limiter, released = self.limiter(max_in_flight=1), self.limiter(max_in_flight=1, wait_timeout=1), \
+            asyncio.Event()
+
+        async def hold():
+            async with other.slot('edge-a'):
+                await released.wait()
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        self.loop.call_later(0.05, released.set)
+        async with limiter.slot('edge-a'):
+            self.assertTrue(holder.done())
+
+    async def test_does_not_wait_for_own_slots(self):
+        limiter = self.limiter(max_in_flight=1, wait_timeout=10)
+        async with limiter.slot('edge-a'):
+            with self.assertRaises(EdgeBusyError):
+                await asyncio.wait_for(limiter.slot('edge-a').__aenter__(), 0.1)
+
+    @asynctest.patch('tasks.edge.RabbitLock')
+    @asynctest.patch('tasks.edge.ConnectionPool')
+    async def test_locks_share_connection_pool(self, pool_cls, lock_cls):
+        lock_cls.return_value.__aenter__ = asynctest.CoroutineMock()
+        lock_cls.return_value.__aexit__ = asynctest.CoroutineMock()
+        pool_cls.return_value.close = asynctest.CoroutineMock()
+        limiter = EdgeLimiter(2, rate=0, burst=0, wait_timeout=0, connection_pool_size=3)
+        async with limiter.slot('edge-a'), limiter.slot('edge-b'):
+            pass
+
+        pool_cls.assert_called_once_with(mock.ANY, max_size=3)
+        self.assertEqual(lock_cls.call_count, 2)
+        for call in lock_cls.call_args_list:
+            self.assertIs(call[1]['connection_pool'], pool_cls.return_value)
+
+        await limiter.close()
+        pool_cls.return_value.close.assert_called_once_with()
+
+    async def test_disabled(self):
+        limiter = self.limiter(max_in_flight=0)
+        async with limiter.slot('edge-a'), limiter.slot('edge-a'):
+            self.assertEqual(self.registry, set())
@@ -0,0 +1,73 @@
+import unittest
+from unittest import mock
+
+import asynctest
+import ujson
+
+from common.cams.objects import ChatTypeEnum, StreamSession
+from tasks.events import InMemoryEventSource, StreamEvent, StreamEventConsumer
+
+
+def event(event_type: str, stream_name: str = 'Anna', online: str = '1', timestamp: float = 100) -> bytes:
+    return ujson.dumps({'type': event_type, 'stream_name': stream_name, 'subdomain': 'edge1', 'online': online,
+                        'timestamp': timestamp})
+
+
+class TestStreamEvent(unittest.TestCase):
+    def test_from_json(self):
+        self.assertEqual(StreamEvent.from_json(event('start'), 200),
+                         StreamEvent(type='start', stream_name='Anna', subdomain='edge1', chat_type=ChatTypeEnum.FREE,
+                                     timestamp=100))
+        self.assertEqual(StreamEvent.from_json(b'{"type": "stop", "stream_name": "Anna"}', 200),
+                         StreamEvent(type='stop', stream_name='Anna', subdomain=None, chat_type=None, timestamp=200))
+        with self.assertRaises(ValueError):
+            StreamEvent.from_json(event('unknown'), 200)
+        with self.assertRaises(KeyError):
+            StreamEvent.from_json(b'{"type": "start", "stream_name": "Anna"}', 200)
+
+
+class TestStreamEventConsumer(asynctest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0
+        self.source = InMemoryEventSource()
+        self.capture = mock.Mock(return_value=True)
+        self.retire = mock.Mock()
+        self.consumer = StreamEventConsumer(self.source, self.capture, self.retire,
+                                            lambda chat_type: chat_type is not ChatTypeEnum.ELSE, min_interval=60,
+                                            clock=lambda: self.now)
+
+    async def consume(self, *bodies: bytes) -> None:
+        for body in bodies:
+            self.source.publish(body)
+        self.source.close()
+        await self.consumer.run()
+
+    async def test_start_and_stop(self):
+        await self.consume(event('start'), event('chat_type', stream_name='anna'), event('stop'), event('start'))
+
+        self.assertEqual(self.capture.call_args_list, [
+            mock.call(StreamSession(stream_name='Anna', subdomain='edge1', chat_type=ChatTypeEnum.FREE)),
+        ] * 2)
+        self.retire.assert_called_once_with('Anna', 100)
+
+    async def test_min_interval(self):
+        self.capture.side_effect = [False, True, True]
+        await self.consume(event('start'), event('chat_type'), event('chat_type'))
+        self.assertEqual(self.capture.call_count, 2)  # the first capture was not dispatched, so it is not tracked
+
+        self.now = 60
+        self.source = self.consumer._source = InMemoryEventSource()
+        await self.consume(event('chat_type'))
+        self.assertEqual(self.capture.call_count, 3)
+
+    async def test_private_show_retires_preview(self):
+        # within min_interval of the capture, still retired at once
+        await self.consume(event('start'), event('chat_type', online='9', timestamp=150), event('chat_type'))
+
+        self.retire.assert_called_once_with('Anna', 150)
+        self.assertEqual(self.capture.call_count, 2)  # back to a public show, captured again at once
+
+    async def test_errors(self):
+        self.capture.side_effect = [ValueError, True]
+        await self.consume(b'not json', event('start', stream_name='Bella'), event('start'))
+        self.assertEqual(self.capture.call_count, 2)
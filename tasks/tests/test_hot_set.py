@@ -0,0 +1,65 @@
+import asyncio
+from unittest import mock
+
+import asynctest
+
+from common.cams.objects import ChatTypeEnum, StreamSession
+from tasks.capture import CaptureEngine
+from tasks.hot_set import HotSetRecorder
+
+
+def session(stream_name: str, subdomain: str = 'edge1') -> StreamSession:
+    return StreamSession(stream_name=stream_name, subdomain=subdomain, chat_type=ChatTypeEnum.FREE)
+
+
+class TestHotSetRecorder(asynctest.TestCase):
+
+    def setUp(self) -> None:
+        self.recording = set()
+
+        async def record(name: str, input_url: str, duration: float) -> None:
+            self.recording.add(input_url)
+            try:
+                await asyncio.sleep(duration)
+            finally:
+                self.recording.discard(input_url)
+
+        self.recorder = mock.Mock(record=record)
+        self.get_hot_set = asynctest.CoroutineMock()
+        self.stale = set()
+        self.cut = asynctest.CoroutineMock()
+        self.hot_set_recorder = HotSetRecorder(self.recorder, CaptureEngine(2, 10), self.get_hot_set,
+                                               lambda stream: f'rtmp://{stream.subdomain}/{stream.stream_name}',
+                                               lambda stream_name: stream_name in self.stale, self.cut,
+                                               refresh_period=60)
+
+    async def refresh(self, *streams: StreamSession) -> None:
+        self.get_hot_set.return_value = list(streams)
+        await self.hot_set_recorder.refresh()
+        await asyncio.sleep(0)
+
+    async def test_refresh_follows_hot_set(self):
+        self.stale = {'bella'}
+        await self.refresh(session('anna'), session('bella'))
+        self.assertEqual(self.recording, {'rtmp://edge1/anna', 'rtmp://edge1/bella'})
+        self.cut.assert_called_once_with('bella')
+
+        # bella left the hot set, anna moved to another edge
+        self.stale = set()
+        await self.refresh(session('anna', 'edge2'), session('carla'))
+        self.assertEqual(self.recording, {'rtmp://edge2/anna', 'rtmp://edge1/carla'})
+        self.assertEqual(self.recorder.discard.call_args_list, [mock.call('anna'), mock.call('bella')])
+        self.assertEqual(self.cut.call_count, 1)
+
+        await self.hot_set_recorder.close()
+        self.assertEqual(self.recording, set())
+        self.recorder.close.assert_called_once_with()
+
+    async def test_failed_recorder_is_restarted(self):
+        self.recorder.record = asynctest.CoroutineMock(side_effect=OSError('ffmpeg not found'))
+        await self.refresh(session('anna'))
+        await self.refresh(session('anna'))
+
+        self.assertEqual(self.recorder.record.call_count, 2)
+        self.recorder.discard.assert_called_once_with('anna')
+        await self.hot_set_recorder.close()
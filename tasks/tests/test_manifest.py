@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+from tasks.manifest import ExpiryManifest
+
+
+class TestExpiryManifest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'manifest')
+        self.now = 7200
+        self.manifest = ExpiryManifest(self.path, bucket_period=3600, clock=lambda: self.now)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_add(self):
+        self.manifest.add(['/a/1.mp4', '/a/1.png'])
+        self.now = 10799
+        self.manifest.add(iter(['/b/1.mp4']))
+        self.manifest.add([])
+        self.now = 10800
+        self.manifest.add(['/c/1.mp4'])
+
+        self.assertEqual(sorted(os.listdir(self.path)), ['10800.txt', '7200.txt'])
+        with open(os.path.join(self.path, '7200.txt')) as f:
+            self.assertEqual(f.read(), '/a/1.mp4\n/a/1.png\n/b/1.mp4\n')
+
+    def test_expire(self):
+        self.manifest.add(['/a/1.mp4', '/a/1.png'])
+        self.now = 10800
+        self.manifest.add(['/b/1.mp4'])
+
+        removed = []
+        self.now = 10800 + 99
+        self.assertEqual(self.manifest.expire(100, removed.append), 0)
+
+        self.now = 10800 + 100
+        self.assertEqual(self.manifest.expire(100, removed.append), 2)
+        self.assertEqual(removed, ['/a/1.mp4', '/a/1.png'])
+        self.assertEqual(os.listdir(self.path), ['10800.txt'])
+
+    def test_expire_missing_manifest(self):
+        self.assertEqual(self.manifest.expire(100, self.fail), 0)
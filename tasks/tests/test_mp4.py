@@ -0,0 +1,98 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from tasks import mp4
+
+
+def box(box_type: bytes, *payload: bytes) -> bytes:
+    data = b''.join(payload)
+    return struct.pack('>I4s', len(data) + 8, box_type) + data
+
+
+def full_box(box_type: bytes, *payload: bytes, version: int = 0) -> bytes:
+    return box(box_type, struct.pack('>B3x', version), *payload)
+
+
+def track(handler: bytes, timescale: int = 1000, stts=((250, 40),), sizes=(5000,) * 250, stss=None,
+          mdhd_version: int = 0) -> bytes:
+    times = b'\0' * (16 if mdhd_version == 1 else 8)
+    stbl = [
+        full_box(b'stts', struct.pack(f'>I{len(stts) * 2}I', len(stts), *(v for entry in stts for v in entry))),
+        full_box(b'stsz', struct.pack(f'>II{len(sizes)}I', 0, len(sizes), *sizes)),
+    ]
+    if stss is not None:
+        stbl.append(full_box(b'stss', struct.pack(f'>I{len(stss)}I', len(stss), *stss)))
+    return box(b'trak',
+               box(b'tkhd', b'\0' * 84),
+               box(b'mdia',
+                   full_box(b'mdhd', times, struct.pack('>II', timescale, 0), version=mdhd_version),
+                   full_box(b'hdlr', b'\0' * 4, handler, b'\0' * 12),
+                   box(b'minf', box(b'stbl', *stbl))))
+
+
+def mp4_file(*tracks: bytes, mdat: bytes = b'\0' * 64) -> bytes:
+    return box(b'ftyp', b'isom\0\0\0\0') + box(b'moov', full_box(b'mvhd', b'\0' * 96), *tracks) + box(b'mdat', mdat)
+
+
+class TestParse(unittest.TestCase):
+
+    def parse(self, data: bytes) -> mp4.Mp4Info:
+        return mp4.parse(data, len(data))
+
+    def test_video_track(self):
+        data = mp4_file(track(b'soun', sizes=(100,) * 430, stts=((430, 1024),)),
+                        track(b'vide', stss=(1, 51, 101, 151, 201)))
+        self.assertEqual(self.parse(data), mp4.Mp4Info(size=len(data), duration=10, sample_count=250,
+                                                       avg_frame_rate=25, bit_rate=1000000, keyframe_count=5))
+
+    def test_without_stss_every_sample_is_keyframe(self):
+        info = self.parse(mp4_file(track(b'vide')))
+        self.assertEqual(info.keyframe_count, 250)
+
+    def test_mixed_sample_deltas(self):
+        info = self.parse(mp4_file(track(b'vide', timescale=90000, stts=((100, 6000), (150, 2400)), stss=(1,))))
+        self.assertEqual(info.sample_count, 250)
+        self.assertEqual(info.duration, 10.666666666666666)
+
+    def test_mdhd_version_1(self):
+        info = self.parse(mp4_file(track(b'vide', timescale=500, stts=((250, 20),), mdhd_version=1)))
+        self.assertEqual(info.duration, 10)
+
+    def test_moov_after_large_mdat(self):
+        mdat = struct.pack('>I4sQ', 1, b'mdat', 16 + 32) + b'\0' * 32
+        data = box(b'ftyp', b'isom') + mdat + box(b'moov', track(b'vide'))
+        self.assertEqual(self.parse(data).sample_count, 250)
+
+    def test_no_moov(self):
+        with self.assertRaises(mp4.Mp4Error):
+            self.parse(box(b'ftyp', b'isom') + box(b'mdat', b'\0' * 16))
+
+    def test_no_video_track(self):
+        with self.assertRaises(mp4.Mp4Error):
+            self.parse(mp4_file(track(b'soun')))
+
+    def test_truncated(self):
+        data = mp4_file(track(b'vide'))
+        with self.assertRaises(mp4.Mp4Error):
+            self.parse(data[:len(data) // 2])
+
+
+class TestProbe(unittest.TestCase):
+
+    def test_probe(self):
+        data = mp4_file(track(b'vide'))
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            self.assertEqual(mp4.probe(f.name).size, len(data))
+
+    def test_probe_empty_file(self):
+        with tempfile.NamedTemporaryFile() as f:
+            with self.assertRaises(mp4.Mp4Error):
+                mp4.probe(f.name)
+
+    def test_probe_missing_file(self):
+        with self.assertRaises(FileNotFoundError):
+            mp4.probe(os.path.join(tempfile.gettempdir(), 'no_such_preview_video.mp4'))
@@ -0,0 +1,79 @@
+import os
+import tempfile
+from unittest import mock
+
+import asynctest
+
+from tasks.recorder import SegmentRecorder
+from tasks.supervisor import ProcessResult
+
+PLAYLIST = '''#EXTM3U
+#EXT-X-VERSION:3
+#EXT-X-TARGETDURATION:3
+#EXT-X-MEDIA-SEQUENCE:4
+#EXTINF:2.002000,
+segment_000004.ts
+#EXTINF:2.000000,
+segment_000005.ts
+#EXTINF:2.502000,
+segment_000006.ts
+#EXTINF:1.998000,
+segment_000007.ts
+'''
+
+
+class TestSegmentRecorder(asynctest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.supervisor = mock.Mock()
+        self.recorder = SegmentRecorder(self.supervisor, self.directory.name, segment_duration=2, ring_size=7,
+                                        restart_delay=0)
+
+    def tearDown(self) -> None:
+        self.recorder.close()
+        self.assertFalse(os.path.exists(self.recorder.staging_path))
+        self.directory.cleanup()
+
+    def write_playlist(self, name: str, playlist: str) -> None:
+        os.makedirs(self.recorder.get_stream_path(name), exist_ok=True)
+        with open(os.path.join(self.recorder.get_stream_path(name), 'index.m3u8'), 'w') as f:
+            f.write(playlist)
+
+    def test_get_latest_segments(self):
+        self.write_playlist('Anna', PLAYLIST)
+        stream_path = self.recorder.get_stream_path('anna')
+
+        self.assertSequenceEqual(self.recorder.get_latest_segments('Anna', 4.5),
+                                 [os.path.join(stream_path, 'segment_000006.ts'),
+                                  os.path.join(stream_path, 'segment_000007.ts')])
+        self.assertEqual(len(self.recorder.get_latest_segments('Anna', 8.5)), 4)
+
+    def test_get_latest_segments_ring_not_warm(self):
+        self.write_playlist('Anna', PLAYLIST)
+        self.assertIsNone(self.recorder.get_latest_segments('Anna', 10))
+        self.assertIsNone(self.recorder.get_latest_segments('Bella', 10))
+
+    def test_get_record_args(self):
+        args = self.recorder.get_record_args('Anna', 'rtmp://edge/cams/anna/anna__720p')
+        stream_path = self.recorder.get_stream_path('anna')
+        self.assertEqual(args[args.index('-i') + 1], 'rtmp://edge/cams/anna/anna__720p')
+        self.assertEqual(args[args.index('-hls_list_size') + 1], '7')
+        self.assertEqual(args[-1], os.path.join(stream_path, 'index.m3u8'))
+
+    def test_get_cut_input_args(self):
+        self.assertSequenceEqual(SegmentRecorder.get_cut_input_args(['/a/1.ts', '/a/2.ts']),
+                                 ['-i', 'concat:/a/1.ts|/a/2.ts'])
+
+    async def test_record_restarts_exited_ffmpeg(self):
+        exited = ProcessResult(returncode=1, timed_out=False, wall_time=0, user_time=0, system_time=0, max_rss=0)
+        timed_out = exited._replace(returncode=-9, timed_out=True)
+        self.supervisor.run = asynctest.CoroutineMock(side_effect=[exited, Exception('boom'), timed_out])
+
+        with mock.patch('tasks.recorder.time') as time_mock:
+            time_mock.monotonic.side_effect = [0, 1, 1, 2, 2, 3, 3, 100]
+            await self.recorder.record('Anna', 'rtmp://edge', duration=10)
+
+        self.assertEqual(self.supervisor.run.call_count, 3)
+        self.assertEqual(self.supervisor.run.call_args_list[0][0][1], 9)
+        self.assertTrue(os.path.isdir(self.recorder.get_stream_path('anna')))
@@ -0,0 +1,184 @@
+import os
+import tempfile
+import unittest
+from typing import Dict, List, Optional
+from unittest import mock
+
+import asynctest
+
+import tasks.tasks as module
+from common.cams.objects import ChatTypeEnum, StreamSession, StreamSessions
+from tasks.scheduler import SchedulerState, StreamRecord
+
+
+def session(stream_name: str, chat_type: ChatTypeEnum = ChatTypeEnum.FREE) -> StreamSession:
+    return StreamSession(stream_name=stream_name, subdomain='edge1.cams.test', chat_type=chat_type)
+
+
+class TestSchedulePreviewVideos(unittest.TestCase):
+    """`schedule_preview_videos` against a fake Cams API, dispatched tasks are recorded instead of sent."""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.state_path = os.path.join(self.directory.name, 'state', 'scheduler.json')
+        self.won = []
+        self.sessions = {}
+        patches = [
+            mock.patch.object(module, 'config', PREVIEW_VIDEO_STORAGE_PATH=os.path.join(self.directory.name, 'mp4'),
+                              PREVIEW_VIDEO_SCHEDULER_STATE_PATH=self.state_path,
+                              PREVIEW_SNAPSHOT_FORMATS=[], PREVIEW_SNAPSHOT_WIDTHS=[],
+                              PREVIEW_VIDEO_SCHEDULE_PERIOD=5, PREVIEW_VIDEO_CAPTURE_RATE=2,
+                              PREVIEW_VIDEO_TASK_CHUNK_SIZE=3, PREVIEW_VIDEO_MIN_AGE=300,
+                              PREVIEW_VIDEO_RETIRE_DEPARTED=True,
+                              PREVIEW_VIDEO_STREAM_FETCH_CONCURRENCY=10),
+            mock.patch.object(module, 'cams_api', mock.Mock(get_won=lambda: StreamSessions(self.won))),
+            mock.patch.object(module, 'acams_api', mock.Mock(get_streams=asynctest.CoroutineMock(
+                side_effect=lambda stream_names, concurrency: {name: self.sessions[name] for name in stream_names
+                                                               if name in self.sessions}))),
+            mock.patch.object(module.celery_app, 'producer_or_acquire'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.directory.cleanup)
+
+        self.make_preview_videos = mock.Mock()
+        patch = mock.patch.object(module, 'make_preview_videos', self.make_preview_videos)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def schedule(self) -> List[dict]:
+        self.make_preview_videos.apply_async.reset_mock()
+        module.schedule_preview_videos()
+        return [call[1] for call in self.make_preview_videos.apply_async.call_args_list]
+
+    def publish(self, stream_name: str, mtime: Optional[float] = None) -> None:
+        file_path = module._get_preview_video_file_path(stream_name, f'preview_video_1_{stream_name}.mp4')
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w'):
+            pass
+        module._replace_symlink(file_path, module._get_preview_video_symlink_file_path(stream_name))
+        if mtime is not None:
+            os.utime(module._get_preview_video_symlink_file_path(stream_name), (mtime, mtime), follow_symlinks=False)
+
+    @staticmethod
+    def dispatched(calls: List[dict]) -> Dict[str, List[str]]:
+        return {
+            'stream_names': [name for call in calls for name in call['kwargs']['stream_names']],
+            'streams': [name for call in calls for name in call['kwargs']['streams']],
+        }
+
+    def test_budget_chunks_and_countdowns(self):
+        self.won = [f'stream{i:02}' for i in range(12)]
+        self.sessions = {name: session(name) for name in self.won}
+        self.sessions['stream01'] = None  # offline
+        del self.sessions['stream02']  # could not be fetched, the worker asks Cams again
+        self.sessions['stream03'] = session('stream03', ChatTypeEnum.ELSE)  # private show
+
+        calls = self.schedule()
+
+        # 5 seconds at 2 captures per second, 3 streams per task, one chunk every 1.5 seconds
+        self.assertEqual([call['countdown'] for call in calls], [0, 1.5, 3])
+        self.assertTrue(all(call['ignore_result'] for call in calls))
+        self.assertEqual([call['kwargs']['stream_names'] for call in calls], [['stream02'], [], []])
+        self.assertEqual([list(call['kwargs']['streams']) for call in calls],
+                         [['stream00', 'stream04'], ['stream05', 'stream06', 'stream07'], ['stream08', 'stream09']])
+        self.assertEqual(calls[0]['kwargs']['streams']['stream00'], session('stream00').to_dict())
+        producer = module.celery_app.producer_or_acquire.return_value.__enter__.return_value
+        self.assertTrue(all(call['producer'] is producer for call in calls))
+
+    def test_dispatched_streams_wait_for_retry(self):
+        self.won = [f'stream{i:02}' for i in range(12)]
+        self.sessions = {name: session(name) for name in self.won}
+
+        first = self.dispatched(self.schedule())
+        self.assertEqual(first['streams'], self.won[:10])
+
+        # the first captures had no time to publish or fail yet, only the streams left over are dispatched
+        second = self.dispatched(self.schedule())
+        self.assertEqual(second['streams'], self.won[10:])
+        self.assertEqual(self.dispatched(self.schedule())['streams'], [])
+
+    def test_fresh_previews_are_not_dispatched(self):
+        self.won = ['anna', 'bella', 'carla']
+        self.sessions = {name: session(name) for name in self.won}
+        self.publish('anna')
+        self.publish('bella', mtime=1)
+
+        self.assertEqual(self.dispatched(self.schedule())['streams'], ['carla', 'bella'])
+
+    def test_saves_state(self):
+        self.won = ['anna', 'bella', 'carla']
+        self.sessions = {name: session(name) for name in self.won}
+        self.publish('anna')
+
+        self.schedule()
+
+        state = SchedulerState.load(self.state_path)
+        self.assertEqual(state.won, self.won)
+        self.assertEqual(set(state.dispatched_at), {'bella', 'carla'})
+        self.assertEqual(state.dispatched_at['bella'], state.dispatched_at['carla'])
+        self.assertEqual(set(state.streams), {'anna', 'bella', 'carla'})
+        self.assertEqual(state.streams['anna'].file,
+                         os.readlink(module._get_preview_video_symlink_file_path('anna')))
+
+    def test_skipped_while_another_run_holds_the_state(self):
+        self.won = ['anna']
+        self.sessions = {'anna': session('anna')}
+
+        with SchedulerState.lock(self.state_path):
+            self.assertEqual(self.schedule(), [])
+        self.assertFalse(os.path.exists(self.state_path))
+
+        self.assertEqual(self.dispatched(self.schedule())['streams'], ['anna'])
+
+    def test_first_run_without_previous_won(self):
+        self.publish('dora', mtime=1)  # published by an earlier deployment, not online anymore
+        self.won = [f'stream{i:02}' for i in range(12)]
+        self.sessions = {name: session(name) for name in self.won}
+
+        self.schedule()
+
+        # nothing to diff against: no stream joined, none left
+        self.assertTrue(os.path.lexists(module._get_preview_video_symlink_file_path('dora')))
+        self.assertEqual(SchedulerState.load(self.state_path).won, self.won)
+
+    def test_joined_streams_come_first_and_left_ones_are_retired(self):
+        self.won = [f'stream{i:02}' for i in range(12)]
+        self.sessions = {name: session(name) for name in self.won + ['zoe']}
+        self.publish('stream00', mtime=1)
+        self.schedule()
+
+        # zoe sorts after stream11 by name, but just came online
+        self.won = self.won[1:] + ['zoe']
+        self.assertEqual(self.dispatched(self.schedule())['streams'], ['zoe', 'stream11'])
+        self.assertFalse(os.path.lexists(module._get_preview_video_symlink_file_path('stream00')))
+
+    def test_forgets_streams_which_left(self):
+        self.won = ['anna', 'bella']
+        self.sessions = {name: session(name) for name in self.won}
+        self.schedule()
+
+        self.won = ['bella', 'carla']
+        self.schedule()
+
+        state = SchedulerState.load(self.state_path)
+        self.assertEqual(set(state.dispatched_at), {'bella', 'carla'})
+        self.assertEqual(set(state.streams), {'bella', 'carla'})
+
+    def test_stream_records_survive_save_and_load(self):
+        self.won = ['anna', 'bella']
+        self.sessions = {name: session(name) for name in self.won}
+        self.schedule()
+        dispatched_at = SchedulerState.load(self.state_path).dispatched_at
+
+        # anna's capture published, bella's is still in flight
+        self.publish('anna', mtime=dispatched_at['anna'] + 1)
+        with mock.patch.object(module.config, 'PREVIEW_VIDEO_MIN_AGE', 0):
+            self.schedule()
+
+        records = SchedulerState.load(self.state_path).streams
+        self.assertEqual(records['anna'].outcome, StreamRecord.PUBLISHED)
+        self.assertEqual(records['anna'].published_at, dispatched_at['anna'] + 1)
+        self.assertEqual(records['anna'].file, os.readlink(module._get_preview_video_symlink_file_path('anna')))
+        self.assertEqual(records['bella'].outcome, StreamRecord.FAILED)
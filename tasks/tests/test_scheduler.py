@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import ujson
+
+from tasks.scheduler import SchedulerBusyError, SchedulerState, StreamRecord, select_stale, spread
+
+NOW = 10000
+
+
+class TestSelectStale(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.published_at = {'anna': NOW - 100, 'bella': NOW - 1000, 'carla': NOW - 600, 'dora': NOW - 10}
+
+    def select(self, state: SchedulerState, budget: int = 10, first=()):
+        return select_stale(['anna', 'bella', 'carla', 'dora', 'emma'], lambda name: self.published_at.get(name, 0),
+                            state, NOW, min_age=60, retry_after=300, budget=budget, first=first)
+
+    def test_stalest_first(self):
+        self.assertSequenceEqual(self.select(SchedulerState()), ['emma', 'bella', 'carla', 'anna'])
+
+    def test_budget(self):
+        self.assertSequenceEqual(self.select(SchedulerState(), budget=2), ['emma', 'bella'])
+        self.assertSequenceEqual(self.select(SchedulerState(), budget=0), [])
+
+    def test_first(self):
+        self.assertSequenceEqual(self.select(SchedulerState(), budget=2), ['emma', 'bella'])
+        self.assertSequenceEqual(self.select(SchedulerState(), budget=2, first={'anna', 'dora'}), ['anna', 'emma'])
+
+    def test_fresh_records_are_not_looked_up(self):
+        state = SchedulerState(streams={'emma': StreamRecord(published_at=NOW - 10, file=None, outcome=None)})
+        published_at = mock.Mock(side_effect=lambda name: self.published_at.get(name, 0))
+
+        selected = select_stale(['bella', 'emma'], published_at, state, NOW, min_age=60, retry_after=300, budget=10)
+        self.assertSequenceEqual(selected, ['bella'])
+        published_at.assert_called_once_with('bella')
+
+    def test_recently_dispatched_are_skipped(self):
+        state = SchedulerState(dispatched_at={'emma': NOW - 100, 'bella': NOW - 400})
+        self.assertSequenceEqual(self.select(state), ['bella', 'carla', 'anna'])
+
+
+class TestSpread(unittest.TestCase):
+
+    def test_spread(self):
+        names = [str(i) for i in range(5)]
+        self.assertSequenceEqual(spread(names, chunk_size=2, rate=0.5),
+                                 [(['0', '1'], 0), (['2', '3'], 4), (['4'], 8)])
+        self.assertSequenceEqual(spread([], chunk_size=2, rate=0.5), [])
+
+
+class TestSchedulerState(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.directory.name, 'state', 'scheduler.json')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_save_and_load(self):
+        record = StreamRecord(published_at=1, file='anna/preview.mp4', outcome=StreamRecord.PUBLISHED)
+        state = SchedulerState(dispatched_at={'anna': 1.5}, won=['anna', 'bella'], streams={'anna': record})
+        state.save(self.file_path)
+
+        state = SchedulerState.load(self.file_path)
+        self.assertEqual(state.dispatched_at, {'anna': 1.5})
+        self.assertEqual(state.won, ['anna', 'bella'])
+        self.assertEqual(state.streams, {'anna': record})
+        self.assertEqual(os.listdir(os.path.dirname(self.file_path)), ['scheduler.json'])
+
+    def test_lock(self):
+        with SchedulerState.lock(self.file_path):
+            with self.assertRaises(SchedulerBusyError):
+                with SchedulerState.lock(self.file_path):
+                    pass
+        with SchedulerState.lock(self.file_path):
+            pass
+
+    def test_load_missing_or_broken(self):
+        self.assertEqual(SchedulerState.load(self.file_path).dispatched_at, {})
+
+        os.makedirs(os.path.dirname(self.file_path))
+        with open(self.file_path, 'w') as f:
+            f.write('{"dispatched_at": ')
+        self.assertEqual(SchedulerState.load(self.file_path).dispatched_at, {})
+
+    def test_load_without_streams(self):
+        SchedulerState(dispatched_at={'anna': 1.5}).save(self.file_path)
+        with open(self.file_path) as f:
+            data = ujson.load(f)
+        del data['won'], data['streams']
+        with open(self.file_path, 'w') as f:
+            ujson.dump(data, f)
+
+        state = SchedulerState.load(self.file_path)
+        self.assertEqual((state.dispatched_at, state.won, state.streams), ({'anna': 1.5}, [], {}))
+
+    def test_forget_missing(self):
+        record = StreamRecord(published_at=1, file=None, outcome=None)
+        state = SchedulerState(dispatched_at={'anna': 1, 'bella': 2}, streams={'anna': record, 'bella': record})
+        state.forget_missing(['bella', 'carla'])
+        self.assertEqual(state.dispatched_at, {'bella': 2})
+        self.assertEqual(list(state.streams), ['bella'])
+
+    def test_observe(self):
+        state = SchedulerState(dispatched_at={'anna': NOW - 100, 'bella': NOW - 100, 'carla': NOW - 1000})
+        state.observe('anna', NOW - 50, 'anna/2.mp4', NOW, retry_after=300)
+        state.observe('bella', NOW - 500, 'bella/1.mp4', NOW, retry_after=300)
+        state.observe('carla', 0, None, NOW, retry_after=300)
+        state.observe('dora', 0, None, NOW, retry_after=300)
+
+        self.assertEqual({name: record.outcome for name, record in state.streams.items()}, {
+            'anna': StreamRecord.PUBLISHED,
+            'bella': StreamRecord.PENDING,
+            'carla': StreamRecord.FAILED,
+            'dora': None,
+        })
+        self.assertEqual(state.streams['anna'].file, 'anna/2.mp4')
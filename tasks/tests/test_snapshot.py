@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+from PIL import Image
+
+from tasks.snapshot import SnapshotTarget, get_distance, get_fingerprint, save_snapshots
+
+
+class TestSaveSnapshots(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.poster_file_path = self.path('poster.png')
+        Image.new('RGB', (1280, 720), color=(200, 10, 10)).save(self.poster_file_path)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory.name, name)
+
+    def test_formats_and_widths(self):
+        targets = [
+            SnapshotTarget(file_path=self.path('320.jpg'), width=320, extension='jpg'),
+            SnapshotTarget(file_path=self.path('640.jpg'), width=640, extension='jpg'),
+            SnapshotTarget(file_path=self.path('640.webp'), width=640, extension='webp'),
+        ]
+        save_snapshots(self.poster_file_path, targets, quality=80)
+
+        for target, (size, image_format) in zip(targets, [((320, 180), 'JPEG'),
+                                                          ((640, 360), 'JPEG'),
+                                                          ((640, 360), 'WEBP')]):
+            with Image.open(target.file_path) as image:
+                self.assertEqual(image.size, size)
+                self.assertEqual(image.format, image_format)
+
+    def test_does_not_upscale(self):
+        target = SnapshotTarget(file_path=self.path('1920.jpg'), width=1920, extension='jpg')
+        save_snapshots(self.poster_file_path, [target], quality=80)
+
+        with Image.open(target.file_path) as image:
+            self.assertEqual(image.size, (1280, 720))
+
+    def test_unknown_format(self):
+        with self.assertRaises(KeyError):
+            save_snapshots(self.poster_file_path, [SnapshotTarget(self.path('320.gif'), 320, 'gif')], quality=80)
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def save(self, image: Image.Image, name: str, **kwargs) -> str:
+        file_path = os.path.join(self.directory.name, name)
+        image.save(file_path, **kwargs)
+        return file_path
+
+    def test_distance(self):
+        # dark to bright, left to right
+        gradient = Image.linear_gradient('L').rotate(90).resize((1280, 720)).convert('RGB')
+        poster = self.save(gradient, 'poster.png')
+        snapshot = self.save(gradient.resize((320, 180)), 'snapshot.jpg', quality=60)
+        other = self.save(gradient.transpose(Image.FLIP_LEFT_RIGHT), 'other.png')
+
+        self.assertLessEqual(get_distance(get_fingerprint(poster), get_fingerprint(snapshot)), 4)
+        self.assertGreater(get_distance(get_fingerprint(poster), get_fingerprint(other)), 32)
+
+    def test_get_distance(self):
+        self.assertEqual(get_distance(0b1011, 0b0010), 2)
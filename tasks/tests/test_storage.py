@@ -0,0 +1,227 @@
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import tasks.tasks as module
+from tasks.manifest import ExpiryManifest
+
+
+class TestPreviewVideoStorage(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage_path = os.path.join(self.directory.name, 'mp4')
+        self.config_patch = mock.patch.object(module, 'config', PREVIEW_VIDEO_STORAGE_PATH=self.storage_path,
+                                              PREVIEW_SNAPSHOT_FORMATS=[], PREVIEW_SNAPSHOT_WIDTHS=[],
+                                              PREVIEW_VIDEO_EXPIRE_PERIOD=100, PREVIEW_VIDEO_MIN_AGE=300)
+        self.config_patch.start()
+        self.manifest_patch = mock.patch.object(module, 'manifest',
+                                                ExpiryManifest(os.path.join(self.directory.name, 'manifest'), 3600))
+        self.manifest_patch.start()
+
+    def tearDown(self) -> None:
+        self.config_patch.stop()
+        self.manifest_patch.stop()
+        self.directory.cleanup()
+
+    def touch(self, path: str, mtime: float = None) -> str:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w'):
+            pass
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+        return path
+
+    def test_cleanup_touches_only_own_directory(self):
+        old = self.touch(module._get_preview_video_file_path('Anna', 'preview_video_1_Anna.mp4'))
+        new = self.touch(module._get_preview_video_file_path('Anna', 'preview_video_2_Anna.mp4'))
+        other = self.touch(module._get_preview_video_file_path('Annabelle', 'preview_video_1_Annabelle.mp4'))
+        legacy = self.touch(os.path.join(self.storage_path, 'preview_video_0_Anna.mp4'))
+
+        module._cleanup_preview_videos('Anna', ['preview_video_2_Anna.mp4'])
+
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+        self.assertTrue(os.path.exists(other))
+        self.assertTrue(os.path.exists(legacy))
+
+    def test_replace_symlink_from_threads(self):
+        targets = [self.touch(module._get_preview_video_file_path('Anna', f'preview_video_{i}_Anna.mp4'))
+                   for i in range(8)]
+        symlink_file_path = module._get_preview_video_symlink_file_path('Anna')
+
+        with ThreadPoolExecutor(len(targets)) as executor:
+            for future in [executor.submit(module._replace_symlink, target, symlink_file_path)
+                           for target in targets * 20]:
+                future.result()
+
+        self.assertIn(os.readlink(symlink_file_path), targets)
+        self.assertFalse([name for name in os.listdir(os.path.dirname(symlink_file_path)) if name.endswith('.tmp')])
+
+    def test_cleanup_expired_files(self):
+        now = time.time()
+        expired = self.touch(module._get_preview_video_file_path('Anna', 'preview_video_1_Anna.mp4'), now - 200)
+        module._replace_symlink(expired, module._get_preview_video_symlink_file_path('Anna'))
+        fresh = self.touch(module._get_preview_video_file_path('Bella', 'preview_video_1_Bella.mp4'), now)
+        legacy = self.touch(os.path.join(self.storage_path, 'preview_video_0_Carla.mp4'), now - 200)
+
+        module._cleanup_expired_files(self.storage_path, now)
+
+        self.assertFalse(os.path.lexists(module._get_preview_video_symlink_file_path('Anna')))
+        self.assertFalse(os.path.exists(os.path.dirname(expired)))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertFalse(os.path.exists(legacy))
+
+    def test_remove_expired_file(self):
+        expired = self.touch(module._get_preview_video_file_path('Anna', 'preview_video_1_Anna.mp4'))
+        module._replace_symlink(expired, module._get_preview_video_symlink_file_path('Anna'))
+        os.utime(module._get_preview_video_symlink_file_path('Anna'), (0, 0), follow_symlinks=False)
+        replaced = self.touch(module._get_preview_video_file_path('Bella', 'preview_video_1_Bella.mp4'))
+        published = self.touch(module._get_preview_video_file_path('Bella', 'preview_video_2_Bella.mp4'))
+        module._replace_symlink(published, module._get_preview_video_symlink_file_path('Bella'))
+
+        module._remove_expired_file(expired)
+        module._remove_expired_file(replaced)
+        module._remove_expired_file(replaced)
+
+        self.assertFalse(os.path.lexists(module._get_preview_video_symlink_file_path('Anna')))
+        self.assertFalse(os.path.exists(module._get_preview_video_directory('Anna')))
+        self.assertFalse(os.path.exists(replaced))
+        self.assertEqual(os.path.realpath(module._get_preview_video_symlink_file_path('Bella')), published)
+
+    def test_remove_expired_file_still_published(self):
+        # a static stream keeps its old preview, deduplication touches the symlink
+        published = self.touch(module._get_preview_video_file_path('Anna', 'preview_video_1_Anna.mp4'), 0)
+        module._replace_symlink(published, module._get_preview_video_symlink_file_path('Anna'))
+
+        module._remove_expired_file(published)
+
+        self.assertTrue(os.path.exists(published))
+        self.assertEqual(module.manifest.expire(-3600, lambda file_path: None), 1)
+
+    def test_remove_expired_file_replaced_meanwhile(self):
+        symlink_file_path = module._get_preview_video_symlink_file_path('Anna')
+        expired = self.touch(module._get_preview_video_file_path('Anna', 'preview_video_1_Anna.mp4'))
+        published = self.touch(module._get_preview_video_file_path('Anna', 'preview_video_2_Anna.mp4'))
+        module._replace_symlink(expired, symlink_file_path)
+
+        def publish(*_) -> bool:
+            module._replace_symlink(published, symlink_file_path)
+            return True
+
+        # a capture publishes between the first look at the symlink and taking it down
+        with mock.patch.object(module, '_is_preview_video_expired', side_effect=publish):
+            module._remove_expired_file(expired)
+
+        self.assertFalse(os.path.exists(expired))
+        self.assertEqual(os.readlink(symlink_file_path), published)
+
+    def test_remove_expired_file_retired_meanwhile(self):
+        symlink_file_path = module._get_preview_video_symlink_file_path('Anna')
+        expired = self.touch(module._get_preview_video_file_path('Anna', 'preview_video_1_Anna.mp4'))
+        module._replace_symlink(expired, symlink_file_path)
+
+        def retire(*_) -> bool:
+            os.unlink(symlink_file_path)
+            return True
+
+        with mock.patch.object(module, '_is_preview_video_expired', side_effect=retire):
+            module._remove_expired_file(expired)
+
+        self.assertFalse(os.path.exists(module._get_preview_video_directory('Anna')))
+
+    def test_retire_published_preview(self):
+        video = self.touch(module._get_preview_video_file_path('Anna', 'preview_video_1_Anna.mp4'))
+        module._replace_symlink(video, module._get_preview_video_symlink_file_path('Anna'))
+
+        module._retire_published_preview('Anna')
+        module._retire_published_preview('Bella')
+
+        self.assertFalse(os.path.lexists(module._get_preview_video_symlink_file_path('Anna')))
+        self.assertTrue(os.path.exists(video))  # removed when it expires
+
+    def test_retire_keeps_preview_published_after_going_offline(self):
+        video = self.touch(module._get_preview_video_file_path('Anna', 'preview_video_1_Anna.mp4'))
+        module._replace_symlink(video, module._get_preview_video_symlink_file_path('Anna'))
+        published_at = os.lstat(module._get_preview_video_symlink_file_path('Anna')).st_mtime
+
+        module._retire_published_preview('Anna', went_offline_at=published_at - 10)
+        self.assertTrue(os.path.lexists(module._get_preview_video_symlink_file_path('Anna')))
+
+        module._retire_published_preview('Anna', went_offline_at=published_at + 10)
+        self.assertFalse(os.path.lexists(module._get_preview_video_symlink_file_path('Anna')))
+
+    def test_observe_published_preview(self):
+        state = module.SchedulerState(dispatched_at={'Anna': 0})
+        video = self.touch(module._get_preview_video_file_path('Anna', 'preview_video_1_Anna.mp4'))
+        module._replace_symlink(video, module._get_preview_video_symlink_file_path('Anna'))
+
+        get_published_at = module._observe_published_preview(state, time.time())
+        self.assertGreater(get_published_at('Anna'), 0)
+        self.assertEqual(get_published_at('Bella'), 0)
+        self.assertEqual(state.streams['Anna'].file, video)
+        self.assertEqual(state.streams['Anna'].outcome, module.StreamRecord.PUBLISHED)
+        self.assertIsNone(state.streams['Bella'].file)
+
+    def test_shards(self):
+        self.assertEqual(module._get_preview_video_symlink_file_path('Anna'),
+                         os.path.join(self.storage_path, 'a7', '0f', 'anna.mp4'))
+        self.assertEqual(module._get_preview_video_file_path('Anna', 'preview_video_1_Anna.mp4'),
+                         os.path.join(self.storage_path, 'a7', '0f', 'anna', 'preview_video_1_Anna.mp4'))
+
+    def test_migrate_flat_symlinks(self):
+        flat = self.touch(os.path.join(self.storage_path, 'preview_video_1_Anna.mp4'))
+        module._replace_symlink(flat, os.path.join(self.storage_path, 'anna.mp4'))
+        # Bella was published into the shard after the deploy, its flat symlink is stale
+        stale = self.touch(os.path.join(self.storage_path, 'preview_video_1_Bella.mp4'))
+        module._replace_symlink(stale, os.path.join(self.storage_path, 'bella.mp4'))
+        published = self.touch(module._get_preview_video_file_path('Bella', 'preview_video_2_Bella.mp4'))
+        module._replace_symlink(published, module._get_preview_video_symlink_file_path('Bella'))
+
+        self.assertEqual(module._migrate_flat_symlinks(self.storage_path), 1)
+
+        self.assertEqual(os.path.realpath(module._get_preview_video_symlink_file_path('Anna')),
+                         module._get_preview_video_file_path('Anna', 'preview_video_1_Anna.mp4'))
+        self.assertEqual(os.path.realpath(module._get_preview_video_symlink_file_path('Bella')), published)
+        self.assertFalse(os.path.lexists(os.path.join(self.storage_path, 'anna.mp4')))
+        self.assertFalse(os.path.lexists(os.path.join(self.storage_path, 'bella.mp4')))
+        self.assertTrue(os.path.exists(stale))
+
+    @mock.patch.object(module, '_publish_preview_snapshots')
+    @mock.patch.object(module, 'get_distance', return_value=0)
+    @mock.patch.object(module, 'get_fingerprint')
+    @mock.patch.object(module, '_is_blurry', return_value=False)
+    @mock.patch.object(module, '_is_preview_video_size_valid', return_value=True)
+    @mock.patch.object(module, '_probe_preview_video')
+    def test_publish_dedupes_unchanged_preview(self, *_):
+        now = time.time()
+        symlink_file_path = module._get_preview_video_symlink_file_path('Anna')
+        published = self.touch(module._get_preview_video_file_path('Anna', 'preview_video_1_Anna.mp4'), now - 100)
+        module._replace_symlink(published, symlink_file_path)
+        os.utime(symlink_file_path, (0, 0), follow_symlinks=False)
+
+        def publish(preview_video_name: str) -> None:
+            self.touch(module._get_preview_video_file_path('Anna', preview_video_name))
+            poster = self.touch(os.path.join(self.directory.name, 'poster.png'))
+            module._publish_preview_video_file('Anna', preview_video_name, mock.Mock(), poster)
+
+        with mock.patch.object(module.config, 'PREVIEW_SNAPSHOT_FORMATS', ['jpg']), \
+                mock.patch.object(module.config, 'PREVIEW_SNAPSHOT_WIDTHS', [320]), \
+                mock.patch.object(module.config, 'PREVIEW_SNAPSHOT_STORAGE_PATH',
+                                  os.path.join(self.directory.name, 'snapshots')), \
+                mock.patch.object(module.config, 'PREVIEW_VIDEO_DEDUPE_MAX_DISTANCE', 4), \
+                mock.patch.object(module.config, 'PREVIEW_VIDEO_DEDUPE_MAX_AGE', 1000):
+            # the same picture: the published preview is confirmed, the capture is dropped
+            publish('preview_video_2_Anna.mp4')
+            self.assertEqual(os.path.realpath(symlink_file_path), published)
+            self.assertGreaterEqual(os.lstat(symlink_file_path).st_mtime, now)
+            self.assertEqual(os.listdir(os.path.dirname(published)), ['preview_video_1_Anna.mp4'])
+
+            # confirmed for too long: republished even though it looks the same
+            os.utime(published, (now - 1001, now - 1001))
+            publish('preview_video_3_Anna.mp4')
+            self.assertEqual(os.path.realpath(symlink_file_path),
+                             module._get_preview_video_file_path('Anna', 'preview_video_3_Anna.mp4'))
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import sys
+import time
+
+import asynctest
+
+from tasks.supervisor import ProcessSupervisor
+
+SPAWN_GRANDCHILD = '''
+import subprocess, sys, time
+child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+print(child.pid, flush=True)
+time.sleep(30)
+'''
+
+
+def is_alive(pid: int, wait: float = 1) -> bool:
+    """SIGKILL is delivered asynchronously, give the process a moment to die."""
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                state = f.read().rsplit(')', 1)[1].split()[0]
+        except FileNotFoundError:
+            return False
+        if state in ('Z', 'X'):
+            return False
+        if time.monotonic() > deadline:
+            return True
+        time.sleep(0.01)
+
+
+class TestProcessSupervisor(asynctest.TestCase):
+
+    def setUp(self) -> None:
+        self.supervisor = ProcessSupervisor(poll_interval=0.01)
+
+    async def test_run_records_exit_status_and_rusage(self):
+        result = await self.supervisor.run([sys.executable, '-c', 'sum(range(10 ** 6)); exit(2)'], timeout=10)
+        self.assertEqual(result.returncode, 2)
+        self.assertFalse(result.timed_out)
+        self.assertGreater(result.user_time + result.system_time, 0)
+        self.assertGreater(result.max_rss, 0)
+        self.assertGreater(result.wall_time, 0)
+
+    async def test_run_passes_output_lines(self):
+        lines = []
+        result = await self.supervisor.run([sys.executable, '-c', 'print("a=1"); print("b=2")'], timeout=10,
+                                           on_output=lines.append)
+        self.assertEqual(result.returncode, 0)
+        self.assertSequenceEqual(lines, ['a=1\n', 'b=2\n'])
+
+    async def test_run_kills_process_group_on_timeout(self):
+        lines = []
+        result = await self.supervisor.run([sys.executable, '-c', SPAWN_GRANDCHILD], timeout=0.5,
+                                           on_output=lines.append)
+        self.assertTrue(result.timed_out)
+        self.assertEqual(result.returncode, -9)
+        self.assertFalse(is_alive(int(lines[0])))
+
+    async def test_run_kills_process_group_on_cancel(self):
+        lines = []
+        task = asyncio.ensure_future(self.supervisor.run([sys.executable, '-c', SPAWN_GRANDCHILD], timeout=10,
+                                                         on_output=lines.append))
+        while not lines:
+            await asyncio.sleep(0.01)
+
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        self.assertFalse(is_alive(int(lines[0])))
+
+    async def test_kill_all(self):
+        lines = []
+        task = asyncio.ensure_future(self.supervisor.run([sys.executable, '-c', SPAWN_GRANDCHILD], timeout=10,
+                                                         on_output=lines.append))
+        while not lines:
+            await asyncio.sleep(0.01)
+
+        self.supervisor.kill_all()
+        result = await task
+        self.assertEqual(result.returncode, -9)
+        self.assertFalse(result.timed_out)
+        self.assertFalse(is_alive(int(lines[0])))
+
+    async def test_missing_executable(self):
+        with self.assertRaises(FileNotFoundError):
+            await self.supervisor.run([os.path.join(os.sep, 'no', 'such', 'ffmpeg')], timeout=1)